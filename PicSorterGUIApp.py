@@ -13,7 +13,6 @@ if getattr(sys, 'frozen', False):
 from tkinter import filedialog, messagebox
 from PIL import ImageTk, Image
 from tkinterdnd2 import *
-import shutil
 import threading
 
 from lib.PicSorterGUILogger import setup_logging, get_logger
@@ -22,9 +21,9 @@ logger = get_logger(__name__)
 
 from PicSorterGUILogic import (
     load_config, save_config, ImageDataManager, PicController,
-    calculate_file_hash, VectorBatchProcessor,
+    calculate_file_hash, move_file, VectorBatchProcessor,
     open_visual_sort_window, get_vector_data_info,
-    clear_vectors, clear_analysis_cache, check_model_cached
+    check_model_cached, VectorStore, HashIndex
 )
 from lib.PicSorterGUILib import GetKoFolder, GetGazoFiles
 from lib.PicSorterGUIState import get_app_state
@@ -33,6 +32,8 @@ from lib.config_defaults import (
 )
 from lib.PicSorterGUIWidgets import SplashWindow, ModelSelectDialog, AutoSortDialog
 from lib.PicSorterGUIAI import VectorEngine, apply_model_cache_dir
+from lib.PicSorterGUIThumbnailStore import ThumbnailStore
+from lib.PicSorterGUIImageCache import ImageCache
 
 # --- アプリケーション状態の初期化 ---
 app_state = get_app_state()
@@ -75,14 +76,8 @@ def open_model_select_dialog():
     def on_model_selected(new_key):
         old_key = app_state.ai_model
         if new_key != old_key:
-            if messagebox.askyesno("確認",
-                    "モデルを変更すると既存のベクトルデータと分析キャッシュがリセットされます。\n\nよろしいですか？"):
-                clear_vectors()
-                clear_analysis_cache()
-                VectorEngine.reset_instance()
-                logger.info(f"AIモデル変更: {old_key} -> {new_key}")
-            else:
-                return
+            # ベクトルはモデルごとに別の格納先に保存されているため、削除は不要
+            logger.info(f"AIモデル変更: {old_key} -> {new_key}")
 
         # 設定を保存
         app_state.ai_model = new_key
@@ -91,6 +86,9 @@ def open_model_select_dialog():
         save_config(cfg["last_folder"], cfg.get("geometries", {}), cfg["settings"])
         app_state.from_dict(cfg)
 
+        # 保存済みのカスタムモデル設定を反映してから格納先を切り替える
+        VectorStore.get_instance(new_key)
+
         # VectorEngine をリセットして新モデルで初期化準備
         VectorEngine.reset_instance()
 
@@ -166,6 +164,8 @@ def refresh_ui(new_path):
 koRoot.title("PicSorterGUI")
 
 # 実体生成
+VectorStore.get_instance(app_state.ai_model).start_auto_flush()
+VectorStore.get_instance().start_neighbour_updates()
 data_manager = ImageDataManager(DEFOLDER)
 pic_controller = PicController(koRoot, DEFOLDER)
 
@@ -177,7 +177,7 @@ def execute_move(file_path, dest_folder, refresh=True):
         return
     try:
         filename = os.path.basename(file_path)
-        shutil.move(file_path, os.path.join(dest_folder, filename))
+        move_file(file_path, os.path.join(dest_folder, filename))
         logger.info(f"ファイル移動成功: {filename} -> {dest_folder}")
         if refresh:
             refresh_ui(DEFOLDER)
@@ -207,6 +207,14 @@ def on_closing_main():
     except Exception as e:
         logger.error(f"終了処理エラー: {e}", exc_info=True)
 
+    try:
+        VectorStore.get_instance().close()
+        HashIndex.get_instance().close()
+        ImageCache.get_instance().shutdown()
+        ThumbnailStore.get_instance().close()
+    except Exception as e:
+        logger.error(f"ベクトルデータ保存エラー: {e}", exc_info=True)
+
     koRoot.destroy()
     sys.exit()
 
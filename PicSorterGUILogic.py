@@ -18,13 +18,14 @@ class RECT(ctypes.Structure):
 
 from lib.PicSorterGUILib import GetKoFolder, GetGazoFiles
 from lib.PicSorterGUIData import (
-    load_config, save_config, calculate_file_hash,
-    load_vectors, save_vectors, ImageDataManager,
-    get_vector_data_info, load_analysis_cache, save_analysis_cache,
-    clear_vectors, clear_analysis_cache
+    load_config, save_config, calculate_file_hash, iter_file_hashes, move_file, rename_file,
+    load_vectors, save_vectors, VectorStore, HashIndex, ImageDataManager,
+    get_vector_data_info, load_analysis_cache, load_unchanged_analysis, save_analysis_cache,
+    directory_digests, clear_vectors, clear_analysis_cache
 )
 from lib.PicSorterGUIAI import VectorEngine, VectorBatchProcessor, check_model_cached, download_model
 from lib.PicSorterGUIState import get_app_state
+from lib.PicSorterGUIImageCache import ImageCache
 
 from lib.PicSorterGUILogger import LoggerManager
 logger = LoggerManager.get_logger(__name__)
@@ -102,7 +103,7 @@ def open_visual_sort_window(target_path, app_state, move_callback, refresh_callb
                                  move_callback(f, dest_root)
                                  success_count += 1
                          else:
-                             shutil.move(f, os.path.join(dest_root, os.path.basename(f)))
+                             move_file(f, os.path.join(dest_root, os.path.basename(f)))
                              success_count += 1
                 except Exception as e:
                      logger.error(f"Move error: {e}")
@@ -158,7 +159,7 @@ class PicController():
         self.open_windows = {}
         self.folder_win = None
         self.file_win = None
-        self.vectors_cache = load_vectors()
+        self.vectors_cache = VectorStore.get_instance()
 
         self._move_callback = None
         self._refresh_callback = None
@@ -243,9 +244,8 @@ class PicController():
                     new_w = int(new_w * scale)
                     new_h = app_state.image_max_height
 
-                img_resized = img.resize((new_w, new_h), Image.LANCZOS)
-                tkimg = ImageTk.PhotoImage(img_resized)
-                del img_resized
+                # 同じ画像を同じ大きさで開き直すときはデコードも縮小もしない
+                tkimg = ImageTk.PhotoImage(ImageCache.get_instance().get(fullName, (new_w, new_h)))
 
             # 表示位置の計算
             try:
@@ -8,14 +8,23 @@ import os
 import threading
 import sys
 import itertools
+import numpy as np
 from collections import OrderedDict
 from .PicSorterGUIExceptions import AIModelError, ImageLoadError, VectorProcessingError
 from .PicSorterGUILogger import LoggerManager
 import time
-from lib.PicSorterGUIData import load_vectors, save_vectors, calculate_file_hash
+from lib.PicSorterGUIData import VectorStore, iter_file_hashes
 from lib.PicSorterGUILib import GetGazoFiles
-from lib.PicSorterGUIExceptions import FileHashError
-from lib.config_defaults import AI_MODELS, DEFAULT_AI_MODEL
+from lib.PicSorterGUIImageCache import open_image_reduced
+from lib.PicSorterGUIThumbnailStore import ThumbnailStore
+from lib.PicSorterGUIFeaturePipeline import FeaturePipeline
+from lib.PicSorterGUISimilarity import (
+    normalize_rows, build_candidate_matrix, similarity_scores, rank_by_similarity,
+)
+from lib.config_defaults import (
+    AI_MODELS, DEFAULT_AI_MODEL,
+    AI_INFERENCE_BATCH_SIZE, AI_AUTO_BATCH_SIZE_CPU, AI_AUTO_BATCH_SIZE_GPU,
+)
 
 
 logger = LoggerManager.get_logger(__name__)
@@ -321,6 +330,34 @@ class VectorEngine:
             "max_size": self.cache_size
         }
 
+    def load_tensor(self, image_path, thumbnail_key=None):
+        """画像を読み込み、モデル入力用のテンソルへ前処理する（推論スレッド以外から呼んでよい）
+
+        前処理のリサイズ（短辺合わせ）を下回らない範囲で縮小しながらデコードする。
+        thumbnail_key（内容ハッシュ）を渡すと、デコードした画像からサムネイルも保存する。
+        """
+        resize_size = getattr(self.preprocess, "resize_size", None)
+        if resize_size:
+            side = resize_size[0]
+            img = open_image_reduced(image_path, (side, side), fit="cover")
+        else:
+            img = Image.open(image_path)
+        img = img.convert("RGB")
+        if thumbnail_key:
+            try:
+                ThumbnailStore.get_instance().add_from_image(thumbnail_key, img)
+            except Exception as e:
+                logger.warning(f"サムネイル保存失敗: {image_path} - {e}")
+        return self.preprocess(img)
+
+    def infer_tensors(self, tensors):
+        """前処理済みテンソルをまとめて推論し、正規化したベクトルの float32 行列（行 = 画像）を返す"""
+        input_batch = torch.stack(tensors).to(self.device)
+        with torch.no_grad():
+            outputs = self.model(input_batch)
+        outputs = torch.nn.functional.normalize(outputs, p=2, dim=1)
+        return np.ascontiguousarray(outputs.cpu().numpy(), dtype=np.float32)
+
     def get_image_feature(self, image_path):
         if not self.available:
             raise AIModelError("AI model is not available")
@@ -330,25 +367,9 @@ class VectorEngine:
             return cached_vec
 
         try:
-            image = Image.open(image_path).convert("RGB")
-
-            input_tensor = self.preprocess(image)
-            input_batch = input_tensor.unsqueeze(0).to(self.device)
-
-            with torch.no_grad():
-                output = self.model(input_batch)
-
-            feature_vector = output[0]
-
-            norm = feature_vector.norm(p=2)
-            if norm > 0:
-                feature_vector = feature_vector / norm
-
-            vec_list = feature_vector.tolist()
-
-            self._add_to_cache(image_path, vec_list)
-
-            return vec_list
+            vec = self.infer_tensors([self.load_tensor(image_path)])[0]
+            self._add_to_cache(image_path, vec)
+            return vec
 
         except FileNotFoundError as e:
             raise ImageLoadError(f"Image file not found: {image_path}") from e
@@ -358,7 +379,14 @@ class VectorEngine:
             logger.error(f"ベクトル化処理中にエラー: {os.path.basename(image_path)}", exc_info=True)
             raise VectorProcessingError(f"Failed to vectorize image: {e}") from e
 
-    def get_image_features_batch(self, image_paths):
+    def get_batch_size(self):
+        """1回の推論でまとめる画像数（AI_INFERENCE_BATCH_SIZE が 0 ならデバイスに合わせて決める）"""
+        if AI_INFERENCE_BATCH_SIZE > 0:
+            return AI_INFERENCE_BATCH_SIZE
+        return AI_AUTO_BATCH_SIZE_GPU if self.device.type == "cuda" else AI_AUTO_BATCH_SIZE_CPU
+
+    def get_image_features_batch(self, image_paths, batch_size=None):
+        """複数画像をまとめてベクトル化する。戻り値は成功した画像の (パス, ベクトル) のリスト"""
         if not self.available:
             raise AIModelError("AI model is not available")
 
@@ -366,46 +394,37 @@ class VectorEngine:
             return []
 
         results = []
-        batch_size = 8
+        batch_size = batch_size or self.get_batch_size()
 
         try:
-            logger.info(f"バッチ処理開始: {len(image_paths)}個の画像")
+            logger.debug(f"バッチ処理開始: {len(image_paths)}個の画像")
 
             for batch_start in range(0, len(image_paths), batch_size):
-                batch_end = min(batch_start + batch_size, len(image_paths))
-                batch_paths = image_paths[batch_start:batch_end]
+                batch_paths = image_paths[batch_start:batch_start + batch_size]
 
-                images = []
+                tensors = []
                 valid_paths = []
 
                 for path in batch_paths:
+                    cached_vec = self._get_from_cache(path)
+                    if cached_vec is not None:
+                        results.append((path, cached_vec))
+                        continue
                     try:
-                        image = Image.open(path).convert("RGB")
-                        images.append(image)
+                        tensors.append(self.load_tensor(path))
                         valid_paths.append(path)
                     except Exception as e:
                         logger.warning(f"画像読み込み失敗（スキップ）: {path} - {e}")
                         continue
 
-                if not images:
+                if not tensors:
                     continue
 
-                input_tensors = [self.preprocess(img) for img in images]
-                input_batch = torch.stack(input_tensors).to(self.device)
+                for path, vec in zip(valid_paths, self.infer_tensors(tensors)):
+                    self._add_to_cache(path, vec)
+                    results.append((path, vec))
 
-                with torch.no_grad():
-                    outputs = self.model(input_batch)
-
-                for i, (path, output) in enumerate(zip(valid_paths, outputs)):
-                    feature_vector = output
-                    norm = feature_vector.norm(p=2)
-                    if norm > 0:
-                        feature_vector = feature_vector / norm
-
-                    vec_list = feature_vector.tolist()
-                    results.append((path, vec_list))
-
-            logger.info(f"バッチ処理完了: {len(results)}個のベクトルを生成")
+            logger.debug(f"バッチ処理完了: {len(results)}個のベクトルを生成")
             return results
 
         except Exception as e:
@@ -414,43 +433,28 @@ class VectorEngine:
 
     def compare_features(self, vec1, vec2):
         try:
-            if not vec1 or not vec2:
+            if vec1 is None or vec2 is None or len(vec1) == 0 or len(vec2) == 0:
                 raise VectorProcessingError("Cannot compare empty vectors")
+            if len(vec1) != len(vec2):
+                raise VectorProcessingError(f"Vector dimension mismatch: {len(vec1)} != {len(vec2)}")
 
-            t1 = torch.tensor(vec1)
-            t2 = torch.tensor(vec2)
-            score = torch.nn.functional.cosine_similarity(t1.unsqueeze(0), t2.unsqueeze(0)).item()
-
-            return score
+            return float(similarity_scores(vec1, normalize_rows(vec2))[0])
         except VectorProcessingError:
             raise
         except Exception as e:
             logger.error(f"ベクトル比較中にエラー: {e}", exc_info=True)
             raise VectorProcessingError(f"Failed to compare features: {e}") from e
 
-    def compare_features_batch(self, query_vec, candidate_vecs, threshold=0.5):
+    def compare_features_batch(self, query_vec, candidate_vecs, threshold=0.5, top_k=None):
         try:
-            if not query_vec or not candidate_vecs:
+            if query_vec is None or len(query_vec) == 0 or len(candidate_vecs) == 0:
                 return []
 
-            t_query = torch.tensor(query_vec)
-            t_candidates = torch.stack([torch.tensor(v) for v in candidate_vecs])
-
-            scores = torch.nn.functional.cosine_similarity(
-                t_query.unsqueeze(0),
-                t_candidates
-            )
-
-            matches = []
-            for idx, score in enumerate(scores):
-                score_val = score.item()
-                if score_val >= threshold:
-                    matches.append((idx, score_val))
-
-            matches.sort(key=lambda x: x[1], reverse=True)
-
-            return matches
+            candidates = build_candidate_matrix(candidate_vecs)
+            return rank_by_similarity(query_vec, candidates, threshold=threshold, k=top_k)
 
+        except VectorProcessingError:
+            raise
         except Exception as e:
             logger.error(f"バッチ比較処理中にエラー: {e}", exc_info=True)
             raise VectorProcessingError(f"Failed to batch compare features: {e}") from e
@@ -479,69 +483,63 @@ class VectorBatchProcessor(threading.Thread):
             files = GetGazoFiles(all_items, self.folder_path)
             total = len(files)
 
-            try:
-                vectors = load_vectors()
-            except VectorProcessingError:
-                vectors = {}
+            # 途中でモデルが切り替わっても、開始時のモデルの格納先にだけ書き込む
+            vectors = VectorStore.get_instance().bind(engine.model_key)
 
             updated_count = 0
             failed_count = 0
+            timed_out = False
 
             logger.info(f"ベクトル更新開始: {total}ファイルをチェック")
 
             start_time = time.time()
             last_log_time = start_time
 
-            for i, filename in enumerate(files):
-                if not self.running:
-                    logger.info("ベクトル化処理が中止されました")
-                    break
+            paths = [os.path.join(self.folder_path, f) for f in files]
+            pipeline = FeaturePipeline(engine, vectors, should_stop=lambda: not self.running)
+            items = ((file_hash, path) for path, file_hash in iter_file_hashes(paths))
 
+            for i, (file_hash, full_path, vec, is_new) in enumerate(pipeline.run(items)):
                 current_time = time.time()
                 elapsed = current_time - start_time
                 if elapsed > 600:
                     logger.warning("ベクトル化処理がタイムアウト (10分経過)")
-                    if self.callback_finish:
-                        self.callback_finish("タイムアウトにより停止しました")
+                    timed_out = True
                     break
 
                 if current_time - last_log_time >= 60:
                     logger.info(f"ベクトル化処理中... {i}/{total} ({int(elapsed)}秒経過)")
                     last_log_time = current_time
 
-                full_path = os.path.join(self.folder_path, filename)
-
-                try:
-                    file_hash = calculate_file_hash(full_path)
-                except FileHashError:
-                    logger.warning(f"ハッシュ計算失敗: {filename}")
+                filename = os.path.basename(full_path)
+                if vec is None:
+                    reason = "ハッシュ計算失敗" if file_hash is None else "ベクトル化失敗"
+                    logger.warning(f"{reason}: {filename}")
                     failed_count += 1
-                    continue
-
-                if file_hash and file_hash not in vectors:
-                    try:
-                        vec = engine.get_image_feature(full_path)
-                        if vec:
-                            vectors[file_hash] = vec
-                            updated_count += 1
-                    except Exception as e:
-                        logger.warning(f"ベクトル化失敗: {filename} - {e}")
-                        failed_count += 1
+                elif is_new:
+                    updated_count += 1
 
                 if self.callback_progress:
                     self.callback_progress(i + 1, total, filename)
 
-                time.sleep(0.01)
+            if not self.running:
+                logger.info("ベクトル化処理が中止されました")
 
             try:
                 if updated_count > 0:
-                    save_vectors(vectors)
+                    vectors.flush()
             except VectorProcessingError as e:
                 logger.error(f"ベクトルデータ保存失敗: {e}")
                 if self.callback_finish:
                     self.callback_finish(f"ベクトル保存エラー: {e}")
                 return
 
+            if timed_out:
+                # 計算済みのベクトルは保存したうえで、完了通知は 1 回だけにする
+                if self.callback_finish:
+                    self.callback_finish("タイムアウトにより停止しました")
+                return
+
             if self.callback_finish:
                 message = f"完了！ {updated_count}件のベクトルを新規追加しました。"
                 if failed_count > 0:
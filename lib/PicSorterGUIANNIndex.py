@@ -0,0 +1,192 @@
+'''
+PicSorterGUI 近似最近傍（ANN）索引
+
+ベクトルストアの行を球面 k-means のクラスタ（リスト）に振り分けておく IVF 索引。
+検索時はクエリに近い nprobe 個のリストの行だけを厳密に採点するため、
+全行を走査するより速い（nprobe を増やすほど取りこぼしが減り、遅くなる）。
+
+索引はベクトルストアの隣に ``<格納先>.ivf`` として保存する。
+ストアへ追記された行は次の同期で最寄りのリストへ追加し、コンパクションなどで
+行番号が変わった場合はキーで対応付け直すため、全体の作り直しは件数が大きく
+増えたときだけ行う。
+'''
+import os
+import threading
+import numpy as np
+
+from lib.PicSorterGUILogger import LoggerManager
+from lib.PicSorterGUISimilarity import normalize_rows
+from lib.config_defaults import (
+    ANN_KMEANS_ITERATIONS, ANN_TRAIN_PER_LIST, ANN_RETRAIN_FACTOR, ANN_NPROBE,
+)
+
+logger = LoggerManager.get_logger(__name__)
+
+# 行の振り分けで 1 回の行列積にまとめる行数
+ASSIGN_CHUNK_ROWS = 16384
+
+
+def _list_count(n):
+    """行数に応じたリスト数（おおよそ √n）"""
+    return int(min(1024, max(16, round(np.sqrt(n)))))
+
+
+def _assign(matrix, centroids, start=0, stop=None):
+    """matrix[start:stop] の各行を最も類似度の高い重心の番号に振り分ける"""
+    stop = len(matrix) if stop is None else stop
+    out = np.empty(stop - start, dtype=np.int32)
+    for s in range(start, stop, ASSIGN_CHUNK_ROWS):
+        e = min(s + ASSIGN_CHUNK_ROWS, stop)
+        out[s - start:e - start] = np.argmax(normalize_rows(matrix[s:e]) @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(matrix, n_lists, iterations=ANN_KMEANS_ITERATIONS, seed=0):
+    """正規化済み行列の標本から球面 k-means で n_lists 個の重心を求める"""
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    sample_size = min(n, n_lists * ANN_TRAIN_PER_LIST)
+    sample = normalize_rows(matrix[np.sort(rng.choice(n, sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=n_lists)
+        # 空になったリストは標本からランダムに選び直す
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """ベクトルストア 1 つ分の IVF 索引"""
+
+    def __init__(self, path):
+        self.path = path
+        self.centroids = None
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.keys = None
+        self.trained_rows = 0
+        self._lists = None
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._load()
+
+    # ==================== 保存 / 読み込み ====================
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                self.centroids = data["centroids"]
+                self.assign = data["assign"]
+                self.keys = data["keys"]
+                self.trained_rows = int(data["trained_rows"])
+            if len(self.assign) != len(self.keys):
+                raise ValueError("assign/keys length mismatch")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"ANN索引を読み込めません（作り直します）: {e}")
+            self.centroids = None
+            self.assign = np.zeros(0, dtype=np.int32)
+            self.keys = None
+
+    def save(self):
+        """変更があれば索引ファイルを書き出す"""
+        with self._lock:
+            if not self._dirty or self.centroids is None:
+                return False
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.savez(f, centroids=self.centroids, assign=self.assign, keys=self.keys,
+                             trained_rows=np.int64(self.trained_rows))
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.error(f"ANN索引の保存に失敗しました: {e}")
+                return False
+            self._dirty = False
+            return True
+
+    def clear(self):
+        with self._lock:
+            self.centroids = None
+            self.assign = np.zeros(0, dtype=np.int32)
+            self.keys = None
+            self._lists = None
+            self._dirty = False
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    # ==================== 同期 ====================
+
+    def sync(self, keys, matrix):
+        """ストアの保存済み行（keys, matrix）に索引を合わせる。戻り値は索引の行数"""
+        with self._lock:
+            n = len(keys)
+            if n == 0:
+                return 0
+            if (self.centroids is None or self.centroids.shape[1] != matrix.shape[1]
+                    or n > self.trained_rows * ANN_RETRAIN_FACTOR):
+                self._build(keys, matrix)
+                return n
+
+            known = 0 if self.keys is None else len(self.keys)
+            if known == n and np.array_equal(self.keys, keys):
+                return n
+            if known <= n and np.array_equal(self.keys, keys[:known]):
+                # 末尾に追記された行だけを振り分ける
+                added = _assign(matrix, self.centroids, known, n)
+                self.assign = np.concatenate([self.assign, added])
+            else:
+                # 行番号が変わった（コンパクション等）ので、キーで振り分けを引き継ぐ
+                previous = dict(zip(self.keys.tolist(), self.assign.tolist()))
+                assign = np.fromiter((previous.get(k, -1) for k in keys.tolist()),
+                                     dtype=np.int32, count=n)
+                missing = np.flatnonzero(assign < 0)
+                if len(missing):
+                    assign[missing] = np.argmax(normalize_rows(matrix[missing]) @ self.centroids.T, axis=1)
+                self.assign = assign
+            self.keys = np.array(keys)
+            self._lists = None
+            self._dirty = True
+            return n
+
+    def _build(self, keys, matrix):
+        n_lists = min(_list_count(len(keys)), len(keys))
+        logger.info(f"ANN索引を作成します: {len(keys)}行 / {n_lists}リスト")
+        self.centroids = train_centroids(matrix, n_lists)
+        self.assign = _assign(matrix, self.centroids)
+        self.keys = np.array(keys)
+        self.trained_rows = len(keys)
+        self._lists = None
+        self._dirty = True
+
+    def _posting_lists(self):
+        """リストごとの行番号（行番号順に並べた配列と各リストの開始位置）"""
+        if self._lists is None:
+            order = np.argsort(self.assign, kind="stable").astype(np.int32)
+            bounds = np.searchsorted(self.assign[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, bounds)
+        return self._lists
+
+    # ==================== 検索 ====================
+
+    def search(self, matrix, query, k, nprobe=ANN_NPROBE):
+        """クエリに近い行を最大 k 件、(行番号の配列, 類似度の配列) で類似度の降順に返す"""
+        with self._lock:
+            if self.centroids is None:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            q = normalize_rows(query)[0]
+            order, bounds = self._posting_lists()
+            nprobe = min(nprobe, len(self.centroids))
+            probe = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+            rows = np.sort(np.concatenate([order[bounds[c]:bounds[c + 1]] for c in probe]))
+        scores = normalize_rows(matrix[rows]) @ q if len(rows) else np.zeros(0, dtype=np.float32)
+        if k is not None and len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        desc = np.argsort(-scores, kind="stable")
+        return rows[desc], scores[desc]
@@ -0,0 +1,252 @@
+'''
+PicSorterGUI 分析結果キャッシュ
+
+VisualSort の分析結果（候補のファイルのキーと類似度）をキャッシュキーごとに
+1 ファイルずつ ``<格納先>/<キャッシュキーのハッシュ>.npz`` として保存する。
+読み書きは該当するエントリのファイルだけを触る。
+
+エントリには結果としてファイルの内容ハッシュと float16 の類似度を持つ。
+あわせて、分析したファイル集合の指紋と、採点済みの全候補キーのダイジェスト（64bit）を
+持つので、ファイルが一部入れ替わっても増えた分だけを採点し直せる。
+さらに分析したフォルダごとの中身のダイジェストと (パス, キー) の一覧も持ち、フォルダが変わっていなければ
+ハッシュを計算し直さずに結果を使える。
+合計サイズが上限を超えたら、最後に使われた時刻（ファイルの更新時刻）が古い
+エントリから削除する。各エントリのサイズと使用順は起動時に 1 度だけ走査してメモリに持ち、
+以降の保存・参照で更新するので、保存のたびにフォルダを走査しない。
+'''
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from lib.PicSorterGUILogger import LoggerManager
+from lib.PicSorterGUIVectorStore import KEY_SIZE
+from lib.config_defaults import ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_FILE, ANALYSIS_CACHE_MAX_BYTES
+
+logger = LoggerManager.get_logger(__name__)
+
+ENTRY_SUFFIX = ".npz"
+
+
+def key_digests(keys):
+    """ファイルのキー列を 64bit ダイジェストの配列にする（候補集合の照合用）"""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(k.encode("ascii"), digest_size=8).digest(), "little")
+         for k in keys),
+        dtype=np.uint64, count=len(keys))
+
+
+def files_fingerprint(hashed):
+    """(パス, キー) の列から、ファイル集合の指紋（16 進文字列）を作る
+
+    パスとキーの組を並べてダイジェストするため、ファイルの追加・削除・名前変更・
+    内容の変更のどれでも指紋が変わる。キーはハッシュ索引から stat だけで引ける。
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for path, key in sorted((os.path.normcase(p), k or "") for p, k in hashed):
+        h.update(f"{path}\0{key}\n".encode("utf-8", "surrogatepass"))
+    return h.hexdigest()
+
+
+def _pack_paths(paths):
+    """パスの列を NUL 区切りの UTF-8 バイト列（uint8 配列）にする
+
+    np.array(dtype=str) は最長のパスに合わせた固定長の UTF-32 になり大きいため使わない。
+    """
+    blob = "\0".join(paths).encode("utf-8", "surrogatepass")
+    return np.frombuffer(blob, dtype=np.uint8)
+
+
+def _unpack_paths(packed, count):
+    """_pack_paths() の逆（count は元の件数。空のパス列と区別するため）"""
+    if count == 0:
+        return []
+    return packed.tobytes().decode("utf-8", "surrogatepass").split("\0")
+
+
+def _entry_name(cache_key):
+    return hashlib.blake2b(cache_key.encode("utf-8"), digest_size=16).hexdigest() + ENTRY_SUFFIX
+
+
+class AnalysisCache:
+    """サイズ上限付きの分析結果キャッシュ（シングルトン）"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def reset_instance(cls):
+        with cls._lock:
+            cls._instance = None
+
+    def __init__(self, path=ANALYSIS_CACHE_DIR, max_bytes=ANALYSIS_CACHE_MAX_BYTES,
+                 legacy_path=ANALYSIS_CACHE_FILE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file_lock = threading.Lock()
+        self._entries = OrderedDict()  # エントリのパス -> サイズ（使われたのが古い順）
+        self._total = 0
+        self._scan()
+        if legacy_path and os.path.exists(legacy_path):
+            # 旧形式は全エントリを 1 つの JSON に持ち、上限も無いので引き継がずに削除する
+            try:
+                os.remove(legacy_path)
+                logger.info(f"旧形式の分析キャッシュを削除しました: {legacy_path}")
+            except OSError as e:
+                logger.warning(f"旧形式の分析キャッシュを削除できません: {e}")
+
+    def _entry_path(self, cache_key):
+        return os.path.join(self.path, _entry_name(cache_key))
+
+    def _scan(self):
+        """既存エントリのサイズと更新時刻から、使用順の台帳を作る"""
+        if not os.path.isdir(self.path):
+            return
+        found = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(ENTRY_SUFFIX):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                found.append((st.st_mtime_ns, entry.path, st.st_size))
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self._total += size
+
+    def _touch(self, path, size=None):
+        """台帳でエントリを最後に使われたものにする（size を渡せばサイズも更新する）"""
+        with self._file_lock:
+            if size is not None:
+                self._total += size - self._entries.pop(path, 0)
+                self._entries[path] = size
+            elif path in self._entries:
+                self._entries.move_to_end(path)
+
+    # ==================== 参照 / 保存 ====================
+
+    def get(self, cache_key):
+        """エントリを辞書で返す。無ければ None
+
+        keys / scores: 上位の候補のキーと類似度（降順）
+        fingerprint: 分析したファイル集合の指紋
+        candidates: 採点済みの全候補キーのダイジェスト（key_digests() の値、昇順）
+        dirs: 分析したフォルダの {パス: ダイジェスト}（保存していなければ空）
+        files: 分析した (パス, キー) のリスト（保存していなければ空）
+        """
+        path = self._entry_path(cache_key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if str(data["cache_key"]) != cache_key:
+                    return None
+                entry = {
+                    "keys": [k.decode("ascii") for k in data["keys"].tolist()],
+                    "scores": data["scores"].astype(np.float32),
+                    "fingerprint": str(data["fingerprint"]),
+                    "candidates": data["candidates"],
+                    "dirs": {},
+                    "files": [],
+                }
+                if "dir_digests" in data.files:
+                    dir_digests = [d.decode("ascii") for d in data["dir_digests"].tolist()]
+                    file_keys = [k.decode("ascii") for k in data["file_keys"].tolist()]
+                    entry["dirs"] = dict(zip(_unpack_paths(data["dir_paths"], len(dir_digests)),
+                                             dir_digests))
+                    entry["files"] = list(zip(_unpack_paths(data["file_paths"], len(file_keys)),
+                                              file_keys))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"分析キャッシュを読み込めません（破棄します）: {e}")
+            with self._file_lock:
+                self._remove(path)
+            return None
+        try:
+            os.utime(path)  # 次回起動時の使用順のため、更新時刻も進めておく
+        except OSError:
+            pass
+        self._touch(path)
+        return entry
+
+    def put(self, cache_key, keys, scores, fingerprint, candidates, dirs=None, files=None):
+        """エントリを書き込み、合計サイズが上限を超えていれば古いものから削除する
+
+        dirs（{パス: ダイジェスト}）と files（(パス, キー) の列）は get() でそのまま返す。
+        """
+        path = self._entry_path(cache_key)
+        dirs = dirs or {}
+        files = [(p, k) for p, k in (files or ()) if k is not None]
+        tmp_path = path + ".tmp"
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                np.savez_compressed(f, cache_key=np.str_(cache_key),
+                                    keys=np.array([k.encode("ascii") for k in keys], dtype=f"S{KEY_SIZE}"),
+                                    scores=np.asarray(scores, dtype=np.float16),
+                                    fingerprint=np.str_(fingerprint),
+                                    candidates=np.sort(key_digests(list(candidates))),
+                                    dir_paths=_pack_paths(dirs),
+                                    dir_digests=np.array([d.encode("ascii") for d in dirs.values()], dtype="S32"),
+                                    file_paths=_pack_paths([p for p, _ in files]),
+                                    file_keys=np.array([k.encode("ascii") for _, k in files], dtype=f"S{KEY_SIZE}"))
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.error(f"分析キャッシュの保存に失敗しました: {e}")
+            with self._file_lock:
+                self._remove(tmp_path)
+            return False
+        self._touch(path, size)
+        self._evict(keep=path)
+        return True
+
+    def _evict(self, keep=None):
+        """合計サイズが上限以下になるまで、最後に使われた時刻が古いエントリを削除する"""
+        with self._file_lock:
+            removed = 0
+            for path in list(self._entries):
+                if self._total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                if self._remove(path):
+                    removed += 1
+            if removed:
+                logger.info(f"分析キャッシュを{removed}件削除しました（上限 {self.max_bytes:,} バイト）")
+
+    def _remove(self, path):
+        """ファイルを削除して台帳から外す（_file_lock を持って呼ぶ）"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # 外部で削除済みなら台帳から外すだけ
+        except OSError:
+            return False
+        self._total -= self._entries.pop(path, 0)
+        return True
+
+    # ==================== 管理 ====================
+
+    def clear(self):
+        """全エントリを削除する"""
+        with self._file_lock:
+            if not os.path.isdir(self.path):
+                return
+            for entry in os.scandir(self.path):
+                if entry.name.endswith((ENTRY_SUFFIX, ".tmp")):
+                    self._remove(entry.path)
+            self._entries.clear()
+            self._total = 0
+
+    def info(self):
+        """(合計サイズ, エントリ数) を返す"""
+        with self._file_lock:
+            return self._total, len(self._entries)
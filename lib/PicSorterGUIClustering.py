@@ -0,0 +1,462 @@
+'''
+PicSorterGUI 類似画像のクラスタリング
+
+正規化済みベクトル行列（行 = 画像、処理順）に対して貪欲クラスタリングを行う。
+先頭から未割り当ての画像をシードとし、シードより後ろの未割り当て画像のうち
+類似度がしきい値以上のものを同じグループにまとめる。
+
+シードをブロック単位でまとめ、未割り当て列との類似度を 1 回の行列積で求める。
+ブロック内では前のシードの割り当てをマスクで反映するため、1 枚ずつ比較する場合と
+同じグループになる。
+
+しきい値を変えて再分析する場合に備え、下限以上の類似度の組だけを持つ疎グラフ
+（SimilarityGraph）を作っておけば、下限以上のしきい値での再クラスタリングは
+辺の絞り込みだけで済む。
+
+貪欲法のほか、連結成分・平均連結・密度ベースの手法を ClusteringEngine として
+切り替えられる（CLUSTERING_ENGINES / get_clustering_engine）。
+'''
+import time
+import numpy as np
+
+from lib.PicSorterGUISimilarity import normalize_rows
+from lib.config_defaults import (
+    CLUSTER_BLOCK_SIZE, CLUSTER_GRAPH_MAX_EDGES, CLUSTER_DENSITY_MIN_SAMPLES,
+    CLUSTER_AVERAGE_MAX_COMPONENT, CLUSTER_METHODS,
+)
+
+
+def greedy_cluster(matrix, threshold, block_size=CLUSTER_BLOCK_SIZE,
+                   should_stop=None, progress=None):
+    """貪欲クラスタリングを行い、(グループのリスト, 孤立した行のリスト) を返す
+
+    グループは行番号のリスト（先頭がシード、残りは行番号順）で、シード順に並ぶ。
+    progress はブロックごとに (処理済み数, グループ数, 孤立数) で呼ばれる。
+    should_stop が True を返したらその時点までの結果を返す。
+    """
+    matrix = normalize_rows(matrix) if len(matrix) else np.zeros((0, 0), dtype=np.float32)
+    n = matrix.shape[0]
+    assigned = np.zeros(n, dtype=bool)
+    groups = []
+    isolated = []
+    processed = 0
+    next_seed = 0
+
+    while next_seed < n:
+        if should_stop and should_stop():
+            break
+        free = np.flatnonzero(~assigned[next_seed:]) + next_seed
+        if len(free) == 0:
+            break
+        seeds = free[:block_size]
+        # シード自身を含む、最初のシード以降の未割り当て列とまとめて比較する。
+        # 未割り当てが多いうちは行のコピーを避けて連続部分をそのまま掛ける
+        if len(free) * 2 > n - next_seed:
+            scores = (matrix[seeds] @ matrix[next_seed:].T)[:, free - next_seed]
+        else:
+            scores = matrix[seeds] @ matrix[free].T
+
+        # しきい値以上の組をブロック全体で一度に取り出し、シードごとに区切る
+        hit_rows, hit_cols = np.nonzero(scores >= threshold)
+        bounds = np.searchsorted(hit_rows, np.arange(len(seeds) + 1))
+        for j, seed in enumerate(seeds):
+            if assigned[seed]:
+                continue
+            assigned[seed] = True
+            members = free[hit_cols[bounds[j]:bounds[j + 1]]]
+            members = members[(members > seed) & ~assigned[members]]
+            if len(members):
+                assigned[members] = True
+                groups.append([int(seed)] + members.tolist())
+                processed += 1 + len(members)
+            else:
+                isolated.append(int(seed))
+                processed += 1
+
+        next_seed = int(seeds[-1]) + 1
+        if progress:
+            progress(processed, len(groups), len(isolated))
+
+    return groups, isolated
+
+
+class SimilarityGraph:
+    """類似度が下限 floor 以上の画像の組（行番号 i < j）を類似度の降順に持つ疎グラフ
+
+    matrix には作成に使った正規化済みベクトル行列を保持する（平均連結などで使う）。
+    """
+
+    def __init__(self, n, rows, cols, scores, floor, matrix=None):
+        self.n = n
+        self.rows = rows
+        self.cols = cols
+        self.scores = scores
+        self.floor = floor
+        self.matrix = matrix
+
+    @classmethod
+    def build(cls, matrix, floor, keep_threshold=None, max_edges=CLUSTER_GRAPH_MAX_EDGES,
+              block_size=CLUSTER_BLOCK_SIZE, should_stop=None, progress=None):
+        """ベクトル行列から類似度グラフを作る。停止要求があれば None を返す
+
+        辺が max_edges を超えたら類似度の低い辺から捨てて下限を引き上げる。
+        ただし keep_threshold 以上の辺は上限に関係なく残す。
+        progress はブロックごとに (処理済み行数, 辺数) で呼ばれる。
+        """
+        matrix = normalize_rows(matrix) if len(matrix) else np.zeros((0, 0), dtype=np.float32)
+        n = matrix.shape[0]
+        keep_threshold = floor if keep_threshold is None else max(floor, keep_threshold)
+        parts = []
+        n_edges = 0
+
+        for start in range(0, n, block_size):
+            if should_stop and should_stop():
+                return None
+            stop = min(start + block_size, n)
+            scores = matrix[start:stop] @ matrix[start:].T
+            # 上三角（j > i）のうち下限以上の組だけを残す
+            upper = np.arange(start, n)[None, :] > np.arange(start, stop)[:, None]
+            r, c = np.nonzero((scores >= floor) & upper)
+            parts.append((r.astype(np.int32) + start, c.astype(np.int32) + start, scores[r, c]))
+            n_edges += len(r)
+            if n_edges > max_edges * 2:
+                parts, floor = cls._prune(parts, floor, keep_threshold, max_edges)
+                n_edges = len(parts[0][0])
+            if progress:
+                progress(stop, n_edges)
+
+        if n_edges > max_edges:
+            parts, floor = cls._prune(parts, floor, keep_threshold, max_edges)
+        rows, cols, scores = cls._concat(parts)
+        order = np.argsort(-scores, kind="stable")
+        return cls(n, rows[order], cols[order], scores[order], floor, matrix)
+
+    @staticmethod
+    def _concat(parts):
+        if not parts:
+            return (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+                    np.zeros(0, dtype=np.float32))
+        return tuple(np.concatenate([p[k] for p in parts]) for k in range(3))
+
+    @classmethod
+    def _prune(cls, parts, floor, keep_threshold, max_edges):
+        """類似度の高い max_edges 本（keep_threshold 以上は全て）だけを残し、新しい下限を返す"""
+        rows, cols, scores = cls._concat(parts)
+        if len(scores) > max_edges:
+            cut = np.partition(scores, len(scores) - max_edges - 1)[len(scores) - max_edges - 1]
+            # cut と同じ値の辺を一部だけ残さないよう、cut を超える値を下限にする
+            floor = min(max(floor, float(np.nextafter(cut, np.float32(np.inf)))), keep_threshold)
+            keep = scores >= floor
+            rows, cols, scores = rows[keep], cols[keep], scores[keep]
+        return [(rows, cols, scores)], floor
+
+    def __len__(self):
+        return len(self.scores)
+
+    def covers(self, threshold):
+        """このしきい値での再クラスタリングにグラフをそのまま使えるか"""
+        return threshold >= self.floor
+
+    def edges(self, threshold):
+        """類似度が threshold 以上の辺 (rows, cols, scores) を返す（降順の先頭部分のビュー）"""
+        k = int(np.searchsorted(-self.scores, -np.float32(threshold), side="right"))
+        return self.rows[:k], self.cols[:k], self.scores[:k]
+
+
+def greedy_cluster_graph(graph, threshold, active=None, should_stop=None, progress=None):
+    """類似度グラフ上で greedy_cluster と同じ貪欲クラスタリングを行う
+
+    active（行ごとの bool 配列）を渡すと False の行は無いものとして扱い、結果にも含めない。
+    戻り値と progress の呼び出し方は greedy_cluster と同じ。
+    """
+    n = graph.n
+    rows, cols, _ = graph.edges(threshold)
+    if active is not None:
+        keep = active[rows] & active[cols]
+        rows, cols = rows[keep], cols[keep]
+    # シード（行番号の小さい側）ごとに隣接する行をまとめる
+    order = np.lexsort((cols, rows))
+    rows, cols = rows[order], cols[order]
+    bounds = np.searchsorted(rows, np.arange(n + 1))
+
+    assigned = np.zeros(n, dtype=bool) if active is None else ~np.asarray(active, dtype=bool)
+    groups = []
+    isolated = []
+    processed = 0
+
+    for seed in range(n):
+        if assigned[seed]:
+            continue
+        if should_stop and should_stop():
+            break
+        assigned[seed] = True
+        members = cols[bounds[seed]:bounds[seed + 1]]
+        members = members[~assigned[members]]
+        if len(members):
+            assigned[members] = True
+            groups.append([seed] + members.tolist())
+            processed += 1 + len(members)
+        else:
+            isolated.append(seed)
+            processed += 1
+        if progress and (seed + 1) % CLUSTER_BLOCK_SIZE == 0:
+            progress(processed, len(groups), len(isolated))
+
+    if progress:
+        progress(processed, len(groups), len(isolated))
+    return groups, isolated
+
+
+# ==================== 手法の切り替え ====================
+
+def connected_components(n, rows, cols):
+    """辺 (rows, cols) でつながる成分ごとのラベル（成分内で最小の行番号）を返す"""
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[rows], labels[cols])
+        new = labels.copy()
+        np.minimum.at(new, rows, low)
+        np.minimum.at(new, cols, low)
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def _active_edges(graph, threshold, active):
+    rows, cols, scores = graph.edges(threshold)
+    if active is not None:
+        keep = active[rows] & active[cols]
+        rows, cols, scores = rows[keep], cols[keep], scores[keep]
+    return rows, cols, scores
+
+
+def _representative_first(matrix, members):
+    """グループ内の平均類似度が最も高い画像を先頭にし、残りを行番号順に並べる"""
+    members = sorted(members)
+    if matrix is None or len(members) < 3:
+        return members
+    sub = matrix[members]
+    rep = members[int(np.argmax(sub @ sub.sum(axis=0)))]
+    return [rep] + [m for m in members if m != rep]
+
+
+def _split_by_label(labels, nodes, matrix):
+    """nodes をラベルごとにまとめ、(グループのリスト, 孤立した行のリスト) を返す"""
+    nodes = np.asarray(nodes)
+    order = np.argsort(labels[nodes], kind="stable")
+    nodes = nodes[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(labels[nodes]) != 0])
+    groups = []
+    isolated = []
+    for members in np.split(nodes, starts[1:]) if len(nodes) else []:
+        if len(members) > 1:
+            groups.append(_representative_first(matrix, members.tolist()))
+        else:
+            isolated.append(int(members[0]))
+    groups.sort(key=lambda g: min(g))
+    return groups, sorted(isolated)
+
+
+def _average_linkage(sim, threshold):
+    """類似度行列 sim に平均連結法を行い、平均類似度が threshold 以上の間まとめたクラスタを返す
+
+    最近傍チェーン法で O(m^2)。平均連結は併合で類似度が上がらないため、
+    最も近い相手でもしきい値未満になったクラスタはそこで確定してよい。
+    """
+    m = len(sim)
+    sim = np.array(sim, dtype=np.float32)
+    np.fill_diagonal(sim, -np.inf)
+    size = np.ones(m)
+    alive = np.ones(m, dtype=bool)
+    members = [[i] for i in range(m)]
+    clusters = []
+    chain = []
+
+    while True:
+        if not chain:
+            rest = np.flatnonzero(alive)
+            if len(rest) == 0:
+                break
+            chain.append(int(rest[0]))
+        a = chain[-1]
+        b = int(np.argmax(sim[a]))
+        if len(chain) >= 2 and sim[a, chain[-2]] >= sim[a, b]:
+            b = chain[-2]
+        if not sim[a, b] >= threshold:
+            clusters.append(members[a])
+            alive[a] = False
+            sim[a, :] = -np.inf
+            sim[:, a] = -np.inf
+            chain.pop()
+            continue
+        if len(chain) >= 2 and b == chain[-2]:
+            chain.pop()
+            chain.pop()
+            merged = (size[a] * sim[a] + size[b] * sim[b]) / (size[a] + size[b])
+            sim[a, :] = merged
+            sim[:, a] = merged
+            sim[a, a] = -np.inf
+            sim[b, :] = -np.inf
+            sim[:, b] = -np.inf
+            alive[b] = False
+            size[a] += size[b]
+            members[a] += members[b]
+        else:
+            chain.append(b)
+    return clusters
+
+
+class ClusteringEngine:
+    """クラスタリング手法の基底クラス
+
+    cluster() は SimilarityGraph としきい値から (グループのリスト, 孤立した行のリスト) を返す。
+    グループは行番号のリストで、先頭がグループの代表（シード）になる。
+    active（行ごとの bool 配列）で False の行は無いものとして扱う。
+    """
+
+    key = None
+
+    @property
+    def name(self):
+        return CLUSTER_METHODS[self.key]["name"]
+
+    def cluster(self, graph, threshold, active=None, should_stop=None, progress=None):
+        raise NotImplementedError
+
+
+class GreedyClustering(ClusteringEngine):
+    """先頭から順にシードを取る貪欲法（画像の並び順で結果が変わる）"""
+
+    key = "greedy"
+
+    def cluster(self, graph, threshold, active=None, should_stop=None, progress=None):
+        return greedy_cluster_graph(graph, threshold, active, should_stop, progress)
+
+
+class ComponentClustering(ClusteringEngine):
+    """しきい値以上の辺でつながる画像をまとめる連結成分（単連結法と同じ）"""
+
+    key = "components"
+
+    def cluster(self, graph, threshold, active=None, should_stop=None, progress=None):
+        rows, cols, _ = _active_edges(graph, threshold, active)
+        labels = connected_components(graph.n, rows, cols)
+        nodes = np.arange(graph.n) if active is None else np.flatnonzero(active)
+        groups, isolated = _split_by_label(labels, nodes, graph.matrix)
+        if progress:
+            progress(len(nodes), len(groups), len(isolated))
+        return groups, isolated
+
+
+class AverageLinkageClustering(ClusteringEngine):
+    """平均連結法による凝集型クラスタリング
+
+    平均連結でまとまる画像は必ず同じ連結成分に入るため、成分ごとに類似度行列を作って処理する。
+    max_component を超える成分は行列が大きくなりすぎるため貪欲法で分ける。
+    """
+
+    key = "average"
+
+    def __init__(self, max_component=CLUSTER_AVERAGE_MAX_COMPONENT):
+        self.max_component = max_component
+
+    def cluster(self, graph, threshold, active=None, should_stop=None, progress=None):
+        rows, cols, _ = _active_edges(graph, threshold, active)
+        labels = connected_components(graph.n, rows, cols)
+        nodes = np.arange(graph.n) if active is None else np.flatnonzero(active)
+        components, isolated = _split_by_label(labels, nodes, None)
+        groups = []
+        processed = len(isolated)
+        for component in components:
+            if should_stop and should_stop():
+                break
+            sub = graph.matrix[component]
+            if len(component) > self.max_component:
+                local, local_isolated = greedy_cluster(sub, threshold)
+                local += [[i] for i in local_isolated]
+            else:
+                local = _average_linkage(sub @ sub.T, threshold)
+            for cluster in local:
+                cluster = [component[i] for i in cluster]
+                if len(cluster) > 1:
+                    groups.append(_representative_first(graph.matrix, cluster))
+                else:
+                    isolated.append(cluster[0])
+            processed += len(component)
+            if progress:
+                progress(processed, len(groups), len(isolated))
+        groups.sort(key=lambda g: min(g))
+        return groups, sorted(isolated)
+
+
+class DensityClustering(ClusteringEngine):
+    """密度ベース（DBSCAN 方式）のクラスタリング
+
+    しきい値以上の近傍が min_samples 以上（自身を含む）ある画像を中心とし、
+    中心同士のつながりでグループを作る。中心ではない画像は最も類似度の高い中心の
+    グループに入り、どの中心にも近くない画像は孤立になる。
+    """
+
+    key = "density"
+
+    def __init__(self, min_samples=CLUSTER_DENSITY_MIN_SAMPLES):
+        self.min_samples = min_samples
+
+    def cluster(self, graph, threshold, active=None, should_stop=None, progress=None):
+        n = graph.n
+        rows, cols, scores = _active_edges(graph, threshold, active)
+        degree = np.bincount(rows, minlength=n) + np.bincount(cols, minlength=n) + 1
+        core = degree >= self.min_samples
+        if active is not None:
+            core &= active
+
+        both = core[rows] & core[cols]
+        labels = connected_components(n, rows[both], cols[both])
+
+        # 中心と非中心を結ぶ辺から、非中心ごとに最も類似度の高い中心を選ぶ（辺は降順）
+        one = core[rows] != core[cols]
+        border = np.where(core[rows[one]], cols[one], rows[one])
+        anchor = np.where(core[rows[one]], rows[one], cols[one])
+        border, first = np.unique(border, return_index=True)
+        labels[border] = labels[anchor[first]]
+
+        # 近傍を全て他の中心に取られた中心は 1 枚だけになり、孤立として返る
+        nodes = np.r_[np.flatnonzero(core), border]
+        groups, isolated = _split_by_label(labels, nodes, graph.matrix)
+        noise = np.ones(n, dtype=bool) if active is None else np.asarray(active, dtype=bool).copy()
+        noise[nodes] = False
+        isolated = sorted(isolated + np.flatnonzero(noise).tolist())
+        if progress:
+            progress(sum(len(g) for g in groups) + len(isolated), len(groups), len(isolated))
+        return groups, isolated
+
+
+CLUSTERING_ENGINES = {
+    engine.key: engine
+    for engine in (GreedyClustering, ComponentClustering, AverageLinkageClustering, DensityClustering)
+}
+
+
+def get_clustering_engine(key):
+    """手法キーに対応する ClusteringEngine を返す（不明なキーは貪欲法）"""
+    return CLUSTERING_ENGINES.get(key, GreedyClustering)()
+
+
+def benchmark_clustering(graph, threshold, active=None, keys=None):
+    """同じグラフ・しきい値で各手法を実行し、手法ごとの所要時間と結果の概要を返す"""
+    results = []
+    for key in keys or CLUSTERING_ENGINES:
+        engine = get_clustering_engine(key)
+        start = time.perf_counter()
+        groups, isolated = engine.cluster(graph, threshold, active)
+        results.append({
+            "key": key,
+            "name": engine.name,
+            "seconds": time.perf_counter() - start,
+            "groups": len(groups),
+            "grouped": sum(len(g) for g in groups),
+            "isolated": len(isolated),
+            "largest": max((len(g) for g in groups), default=0),
+        })
+    return results
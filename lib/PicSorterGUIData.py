@@ -4,6 +4,11 @@ PicSorterGUI データアクセス層 (Config, Vectors)
 import os
 import json
 import hashlib
+import shutil
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from lib.PicSorterGUIExceptions import (
     ConfigError, FileHashError,
     VectorProcessingError, FileOperationError
@@ -11,8 +16,17 @@ from lib.PicSorterGUIExceptions import (
 from lib.PicSorterGUILogger import LoggerManager
 from lib.config_defaults import (
     get_default_config, MOVE_DESTINATION_SLOTS,
-    VECTOR_DATA_FILE, ANALYSIS_CACHE_FILE, CONFIG_FILE
+    VECTOR_DATA_FILE, VECTOR_STORE_DIR, VECTOR_STORE_BASE, CONFIG_FILE,
+    VECTOR_FLUSH_INTERVAL, VECTOR_PREPROCESS_VERSION, AI_MODELS, DEFAULT_AI_MODEL,
+    HASH_BUFFER_SIZE, HASH_MAX_WORKERS, FILE_HASH_MODE, FILE_HASH_SAMPLE_SIZE, KEY_PATH_MEMORY,
+    ANN_MIN_VECTORS, ANN_NPROBE, ANN_TOP_K, KNN_ROWS_PER_RUN, KNN_UPDATE_INTERVAL
 )
+from lib.PicSorterGUIVectorStore import VectorFile, migrate_json_vectors
+from lib.PicSorterGUIANNIndex import IVFIndex
+from lib.PicSorterGUIKNNGraph import NeighbourGraph
+from lib.PicSorterGUISimilarity import build_candidate_matrix, similarity_scores, select_top
+from lib.PicSorterGUIHashIndex import HashIndex
+from lib.PicSorterGUIAnalysisCache import AnalysisCache, files_fingerprint, key_digests
 
 logger = LoggerManager.get_logger(__name__)
 
@@ -66,13 +80,25 @@ def save_config(path, geometries=None, settings=None):
         raise ConfigError(f"Unexpected error saving config: {e}") from e
 
 
-def calculate_file_hash(filepath):
-    hash_md5 = hashlib.md5()
+def _digest_file(filepath, hasher, size=None):
+    # 大きなバッファへ直接読み込む（hashlib は更新中に GIL を解放するため並列化が効く）
+    buf = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buf)
     try:
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        with open(filepath, "rb", buffering=0) as f:
+            if size is None:
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    hasher.update(view[:n])
+            else:
+                # 先頭と末尾だけを読む（サンプリング指紋）
+                hasher.update(str(size).encode("ascii"))
+                hasher.update(f.read(FILE_HASH_SAMPLE_SIZE))
+                f.seek(-FILE_HASH_SAMPLE_SIZE, os.SEEK_END)
+                hasher.update(f.read(FILE_HASH_SAMPLE_SIZE))
+        return hasher.hexdigest()
     except FileNotFoundError as e:
         logger.error(f"ファイルが見つかりません: {filepath}", exc_info=True)
         raise FileHashError(f"File not found: {filepath}") from e
@@ -84,124 +110,837 @@ def calculate_file_hash(filepath):
         raise FileHashError(f"Unexpected error calculating hash: {e}") from e
 
 
-def load_vectors():
-    if os.path.exists(VECTOR_DATA_FILE):
+def _hash_file_contents(filepath, mode=FILE_HASH_MODE, size=None):
+    """FILE_HASH_MODE に従ってファイルのキーを計算する
+
+    md5     : 全体の MD5（旧形式、32桁の16進）
+    blake2b : 全体の BLAKE2b → "b:" + 30桁の16進
+    sampled : サイズ + 先頭・末尾の BLAKE2b → "s:" + 30桁の16進
+              （小さいファイルは全体を読むので blake2b と同じキーになる）
+    どの方式もキー長は 32 文字で、ベクトルストアのキー幅に収まる。
+    """
+    if mode == "md5":
+        return _digest_file(filepath, hashlib.md5())
+    if mode == "sampled":
+        if size is None:
+            size = os.path.getsize(filepath)
+        if size > FILE_HASH_SAMPLE_SIZE * 2:
+            return "s:" + _digest_file(filepath, hashlib.blake2b(digest_size=15), size)
+    return "b:" + _digest_file(filepath, hashlib.blake2b(digest_size=15))
+
+
+def legacy_file_hash(filepath):
+    """旧形式（MD5）のキーを返す。MD5 をキーにした既存データの参照・移行に使う"""
+    return _hash_file_contents(filepath, mode="md5")
+
+
+# キー → パス（直近に計算したもの）。MD5 キーの既存データを新しいキーへ引き継ぐときに使う
+_key_paths = OrderedDict()
+_key_paths_lock = threading.Lock()
+
+
+def _remember_key_path(file_hash, path):
+    if FILE_HASH_MODE == "md5":
+        return
+    with _key_paths_lock:
+        _key_paths[file_hash] = path
+        _key_paths.move_to_end(file_hash)
+        while len(_key_paths) > KEY_PATH_MEMORY:
+            _key_paths.popitem(last=False)
+
+
+def path_for_key(file_hash):
+    """直近にそのキーを計算したファイルのパスを返す（不明なら None）"""
+    with _key_paths_lock:
+        return _key_paths.get(file_hash)
+
+
+def calculate_file_hash(filepath):
+    """ファイル内容のハッシュ（キー）を返す
+
+    stat 情報が前回と同じファイルはハッシュ索引から返し、内容を読み直さない。
+    """
+    try:
+        st = os.stat(filepath)
+    except FileNotFoundError as e:
+        logger.error(f"ファイルが見つかりません: {filepath}", exc_info=True)
+        raise FileHashError(f"File not found: {filepath}") from e
+    except OSError as e:
+        logger.error(f"ファイル情報の取得エラー: {filepath}", exc_info=True)
+        raise FileHashError(f"Cannot stat file: {filepath}") from e
+
+    file_hash = HashIndex.get_instance().lookup(filepath, st)
+    if file_hash is None:
+        file_hash = _record_file_hash(filepath, st, _hash_file_contents(filepath, size=st.st_size))
+    _remember_key_path(file_hash, filepath)
+    return file_hash
+
+
+def _record_file_hash(path, st, file_hash):
+    """新しく計算したキーをハッシュ索引に登録し、登録したキーを返す
+
+    サンプリング指紋が索引にある別のファイルと一致した場合は、両方の全体ハッシュを比べ、
+    内容が違えば全体ハッシュのキーにする。索引に載った後は stat だけで引けるので、
+    確かめるのは計算し直したときだけ。
+    """
+    index = HashIndex.get_instance()
+    if file_hash.startswith("s:"):
+        owner = index.owner_of(file_hash, path)
+        if owner is not None:
+            file_hash = _resolve_sampled_collision(path, file_hash, owner)
+    index.record(path, st, file_hash)
+    return file_hash
+
+
+def _resolve_sampled_collision(path, file_hash, other_path):
+    """サンプリング指紋が別ファイルと一致したとき、全体ハッシュで区別する"""
+    try:
+        full = _hash_file_contents(path, mode="blake2b")
+        other_full = _hash_file_contents(other_path, mode="blake2b")
+    except FileHashError:
+        return file_hash
+    if full == other_full:
+        return file_hash  # 内容が同一のファイル
+    logger.info(f"サンプリング指紋の衝突を全体ハッシュで解決しました: {os.path.basename(path)}")
+    return full
+
+
+def iter_file_hashes(paths, max_workers=HASH_MAX_WORKERS):
+    """複数ファイルのハッシュを並列に計算し、(パス, ハッシュ) を完了順に返す
+
+    ハッシュ索引で分かるものは即座に返し、残りをスレッドプールで計算する。
+    計算中のファイル数は max_workers の 2 倍までに抑える。失敗したファイルのハッシュは None。
+    サンプリング指紋が索引にある別ファイルと一致した場合は、全体ハッシュで区別する。
+    """
+    index = HashIndex.get_instance()
+    misses = []
+    for path in paths:
         try:
-            with open(VECTOR_DATA_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            logger.info(f"ベクトルデータを読み込みました: {len(data)}件")
-            return data
-        except json.JSONDecodeError as e:
-            logger.error(f"ベクトルファイルのJSON解析エラー: {VECTOR_DATA_FILE}", exc_info=True)
-            raise VectorProcessingError(f"Invalid JSON in vector file: {e}") from e
-        except IOError as e:
-            logger.error(f"ベクトルファイル読み込みエラー: {VECTOR_DATA_FILE}", exc_info=True)
-            raise VectorProcessingError(f"Cannot read vector file: {e}") from e
-        except Exception as e:
-            logger.error(f"ベクトル読み込み中に予期しないエラー: {e}", exc_info=True)
-            raise VectorProcessingError(f"Unexpected error loading vectors: {e}") from e
-    return {}
+            st = os.stat(path)
+        except OSError:
+            logger.warning(f"ファイル情報を取得できません: {path}")
+            yield path, None
+            continue
+        file_hash = index.lookup(path, st)
+        if file_hash is None:
+            misses.append((path, st))
+        else:
+            _remember_key_path(file_hash, path)
+            yield path, file_hash
+
+    if not misses:
+        return
+
+    queue = iter(misses)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hash") as pool:
+        running = {}
+
+        def submit_next():
+            item = next(queue, None)
+            if item is not None:
+                path, st = item
+                running[pool.submit(_hash_file_contents, path, FILE_HASH_MODE, st.st_size)] = item
+
+        for _ in range(max_workers * 2):
+            submit_next()
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, st = running.pop(future)
+                submit_next()
+                try:
+                    file_hash = future.result()
+                except FileHashError:
+                    yield path, None
+                    continue
+                file_hash = _record_file_hash(path, st, file_hash)
+                _remember_key_path(file_hash, path)
+                yield path, file_hash
+
+
+def _carry_file_hash(src, src_stat, dst):
+    try:
+        HashIndex.get_instance().record_move(src, src_stat, dst)
+    except Exception as e:
+        logger.warning(f"ハッシュ索引の更新に失敗しました: {dst} ({e})")
 
 
-def save_vectors(vectors):
+def move_file(src, dst):
+    """ファイルを移動し (shutil.move)、ハッシュ索引の登録を移動先へ引き継ぐ"""
+    src_stat = os.stat(src)
+    shutil.move(src, dst)
+    _carry_file_hash(src, src_stat, dst)
+
+
+def rename_file(src, dst):
+    """ファイル名を変更し (os.rename)、ハッシュ索引の登録を引き継ぐ"""
+    src_stat = os.stat(src)
+    os.rename(src, dst)
+    _carry_file_hash(src, src_stat, dst)
+
+
+def model_namespace(model_key):
+    """モデルごとのベクトル格納名を返す（例: mobilenet_v3_small-v1）
+
+    前処理の版を含めるため、前処理を変えた場合も古いベクトルと混ざらない。
+    カスタムモデルは重みファイルごとに別の格納先にする。
+    """
+    name = model_key
+    if model_key == "custom":
+        from lib.PicSorterGUIState import get_app_state
+        state = get_app_state()
+        path = os.path.normcase(os.path.abspath(state.custom_model_path or ""))
+        digest = hashlib.md5(path.encode("utf-8")).hexdigest()[:8]
+        name = f"custom-{state.custom_model_arch}-{digest}"
+    return f"{name}-v{VECTOR_PREPROCESS_VERSION}"
+
+
+def _model_for_dim(dim):
+    """ベクトル次元から組み込みモデルを推定する（旧データの移行用）"""
+    for key, info in AI_MODELS.items():
+        if info.get("vector_dim") == dim:
+            return key
+    return None
+
+
+def open_vector_store(base_path):
+    """バイナリベクトルストアを開く"""
     try:
-        os.makedirs(os.path.dirname(VECTOR_DATA_FILE), exist_ok=True)
-        with open(VECTOR_DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(vectors, f)
-        logger.info(f"ベクトルデータを保存しました: {len(vectors)}件")
-    except IOError as e:
-        logger.error(f"ベクトルファイル書き込みエラー: {VECTOR_DATA_FILE}", exc_info=True)
-        raise VectorProcessingError(f"Cannot write vector file: {e}") from e
+        return VectorFile(base_path)
+    except VectorProcessingError:
+        raise
     except Exception as e:
-        logger.error(f"ベクトル保存中に予期しないエラー: {e}", exc_info=True)
+        logger.error(f"ベクトルストア読み込み中に予期しないエラー: {e}", exc_info=True)
+        raise VectorProcessingError(f"Unexpected error loading vectors: {e}") from e
+
+
+class VectorStore:
+    """プロセス全体で共有するベクトルストア（シングルトン）
+
+    ベクトルはモデル（と前処理の版）ごとに別ファイルへ格納し、キーはその中の内容ハッシュ。
+    参照・追加は現在のモデルの格納先に対して行う。モデルを切り替えても他のモデルの
+    ベクトルは残るので、以前使ったモデルへ戻したときに再計算は不要。
+    時間のかかる処理は開始時に bind() で格納先を固定し、途中でモデルが切り替わっても
+    結果が別のモデルの格納先に混ざらないようにする。
+    追加されたベクトルは未保存として保持し、flush() / 定期フラッシュ / 終了時に追記保存する。
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, model_key=None):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            instance = cls._instance
+        if model_key:
+            instance.use_model(model_key)
+        return instance
+
+    @classmethod
+    def reset_instance(cls):
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.close()
+            cls._instance = None
+
+    def __init__(self, store_dir=VECTOR_STORE_DIR, model_key=DEFAULT_AI_MODEL,
+                 legacy_json_path=VECTOR_DATA_FILE):
+        self.store_dir = store_dir
+        self.legacy_json_path = legacy_json_path
+        self.model_key = model_key
+        self.namespace = model_namespace(model_key)
+        self._files = {}
+        self._indexes = {}
+        self._graphs = {}
+        self._file_lock = threading.RLock()
+        self._legacy_checked = False
+        self._has_legacy = {}
+        self._alias_checked = {}
+        self._flush_timer = None
+        self._flush_interval = None
+        self._neighbour_timer = None
+        self._neighbour_interval = None
+
+    def bind(self, model_key=None):
+        """model_key（省略時は現在のモデル）の格納先に固定した窓口（ModelVectors）を返す"""
+        namespace = model_namespace(model_key) if model_key else self.namespace
+        return ModelVectors(self, namespace)
+
+    def use_model(self, model_key):
+        """参照・追加の対象を model_key の格納先に切り替える"""
+        namespace = model_namespace(model_key)
+        with self._file_lock:
+            if namespace == self.namespace:
+                return
+            self.model_key = model_key
+            self.namespace = namespace
+        logger.info(f"ベクトル格納先を切り替えました: {namespace}")
+
+    def _open(self, namespace):
+        with self._file_lock:
+            store = self._files.get(namespace)
+            if store is None:
+                store = open_vector_store(os.path.join(self.store_dir, namespace))
+                self._files[namespace] = store
+                logger.info(f"ベクトルストアを開きました: {namespace} ({store.count}行)")
+            return store
+
+    def _store(self, namespace=None):
+        with self._file_lock:
+            if not self._legacy_checked:
+                self._legacy_checked = True
+                try:
+                    self._migrate_legacy()
+                except Exception as e:
+                    logger.error(f"旧ベクトルデータの移行に失敗しました: {e}", exc_info=True)
+            return self._open(namespace or self.namespace)
+
+    def _migrate_legacy(self):
+        """モデル別に分かれていない旧データを、次元の一致するモデルの格納先へ移す"""
+        def store_for_dim(dim):
+            key = _model_for_dim(dim)
+            return self._open(model_namespace(key)) if key else None
+
+        base = os.path.join(self.store_dir, os.path.basename(VECTOR_STORE_BASE))
+        legacy = VectorFile(base)
+        if legacy.exists():
+            target = store_for_dim(legacy.dim)
+            if target is not None and not target.exists():
+                legacy.close()
+                target.close()
+                os.replace(legacy.vec_path, target.vec_path)
+                os.replace(legacy.keys_path, target.keys_path)
+                self._files.pop(os.path.basename(target.base_path), None)
+                logger.info(f"旧ベクトルストアを移行しました: {os.path.basename(target.base_path)}")
+            else:
+                legacy.close()
+        else:
+            legacy.close()
+
+        if self.legacy_json_path and os.path.exists(self.legacy_json_path):
+            migrate_json_vectors(self.legacy_json_path, store_for_dim)
+
+    # ==================== 旧キー（MD5）の引き継ぎ ====================
+
+    def _alias_legacy(self, store, key, namespace):
+        """新方式のキーが無いとき、同じファイルの MD5 キーの行があればそのベクトルを引き継ぐ
+
+        MD5 キーの行が残っている格納先でだけ行う。ファイルは直近にそのキーを計算したパスから
+        読み直すので、引き継げなかった場合も推論し直すより安い。
+        """
+        if ":" not in key:
+            return False
+        with self._file_lock:
+            if namespace not in self._has_legacy:
+                self._has_legacy[namespace] = any(":" not in k for k in store.keys())
+            if not self._has_legacy[namespace]:
+                return False
+            checked = self._alias_checked.setdefault(namespace, set())
+            if key in checked:
+                return False
+            checked.add(key)
+
+        path = path_for_key(key)
+        if path is None:
+            return False
+        try:
+            vec = store.get(legacy_file_hash(path))
+        except FileHashError:
+            return False
+        if vec is None:
+            return False
+        store[key] = vec
+        return True
+
+    # ==================== 参照 / 追加（現在のモデル） ====================
+
+    def __contains__(self, key):
+        return key in self.bind()
+
+    def __getitem__(self, key):
+        return self.bind()[key]
+
+    def get(self, key, default=None):
+        return self.bind().get(key, default)
+
+    def __len__(self):
+        return len(self.bind())
+
+    def keys(self):
+        return self.bind().keys()
+
+    def put(self, key, vec):
+        self.bind().put(key, vec)
+
+    def put_many(self, items):
+        self.bind().put_many(items)
+
+    def is_dirty(self):
+        with self._file_lock:
+            return any(f.has_pending() for f in self._files.values())
+
+    # ==================== 類似検索 ====================
+
+    def _ann_index(self, namespace):
+        with self._file_lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = IVFIndex(os.path.join(self.store_dir, namespace) + ".ivf")
+                self._indexes[namespace] = index
+            return index
+
+    def search(self, query, keys, k=ANN_TOP_K, nprobe=ANN_NPROBE, min_ann=ANN_MIN_VECTORS,
+               threshold=None, namespace=None):
+        """keys（候補のキー）のうち query に似たものを探し、(結果, 全件か) を返す
+
+        結果は (キー, 類似度) の降順リストで、threshold を渡すとそれ未満は含まない。
+        候補が min_ann 件未満なら全件を厳密に採点して返す（k は使わない）。それ以上なら
+        namespace（省略時は現在のモデル）の ANN 索引で近似的に上位 k 件を求め、
+        全件かどうかは False になる（nprobe を増やすと取りこぼしが減る）。
+        索引の変更は検索ごとには書き出さず、flush() / close() でまとめて保存する。
+        """
+        namespace = namespace or self.namespace
+        store = self._store(namespace)
+        keys = list(dict.fromkeys(keys))
+        if len(keys) < min_ann:
+            return self._exact_search(store, query, keys, None, threshold), True
+
+        key_arr, matrix = store.arrays()
+        index = self._ann_index(namespace)
+        index.sync(key_arr, matrix)
+        rows, scores = index.search(matrix, query, None, nprobe)
+        if threshold is not None:
+            keep = scores >= threshold
+            rows, scores = rows[keep], scores[keep]
+
+        # 候補外のキーと、上書きされて使われなくなった行を除く
+        wanted = set(keys)
+        found = [k.decode("ascii") for k in key_arr[rows].tolist()]
+        live = store.rows_of(found) == rows
+        results = [(key, score) for key, ok, score in zip(found, live.tolist(), scores.tolist())
+                   if ok and key in wanted]
+        # 未保存のベクトルは索引に無いため厳密に採点して加える
+        unsaved = [key for key, row in zip(keys, store.rows_of(keys).tolist()) if row < 0]
+        results += self._exact_search(store, query, unsaved, k, threshold)
+        order = select_top(np.array([score for _, score in results], dtype=np.float32), k)
+        return [results[i] for i in order.tolist()], False
+
+    def score(self, query, keys, threshold=None, namespace=None):
+        """keys を全件厳密に採点し、(キー, 類似度) の降順リストで返す（件数の上限なし）
+
+        保存済みの行は正規化した行列との行列×ベクトル積でまとめて採点する。
+        ベクトルの無いキーは含まない。threshold を渡すとそれ未満は返さない。
+        """
+        store = self._store(namespace or self.namespace)
+        return self._exact_search(store, query, list(dict.fromkeys(keys)), None, threshold)
+
+    def _exact_search(self, store, query, keys, k=None, threshold=None, chunk_rows=65536):
+        rows = store.rows_of(keys)
+        _, matrix = store.arrays()
+        found = []
+        parts = []
+        saved = np.flatnonzero(rows >= 0)
+        for start in range(0, len(saved), chunk_rows):
+            idx = saved[start:start + chunk_rows]
+            found.append(idx)
+            parts.append(similarity_scores(query, build_candidate_matrix(matrix[rows[idx]])))
+        unsaved = np.flatnonzero(rows < 0)
+        vecs = [(i, store.get(keys[i])) for i in unsaved.tolist()]
+        vecs = [(i, v) for i, v in vecs if v is not None]
+        if vecs:
+            found.append(np.array([i for i, _ in vecs], dtype=np.int64))
+            parts.append(similarity_scores(query, build_candidate_matrix([v for _, v in vecs])))
+        if not parts:
+            return []
+        found = np.concatenate(found)
+        scores = np.concatenate(parts)
+        order = select_top(scores, k, threshold)
+        return [(keys[i], s) for i, s in zip(found[order].tolist(), scores[order].tolist())]
+
+    # ==================== 近傍リスト ====================
+
+    def _neighbour_graph(self, namespace):
+        with self._file_lock:
+            graph = self._graphs.get(namespace)
+            if graph is None:
+                graph = NeighbourGraph(os.path.join(self.store_dir, namespace) + ".knn")
+                self._graphs[namespace] = graph
+            return graph
+
+    def neighbours(self, key, candidates=None, namespace=None):
+        """保存済みの近傍リストから key に似たものを (キー, 類似度) の降順リストで返す
+
+        key がまだ近傍リストに無ければ None。candidates（キーの列）を渡すと結果をその中に
+        絞り、近傍リストの作成後に追加された候補は厳密に採点して加える。
+        近傍リストはライブラリ全体での上位 KNN_K 件なので、candidates のうちそれ以外の
+        候補は含まれない。候補をすべて評価するには、残りを score() で採点して合わせる。
+        """
+        namespace = namespace or self.namespace
+        store = self._store(namespace)
+        row = store.row_of(key)
+        if row is None:
+            return None
+        graph = self._neighbour_graph(namespace)
+        found = graph.lookup(row, key)
+        if found is None:
+            return None
+        rows, scores = found
+        key_arr, _ = store.arrays()
+        results = {}
+        for r, score in zip(rows.tolist(), scores.tolist()):
+            if r >= len(key_arr):
+                continue
+            k = key_arr[r].decode("ascii")
+            if k != key and k not in results:
+                results[k] = score
+        if candidates is not None:
+            candidates = list(dict.fromkeys(c for c in candidates if c != key))
+            results = {k: results[k] for k in candidates if k in results}
+            late = [k for k, r in zip(candidates, store.rows_of(candidates).tolist())
+                    if k not in results and (r < 0 or r >= graph.count)]
+            if late:
+                results.update(self._exact_search(store, store[key], late))
+        return sorted(results.items(), key=lambda x: x[1], reverse=True)
+
+    def update_neighbours(self, should_stop=None, max_rows=KNN_ROWS_PER_RUN):
+        """現在のモデルの近傍リストへ、まだ登録していない保存済みの行を加える
+
+        行数が ANN_MIN_VECTORS 以上なら新しい行の近傍は ANN 索引で探す。戻り値は処理した行数。
+        """
+        store = self._store()
+        namespace = self.namespace
+        key_arr, matrix = store.arrays()
+        index = None
+        if len(key_arr) >= ANN_MIN_VECTORS:
+            index = self._ann_index(namespace)
+            index.sync(key_arr, matrix)
+            index.save()
+        graph = self._neighbour_graph(namespace)
+        done = graph.sync(key_arr, matrix, index, should_stop, max_rows)
+        graph.save()
+        if done:
+            logger.info(f"近傍リストを更新しました: {namespace} {done}行 ({graph.count}/{len(key_arr)})")
+        return done
+
+    def start_neighbour_updates(self, interval=KNN_UPDATE_INTERVAL):
+        """interval 秒ごとに近傍リストを少しずつ更新するタイマーを開始する"""
+        self._neighbour_interval = interval
+        self._schedule_neighbour_update()
+
+    def stop_neighbour_updates(self):
+        self._neighbour_interval = None
+        if self._neighbour_timer:
+            self._neighbour_timer.cancel()
+            self._neighbour_timer = None
+
+    def _schedule_neighbour_update(self):
+        if not self._neighbour_interval:
+            return
+        self._neighbour_timer = threading.Timer(self._neighbour_interval, self._on_neighbour_timer)
+        self._neighbour_timer.daemon = True
+        self._neighbour_timer.start()
+
+    def _on_neighbour_timer(self):
+        try:
+            self.update_neighbours(should_stop=lambda: not self._neighbour_interval)
+        except Exception as e:
+            logger.error(f"近傍リスト更新エラー: {e}")
+        self._schedule_neighbour_update()
+
+    # ==================== 保存 ====================
+
+    def flush(self):
+        """全モデルの未保存ベクトルを追記保存し、変更のある ANN 索引も書き出す。戻り値は保存件数"""
+        with self._file_lock:
+            for index in self._indexes.values():
+                index.save()  # 検索で同期しただけの変更（無ければ何もしない）
+            added = 0
+            for namespace, store in self._files.items():
+                if not store.has_pending():
+                    continue
+                try:
+                    n = store.flush()
+                except VectorProcessingError:
+                    raise
+                except Exception as e:
+                    logger.error(f"ベクトル保存中に予期しないエラー: {e}", exc_info=True)
+                    raise VectorProcessingError(f"Unexpected error saving vectors: {e}") from e
+                logger.info(f"ベクトルデータを保存しました: {namespace} 追加{n}件")
+                added += n
+            return added
+
+    def start_auto_flush(self, interval=VECTOR_FLUSH_INTERVAL):
+        """interval 秒ごとに未保存分をフラッシュするタイマーを開始する"""
+        self._flush_interval = interval
+        self._schedule_flush()
+
+    def stop_auto_flush(self):
+        self._flush_interval = None
+        if self._flush_timer:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    def _schedule_flush(self):
+        if not self._flush_interval:
+            return
+        self._flush_timer = threading.Timer(self._flush_interval, self._on_flush_timer)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def _on_flush_timer(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"定期ベクトル保存エラー: {e}")
+        self._schedule_flush()
+
+    # ==================== 管理 ====================
+
+    def clear(self):
+        """現在のモデルのベクトルを削除する"""
+        with self._file_lock:
+            self._store().clear()
+            self._ann_index(self.namespace).clear()
+            self._neighbour_graph(self.namespace).clear()
+            self._has_legacy.pop(self.namespace, None)
+            self._alias_checked.pop(self.namespace, None)
+
+    def info(self):
+        """現在のモデルの (ファイルサイズ, 行数) を返す（ヘッダのみ参照）"""
+        with self._file_lock:
+            store = self._store()
+            if not store.exists():
+                return 0, 0
+            return store.file_size(), store.count
+
+    def close(self):
+        self.stop_auto_flush()
+        self.stop_neighbour_updates()
+        with self._file_lock:
+            for store in self._files.values():
+                try:
+                    store.flush()
+                except Exception as e:
+                    logger.error(f"ベクトルストア終了時の保存エラー: {e}")
+                store.close()
+            self._files.clear()
+            for index in self._indexes.values():
+                index.save()
+            self._indexes.clear()
+            for graph in self._graphs.values():
+                graph.close()
+            self._graphs.clear()
+
+
+class ModelVectors:
+    """1 つのモデルの格納先に固定した VectorStore の窓口（VectorStore.bind() で作る）
+
+    VectorStore と同じように ``in`` / ``[]`` / ``get`` / ``put`` で参照・追加でき、search() /
+    neighbours() もこの格納先で行う。作成後に現在のモデルが切り替わっても格納先は変わらない。
+    """
+
+    def __init__(self, owner, namespace):
+        self.owner = owner
+        self.namespace = namespace
+
+    def _store(self):
+        return self.owner._store(self.namespace)
+
+    def __contains__(self, key):
+        store = self._store()
+        return key in store or self.owner._alias_legacy(store, key, self.namespace)
+
+    def __getitem__(self, key):
+        store = self._store()
+        if key not in store:
+            self.owner._alias_legacy(store, key, self.namespace)
+        return store[key]
+
+    def get(self, key, default=None):
+        store = self._store()
+        if key not in store and not self.owner._alias_legacy(store, key, self.namespace):
+            return default
+        return store.get(key, default)
+
+    def __len__(self):
+        return len(self._store())
+
+    def keys(self):
+        return self._store().keys()
+
+    def put(self, key, vec):
+        self._store()[key] = vec
+
+    def put_many(self, items):
+        store = self._store()
+        for key, vec in items:
+            store[key] = vec
+
+    def flush(self):
+        return self.owner.flush()
+
+    def search(self, query, keys, **kwargs):
+        return self.owner.search(query, keys, namespace=self.namespace, **kwargs)
+
+    def score(self, query, keys, threshold=None):
+        return self.owner.score(query, keys, threshold, namespace=self.namespace)
+
+    def neighbours(self, key, candidates=None):
+        return self.owner.neighbours(key, candidates, namespace=self.namespace)
+
+
+def load_vectors():
+    """共有ベクトルストアを返す（互換用。新しいコードは VectorStore.get_instance() を使う）"""
+    return VectorStore.get_instance()
+
+
+def save_vectors(vectors):
+    """ベクトルを保存する（互換用）
+
+    共有ストアなら未保存分を追記し、辞書ならストアに無いものだけを追加して追記する。
+    """
+    store = VectorStore.get_instance()
+    if vectors is not store:
+        store.put_many((k, v) for k, v in vectors.items() if k not in store)
+    store.flush()
 
 
 def clear_vectors():
-    """vectordata.json を空にする"""
+    """ベクトルストアを空にする"""
     try:
-        os.makedirs(os.path.dirname(VECTOR_DATA_FILE), exist_ok=True)
-        with open(VECTOR_DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump({}, f)
+        VectorStore.get_instance().clear()
         logger.info("ベクトルデータをクリアしました")
     except Exception as e:
         logger.error(f"ベクトルデータクリアエラー: {e}")
 
 
 def clear_analysis_cache():
-    """analysis_cache.json を空にする"""
+    """分析結果キャッシュを空にする"""
     try:
-        if os.path.exists(ANALYSIS_CACHE_FILE):
-            with open(ANALYSIS_CACHE_FILE, "w", encoding="utf-8") as f:
-                json.dump({}, f)
-            logger.info("分析キャッシュをクリアしました")
+        AnalysisCache.get_instance().clear()
+        logger.info("分析キャッシュをクリアしました")
     except Exception as e:
         logger.error(f"分析キャッシュクリアエラー: {e}")
 
 
 def get_vector_data_info():
-    """vectordata.json のファイルサイズと件数を返す"""
-    if not os.path.exists(VECTOR_DATA_FILE):
-        return 0, 0
+    """ベクトルストアのファイルサイズと件数を返す（ヘッダのみ参照）"""
     try:
-        file_size = os.path.getsize(VECTOR_DATA_FILE)
-        with open(VECTOR_DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return file_size, len(data)
+        return VectorStore.get_instance().info()
     except Exception:
-        try:
-            return os.path.getsize(VECTOR_DATA_FILE), 0
-        except Exception:
-            return 0, 0
+        return 0, 0
 
 
-def _make_cache_key(folder, target_hash):
-    return f"{folder}|{target_hash}"
+def _make_cache_key(folder, target_hash, namespace=None):
+    # スコアはモデルに依存するため、ベクトルの格納先（省略時は現在のモデル）もキーに含める
+    namespace = namespace or VectorStore.get_instance().namespace
+    return f"{namespace}|{folder}|{target_hash}"
 
 
-def load_analysis_cache(folder, target_hash, current_file_count):
-    """分析結果キャッシュを読み込む。無効ならNoneを返す"""
-    if not os.path.exists(ANALYSIS_CACHE_FILE):
-        return None
+def directory_digests(paths):
+    """フォルダの {パス: 中身のダイジェスト} を返す
+
+    ダイジェストはフォルダ直下の項目の (名前, サイズ, 更新時刻ns) を名前順に並べたものの
+    blake2b で、フォルダごとに os.scandir 1 回で求める（ファイルの中身は読まない）。
+    追加・削除・名前変更に加え、同じ名前への上書き保存もサイズか更新時刻で変化として分かる。
+    無いフォルダは空文字（後で作られたら変化として分かる）。
+    """
+    digests = {}
+    for path in paths:
+        entries = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            entries.append((entry.name, -1, -1))  # 下位フォルダは名前だけ
+                        else:
+                            st = entry.stat()
+                            entries.append((entry.name, st.st_size, st.st_mtime_ns))
+                    except OSError:
+                        entries.append((entry.name, -2, -2))
+        except OSError:
+            digests[path] = ""
+            continue
+        h = hashlib.blake2b(digest_size=16)
+        for name, size, mtime in sorted(entries):
+            h.update(name.encode("utf-8", "surrogateescape") + b"\0")
+            h.update(f"{size}:{mtime}\n".encode("ascii"))
+        digests[path] = h.hexdigest()
+    return digests
+
+
+def load_unchanged_analysis(folder, target_hash, namespace=None):
+    """分析したフォルダがどれも前回から変わっていなければ、(結果, hashed) を返す
+
+    フォルダごとの directory_digests() を比べるだけで、ハッシュ計算やハッシュ索引の
+    参照は行わない。ファイルの追加・削除・名前変更・上書きがあればダイジェストが変わるため、
+    load_analysis_cache() での確認に回る。
+    変わっていれば、または前回フォルダのダイジェストを保存していなければ None。
+    """
     try:
-        with open(ANALYSIS_CACHE_FILE, "r", encoding="utf-8") as f:
-            all_cache = json.load(f)
-        key = _make_cache_key(folder, target_hash)
-        entry = all_cache.get(key)
-        if not entry:
+        entry = AnalysisCache.get_instance().get(_make_cache_key(folder, target_hash, namespace))
+        if entry is None or not entry["dirs"]:
             return None
-        if entry.get("file_count") != current_file_count:
-            logger.info(f"キャッシュ無効: ファイル数変更 ({entry.get('file_count')} -> {current_file_count})")
+        if directory_digests(entry["dirs"]) != entry["dirs"]:
             return None
-        results = [(r["file"], r["score"]) for r in entry["results"]]
-        logger.info(f"分析キャッシュを読み込みました: {len(results)}件")
-        return results
+        cached = list(zip(entry["keys"], entry["scores"].tolist()))
+        logger.info(f"分析キャッシュを読み込みました（フォルダ変更なし）: {len(cached)}件")
+        return cached, entry["files"]
     except Exception as e:
         logger.warning(f"分析キャッシュ読み込みエラー: {e}")
         return None
 
 
-def save_analysis_cache(folder, target_hash, results, file_count):
-    """分析結果をキャッシュに保存する"""
+def load_analysis_cache(folder, target_hash, hashed, namespace=None):
+    """分析結果キャッシュを読み込む。エントリが無ければNoneを返す
+
+    hashed は今回の候補の (パス, キー) の列、namespace は採点に使うベクトルの格納先
+    （ModelVectors.namespace、省略時は現在のモデル）。戻り値は (結果, 未採点のキー) で、
+    結果はキャッシュの (キー, 類似度) の降順リストのうち今もある候補の分。
+    ファイル集合の指紋が一致すれば未採点のキーは空。
+    """
     try:
-        all_cache = {}
-        if os.path.exists(ANALYSIS_CACHE_FILE):
-            try:
-                with open(ANALYSIS_CACHE_FILE, "r", encoding="utf-8") as f:
-                    all_cache = json.load(f)
-            except Exception:
-                all_cache = {}
-
-        from datetime import datetime
-        key = _make_cache_key(folder, target_hash)
-        all_cache[key] = {
-            "timestamp": datetime.now().isoformat(),
-            "file_count": file_count,
-            "results": [{"file": path, "score": score} for path, score in results]
-        }
+        entry = AnalysisCache.get_instance().get(_make_cache_key(folder, target_hash, namespace))
+        if entry is None:
+            return None
+        cached = list(zip(entry["keys"], entry["scores"].tolist()))
+        if entry["fingerprint"] == files_fingerprint(hashed):
+            logger.info(f"分析キャッシュを読み込みました: {len(cached)}件")
+            return cached, []
+
+        # 指紋が違う: 消えた候補を除き、まだ採点していない候補だけを返す
+        keys = list(dict.fromkeys(k for _, k in hashed if k is not None))
+        current = set(keys)
+        results = [(k, score) for k, score in cached if k in current]
+        candidates = entry["candidates"]
+        digests = key_digests(keys)
+        pos = np.minimum(np.searchsorted(candidates, digests), max(len(candidates) - 1, 0))
+        scored = (candidates[pos] == digests) if len(candidates) else np.zeros(len(keys), dtype=bool)
+        new_keys = [k for k, ok in zip(keys, scored.tolist()) if not ok]
+        logger.info(f"分析キャッシュを部分的に使います: {len(results)}件を再利用 / 未採点{len(new_keys)}件")
+        return results, new_keys
+    except Exception as e:
+        logger.warning(f"分析キャッシュ読み込みエラー: {e}")
+        return None
 
-        os.makedirs(os.path.dirname(ANALYSIS_CACHE_FILE), exist_ok=True)
-        with open(ANALYSIS_CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(all_cache, f, ensure_ascii=False)
+
+def save_analysis_cache(folder, target_hash, results, hashed, scored_keys, namespace=None,
+                        dirs=None):
+    """分析結果をキャッシュに保存する
+
+    results は (キー, 類似度) の降順リスト、hashed は候補の (パス, キー) の列、
+    scored_keys は採点済みの全候補のキー（次回はこれ以外だけを採点する）。
+    dirs はファイルを列挙する前に取ったフォルダのダイジェスト（directory_digests() の値）で、
+    次回 load_unchanged_analysis() で比べる。
+    """
+    try:
+        AnalysisCache.get_instance().put(
+            _make_cache_key(folder, target_hash, namespace),
+            [key for key, _ in results], [score for _, score in results],
+            files_fingerprint(hashed), scored_keys, dirs, hashed)
         logger.info(f"分析キャッシュを保存しました: {len(results)}件")
     except Exception as e:
         logger.error(f"分析キャッシュ保存エラー: {e}")
@@ -217,7 +956,7 @@ class ImageDataManager():
     def __init__(self, def_folder):
         self.StartFolder = def_folder
         self.GazoFiles = []
-        self.vectors_cache = {}
+        self.vectors_cache = VectorStore.get_instance()
 
     def SetGazoFiles(self, GazoFiles, folder_path, include_subfolders=False):
         self.StartFolder = folder_path
@@ -226,8 +965,6 @@ class ImageDataManager():
         if include_subfolders:
             self.GazoFiles = self._collect_all_images(folder_path)
 
-        self.vectors_cache = load_vectors()
-
     def _collect_all_images(self, base_folder):
         all_images = []
 
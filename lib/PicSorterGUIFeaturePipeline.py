@@ -0,0 +1,201 @@
+'''
+PicSorterGUI ベクトル化パイプライン
+
+画像の読み込み・前処理（複数スレッド）と推論（呼び出し元スレッド）を上限付きキューで
+つなぎ、並行して動かす。推論エンジンは load_tensor / infer_tensors / get_batch_size /
+_add_to_cache を持つオブジェクトなら何でもよく、このモジュール自体は torch に依存しない。
+'''
+import queue
+import threading
+import time
+
+from lib.PicSorterGUILogger import LoggerManager
+from lib.config_defaults import AI_DECODE_WORKERS, AI_PIPELINE_QUEUE_SIZE
+
+logger = LoggerManager.get_logger(__name__)
+
+
+_PIPELINE_DONE = object()
+_SAME_KEY = object()  # 同じキーを別の項目が読み込み済み・読み込み中（テンソルの代わりに流す）
+
+
+class FeaturePipeline:
+    """読み込み・前処理と推論を並行させるベクトル化パイプライン
+
+    複数の読み込みスレッドが画像をデコード・前処理して上限付きキューへ入れ、
+    呼び出し元スレッド（推論段）がキューからバッチ単位で取り出して推論する。
+    キューが満杯になると読み込みスレッドは待つので、メモリ上のテンソル数は上限内に収まる。
+
+    run() は (キー, パス) を受け取り、(キー, パス, ベクトル, 新規計算か) を完了順に返す。
+    ベクトルが保存済みのキーは読み込まずにそのまま返し、新規に計算したベクトルは vectors に追加する。
+    同じ内容のファイル（同じキー）は実行全体で 1 回だけ読み込み・推論し、結果を全員に返す。
+    読み込みや推論に失敗した画像（キーが None のものを含む）のベクトルは None。
+    """
+
+    def __init__(self, engine, vectors, should_stop=None, batch_size=None,
+                 decode_workers=AI_DECODE_WORKERS, queue_size=AI_PIPELINE_QUEUE_SIZE):
+        self.engine = engine
+        self.vectors = vectors
+        self.should_stop = should_stop or (lambda: False)
+        self.batch_size = batch_size or engine.get_batch_size()
+        self.decode_workers = decode_workers
+        self.queue_size = max(queue_size, self.batch_size)
+        self.stats = {"decode": [0, 0.0], "infer": [0, 0.0]}
+        self._stats_lock = threading.Lock()
+
+    def _add_stat(self, stage, count, seconds):
+        with self._stats_lock:
+            self.stats[stage][0] += count
+            self.stats[stage][1] += seconds
+
+    def throughput(self):
+        """段ごとの処理速度（枚/秒、各段のスレッド1本あたり）を返す"""
+        with self._stats_lock:
+            return {stage: (count / seconds if seconds > 0 else 0.0)
+                    for stage, (count, seconds) in self.stats.items()}
+
+    def _decode_worker(self, items, items_lock, claimed, out_queue, cancel):
+        def put(entry):
+            while not cancel.is_set():
+                try:
+                    out_queue.put(entry, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            while not cancel.is_set():
+                with items_lock:
+                    item = next(items, None)
+                if item is None:
+                    break
+                key, path = item
+                if key is None:
+                    # ハッシュ計算に失敗したファイルは失敗としてそのまま流す
+                    if not put((key, path, None, None)):
+                        break
+                    continue
+                vec = self.vectors.get(key)
+                if vec is not None:
+                    if not put((key, path, None, vec)):
+                        break
+                    continue
+                with items_lock:
+                    duplicate = key in claimed
+                    claimed.add(key)
+                if duplicate:
+                    # 先に受け取った項目の推論結果を推論段で分けてもらう
+                    if not put((key, path, _SAME_KEY, None)):
+                        break
+                    continue
+
+                start = time.perf_counter()
+                try:
+                    tensor = self.engine.load_tensor(path, thumbnail_key=key)
+                except Exception as e:
+                    logger.warning(f"画像読み込み失敗（スキップ）: {path} - {e}")
+                    tensor = None
+                self._add_stat("decode", 1, time.perf_counter() - start)
+                if not put((key, path, tensor, None)):
+                    break
+        except Exception as e:
+            logger.error(f"読み込みスレッドでエラー: {e}", exc_info=True)
+        finally:
+            put(_PIPELINE_DONE)
+
+    def _infer(self, batch):
+        # 読み込み段で同じキーは 1 回しか流さないので、バッチ内のキーは重複しない
+        tensors = [tensor for _, _, tensor in batch]
+        start = time.perf_counter()
+        try:
+            vecs = self.engine.infer_tensors(tensors)
+        except Exception as e:
+            logger.error(f"バッチ推論に失敗しました: {e}", exc_info=True)
+            vecs = [None] * len(tensors)
+        self._add_stat("infer", len(tensors), time.perf_counter() - start)
+
+        done = []
+        for (key, path, _), vec in zip(batch, vecs):
+            if vec is not None:
+                # 推論結果の行列を残さないよう、ストアから 1 行分を取り直して渡す
+                self.vectors.put(key, vec)
+                vec = self.vectors.get(key, vec)
+                self.engine._add_to_cache(path, vec)
+            done.append((key, path, vec, True))
+        return done
+
+    def _share(self, key, path, vec):
+        """同じキーの別のファイルへ、計算済みの結果を渡す"""
+        if vec is not None:
+            self.engine._add_to_cache(path, vec)
+        return key, path, vec, True
+
+    def run(self, items):
+        items = iter(items)
+        items_lock = threading.Lock()
+        claimed = set()   # 読み込みを引き受けたキー（読み込み段が items_lock の下で更新）
+        waiting = {}      # 結果待ちのキー -> 同じキーの別のパス
+        completed = set()  # 結果が出たキー（成功ならベクトルはストアにある）
+        out_queue = queue.Queue(maxsize=self.queue_size)
+        cancel = threading.Event()
+        workers = [
+            threading.Thread(target=self._decode_worker,
+                             args=(items, items_lock, claimed, out_queue, cancel),
+                             name=f"decode-{i}", daemon=True)
+            for i in range(self.decode_workers)
+        ]
+        for w in workers:
+            w.start()
+
+        def finish(results):
+            for key, path, vec, is_new in results:
+                yield key, path, vec, is_new
+                completed.add(key)
+                for other in waiting.pop(key, ()):
+                    yield self._share(key, other, vec)
+
+        batch = []
+        finished = 0
+        try:
+            while finished < len(workers):
+                if self.should_stop():
+                    return
+                try:
+                    # 推論待ちがあるときは少しだけ待ち、来なければ揃っている分で推論する
+                    entry = out_queue.get(timeout=0.02 if batch else 0.2)
+                except queue.Empty:
+                    if batch:
+                        yield from finish(self._infer(batch))
+                        batch = []
+                    continue
+
+                if entry is _PIPELINE_DONE:
+                    finished += 1
+                    continue
+                key, path, tensor, vec = entry
+                if vec is not None:
+                    yield key, path, vec, False
+                elif tensor is _SAME_KEY:
+                    if key in completed:
+                        yield self._share(key, path, self.vectors.get(key))
+                    else:
+                        waiting.setdefault(key, []).append(path)
+                elif tensor is None:
+                    yield from finish([(key, path, None, True)])
+                else:
+                    batch.append((key, path, tensor))
+                    if len(batch) >= self.batch_size:
+                        yield from finish(self._infer(batch))
+                        batch = []
+
+            if batch and not self.should_stop():
+                yield from finish(self._infer(batch))
+        finally:
+            cancel.set()
+            for w in workers:
+                w.join(timeout=5)
+            rates = self.throughput()
+            logger.info(
+                f"ベクトル化パイプライン: 読み込み {self.stats['decode'][0]}枚 ({rates['decode']:.1f}枚/秒/スレッド), "
+                f"推論 {self.stats['infer'][0]}枚 ({rates['infer']:.1f}枚/秒)")
@@ -0,0 +1,233 @@
+'''
+PicSorterGUI ファイルハッシュ索引
+
+ファイルの stat 情報 (デバイス, inode, サイズ, 更新時刻ns) からハッシュを引く索引。
+内容が変わっていないファイルは stat だけでハッシュが分かるため、再分析時に
+画像を読み直さずに済む。inode を持たないファイルシステム（一部のネットワーク共有など）
+ではパスで代用する。
+
+ファイル形式（UTF-8 のタブ区切り、追記専用）:
+    1 行目: ``#algo=<ハッシュ方式>``（方式が変わったら索引は破棄する）
+    2 行目以降: dev / ino / size / mtime_ns / hash / path
+同じファイルの行は後の行が優先。不要行が増えたら読み込み時に書き直す。
+
+サンプリング指紋（"s:" で始まるキー）は、どのファイルに付けたかを行から引けるので、
+別の実行で計算した指紋が既存のファイルと一致した場合も衝突を確かめられる（owner_of）。
+'''
+import os
+import threading
+
+from lib.PicSorterGUILogger import LoggerManager
+from lib.config_defaults import HASH_INDEX_FILE, HASH_INDEX_FLUSH_ROWS, FILE_HASH_MODE
+
+logger = LoggerManager.get_logger(__name__)
+
+HASH_ALGORITHM = FILE_HASH_MODE
+
+# 読み込み時に書き直す条件（総行数が有効行数のこの倍率を超えたとき）
+COMPACTION_RATIO = 2
+COMPACTION_MIN_ROWS = 1024
+
+
+def _make_key(path, dev, ino, size, mtime_ns):
+    if ino:
+        return (dev, ino, size, mtime_ns)
+    return (os.path.normcase(os.path.abspath(path)), size, mtime_ns)
+
+
+def _stat_key(path, st):
+    return _make_key(path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class HashIndex:
+    """stat 情報 → ファイルハッシュの永続索引（シングルトン）"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def reset_instance(cls):
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.close()
+            cls._instance = None
+
+    def __init__(self, path=HASH_INDEX_FILE, algorithm=HASH_ALGORITHM, flush_rows=HASH_INDEX_FLUSH_ROWS):
+        self.path = path
+        self.algorithm = algorithm
+        self.flush_rows = flush_rows
+        self._entries = None
+        self._owners = {}  # サンプリング指紋 -> それを登録したパスの集合
+        self._pending = []
+        self._rows = 0
+        self._index_lock = threading.RLock()
+
+    # ==================== 読み込み ====================
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        self._owners = {}
+        self._rows = 0
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8", newline="\n") as f:
+                header = f.readline().rstrip("\n")
+                if header != f"#algo={self.algorithm}":
+                    logger.info(f"ハッシュ索引の方式が異なるため破棄します: {header}")
+                    self._rows = -1
+                    return
+                torn = False
+                for line in f:
+                    parts = line.rstrip("\n").split("\t", 5)
+                    if not line.endswith("\n") or len(parts) != 6:
+                        torn = True  # 書き込み途中の行
+                        continue
+                    dev, ino, size, mtime_ns = (int(v) for v in parts[:4])
+                    row = (dev, ino, size, mtime_ns, parts[4], parts[5])
+                    self._entries[_make_key(parts[5], dev, ino, size, mtime_ns)] = row
+                    self._add_owner(parts[4], parts[5])
+                    self._rows += 1
+        except (OSError, ValueError) as e:
+            logger.warning(f"ハッシュ索引を読み込めません（作り直します）: {e}")
+            self._entries = {}
+            self._owners = {}
+            self._rows = -1
+            return
+        logger.info(f"ハッシュ索引を読み込みました: {len(self._entries)}件")
+
+        if torn:
+            # 途中の行の後ろへ追記すると行が壊れるため、次の保存で書き直す
+            self._rows = -1
+        elif self._rows > COMPACTION_MIN_ROWS and self._rows > len(self._entries) * COMPACTION_RATIO:
+            self._rewrite()
+
+    # ==================== 参照 / 登録 ====================
+
+    def lookup(self, path, st=None):
+        """内容が変わっていなければ登録済みのハッシュを返す。無ければ None"""
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+        with self._index_lock:
+            self._load()
+            entry = self._entries.get(_stat_key(path, st))
+        return entry[4] if entry else None
+
+    def record(self, path, st, file_hash):
+        """path（stat 結果 st）のハッシュを登録する"""
+        row = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, file_hash, path)
+        with self._index_lock:
+            self._load()
+            key = _stat_key(path, st)
+            if self._entries.get(key) == row:
+                return
+            self._entries[key] = row
+            self._add_owner(file_hash, path)
+            self._pending.append(row)
+            if len(self._pending) >= self.flush_rows:
+                self.flush()
+
+    def record_move(self, src, src_stat, dst):
+        """移動・名前変更の後に呼び、移動前のハッシュを移動先へ引き継ぐ
+
+        同じドライブ内の移動は inode が変わらないため何もしなくても引けるが、
+        別ドライブへの移動やパスで索引しているファイルはここで登録し直す。
+        """
+        with self._index_lock:
+            self._load()
+            entry = self._entries.get(_stat_key(src, src_stat))
+        if entry is None:
+            return
+        try:
+            st = os.stat(dst)
+        except OSError:
+            return
+        self.record(dst, st, entry[4])
+
+    def _add_owner(self, file_hash, path):
+        if file_hash.startswith("s:"):
+            self._owners.setdefault(file_hash, set()).add(os.path.normcase(os.path.abspath(path)))
+
+    def owner_of(self, file_hash, path):
+        """file_hash（サンプリング指紋）を登録済みの、path 以外で内容が変わっていないファイルを返す
+
+        登録済みの行は衝突を確かめたうえで記録しているので、path 自身が登録済みなら
+        None を返す。該当するファイルが無い場合も None。
+        """
+        with self._index_lock:
+            self._load()
+            owners = self._owners.get(file_hash)
+            if not owners or os.path.normcase(os.path.abspath(path)) in owners:
+                return None
+            owners = list(owners)
+        for other in owners:
+            if self.lookup(other) == file_hash:
+                return other
+        return None
+
+    def __len__(self):
+        with self._index_lock:
+            self._load()
+            return len(self._entries)
+
+    # ==================== 保存 ====================
+
+    def flush(self):
+        """未保存の行を追記する。戻り値は追記行数"""
+        with self._index_lock:
+            if not self._pending:
+                return 0
+            if self._rows < 0:
+                self._rewrite()
+                return len(self._entries)
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                new_file = not os.path.exists(self.path)
+                with open(self.path, "a", encoding="utf-8", newline="\n") as f:
+                    if new_file:
+                        f.write(f"#algo={self.algorithm}\n")
+                    for row in self._pending:
+                        f.write("\t".join(str(v) for v in row) + "\n")
+            except OSError as e:
+                logger.error(f"ハッシュ索引の保存に失敗しました: {e}")
+                return 0
+            added = len(self._pending)
+            self._rows += added
+            self._pending.clear()
+            return added
+
+    def _rewrite(self):
+        """有効な行だけで索引ファイルを書き直す"""
+        tmp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+                f.write(f"#algo={self.algorithm}\n")
+                for row in self._entries.values():
+                    f.write("\t".join(str(v) for v in row) + "\n")
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"ハッシュ索引の書き直しに失敗しました: {e}")
+            return 0
+        written = len(self._entries)
+        self._rows = written
+        self._pending.clear()
+        logger.info(f"ハッシュ索引を書き直しました: {written}件")
+        return written
+
+    def close(self):
+        with self._index_lock:
+            if self._entries is not None:
+                self.flush()
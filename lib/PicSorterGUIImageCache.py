@@ -2,54 +2,135 @@
 PicSorterGUI 画像キャッシング機構
 
 LRU（最近最少使用）キャッシュで、頻繁にアクセスされる画像をメモリに保持。
+画像は（ファイルの内容ハッシュまたはパス, サイズの段階）ごとに縮小済みで持ち、
+同じ段階に収まる表示サイズの画像はそこから縮小して作る。
 """
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import math
+import os
 import threading
-from pathlib import Path
 from PIL import Image
 from .PicSorterGUILogger import LoggerManager
+from .config_defaults import (IMAGE_CACHE_MAX_MB, IMAGE_CACHE_BUCKETS, IMAGE_CACHE_PRELOAD_WORKERS,
+                              THUMBNAIL_BUCKETS)
 
 logger = LoggerManager.get_logger(__name__)
 
 
+def decode_reduced(img, target_size, fit="contain"):
+    """開いただけの画像を、target_size を下回らない最小の縮尺でデコードして返す
+
+    JPEG は Image.draft() で DCT 縮小（1/2〜1/8）しながらデコードし、
+    それ以外の形式や残りの縮小分は Image.reduce() の整数分の1縮小で行う。
+    fit="contain" は target_size の枠に収める用途（サムネイル）、
+    fit="cover" は枠を覆う用途（短辺合わせ・枠いっぱいへのリサイズ）。
+    最終的な大きさへの縮小は呼び出し側で行う。
+    """
+    tw, th = max(1, target_size[0]), max(1, target_size[1])
+    w, h = img.size
+    scale = min(tw / w, th / h) if fit == "contain" else max(tw / w, th / h)
+    if scale >= 1:
+        img.load()
+        return img
+
+    need_w, need_h = max(1, math.ceil(w * scale)), max(1, math.ceil(h * scale))
+    if img.format == "JPEG":
+        img.draft(img.mode, (need_w, need_h))
+    img.load()
+
+    factor = min(img.width // need_w, img.height // need_h)
+    if factor >= 2:
+        try:
+            return img.reduce(factor)
+        except (ValueError, NotImplementedError):
+            pass  # reduce 非対応のモード
+    return img
+
+
+def open_image_reduced(image_path, target_size, fit="contain"):
+    """画像ファイルを target_size に必要な最小の縮尺で読み込む（decode_reduced 参照）"""
+    return decode_reduced(Image.open(image_path), target_size, fit)
+
+
 class ImageCache:
-    """LRUキャッシュで画像を管理するシングルトンクラス。"""
+    """LRUキャッシュで画像を管理するシングルトンクラス（スレッドセーフ）
+
+    表示サイズを IMAGE_CACHE_BUCKETS の段階に切り上げ、段階の枠に収めた画像（基準画像）を
+    一度だけデコードして持つ。表示サイズごとの画像（派生画像）は基準画像から縮小して作り、
+    同じキャッシュに持つので、2 回目以降は縮小もしない。上限は両方の合計バイト数で管理する。
+    返す画像はキャッシュと共有なので、呼び出し側で書き換えないこと。
+    """
 
     _instance = None
     _lock = threading.Lock()
 
     @classmethod
-    def get_instance(cls, max_size_mb=256):
+    def get_instance(cls, max_size_mb=IMAGE_CACHE_MAX_MB):
         with cls._lock:
             if cls._instance is None:
                 cls._instance = cls(max_size_mb=max_size_mb)
         return cls._instance
 
-    def __init__(self, max_size_mb=256):
+    @classmethod
+    def reset_instance(cls):
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.shutdown()
+            cls._instance = None
+
+    def __init__(self, max_size_mb=IMAGE_CACHE_MAX_MB, buckets=IMAGE_CACHE_BUCKETS,
+                 preload_workers=IMAGE_CACHE_PRELOAD_WORKERS):
         self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.buckets = tuple(sorted(buckets))
+        self.preload_workers = preload_workers
         self.current_size_bytes = 0
-        self.cache = OrderedDict()
+        self.cache = OrderedDict()  # キャッシュキー -> (画像, バイト数)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cache_lock = threading.RLock()
+        self._executor = None
         logger.info(f"ImageCache初期化: 最大{max_size_mb}MB")
 
-    def get(self, image_path, target_size=None):
-        try:
-            if image_path in self.cache:
-                self.cache.move_to_end(image_path)
-                img = self.cache[image_path]
-
-                if target_size and img.size != target_size:
-                    img = img.resize(target_size, Image.Resampling.LANCZOS)
+    # ==================== 取得 ====================
 
-                return img
+    def bucket_for(self, target_size):
+        """表示サイズを収める最小の段階の辺長。指定なし・最大を超える場合は None（原寸）"""
+        if not target_size:
+            return None
+        side = max(target_size)
+        for bucket in self.buckets:
+            if side <= bucket:
+                return bucket
+        return None
 
-            img = Image.open(image_path).convert("RGB")
+    def get(self, image_path, target_size=None, key=None, fit="exact"):
+        """image_path の画像を target_size にして返す
 
-            if target_size:
-                img = img.resize(target_size, Image.Resampling.LANCZOS)
+        fit="exact" は target_size ちょうどに、fit="contain" は縦横比を保って枠に収める。
+        key にファイルの内容ハッシュを渡すとそれで、省くとパスと更新時刻で画像を識別する。
+        """
+        try:
+            image_key = self._image_key(image_path, key)
+            size = tuple(target_size) if target_size else None
+            variant_key = (image_key, fit, size)
+            img = self._lookup(variant_key)
+            if img is not None:
+                self._count(hit=True)
+                return img
 
-            self._add_to_cache(image_path, img)
+            bucket = self.bucket_for(size)
+            base_key = (image_key, "base", bucket)
+            base = self._lookup(base_key)
+            self._count(hit=base is not None)
+            if base is None:
+                base = self._add(base_key, self._decode(image_path, bucket, key))
 
+            img = self._fit(base, size, fit)
+            if img is not base:
+                img = self._add(variant_key, img)
             return img
 
         except FileNotFoundError:
@@ -59,47 +140,130 @@ class ImageCache:
             logger.error(f"画像読み込みエラー: {image_path} - {e}")
             raise
 
-    def preload(self, image_paths, target_size=None):
-        loaded = 0
-        skipped = 0
+    def _image_key(self, image_path, key):
+        if key:
+            return key
+        st = os.stat(image_path)
+        return (os.path.normcase(os.path.abspath(image_path)), st.st_mtime_ns, st.st_size)
+
+    def _decode(self, image_path, bucket, key):
+        """段階 bucket の枠に収めた基準画像をデコードする（None なら原寸）"""
+        if bucket is None:
+            with Image.open(image_path) as img:
+                return img.convert("RGB")
+        if bucket in THUMBNAIL_BUCKETS:
+            # サムネイルの段階はディスク上のサムネイル保存を通す（循環 import を避けて遅延 import）
+            from .PicSorterGUIThumbnailStore import ThumbnailStore
+            return ThumbnailStore.get_instance().thumbnail(image_path, (bucket, bucket), key).convert("RGB")
+        img = open_image_reduced(image_path, (bucket, bucket)).convert("RGB")
+        img.thumbnail((bucket, bucket))
+        return img
+
+    def _fit(self, base, size, fit):
+        if size is None:
+            return base
+        if fit == "contain":
+            if base.width <= size[0] and base.height <= size[1]:
+                return base
+            img = base.copy()
+            img.thumbnail(size)
+            return img
+        if base.size == size:
+            return base
+        return base.resize(size, Image.Resampling.LANCZOS)
+
+    # ==================== 保持 / 追い出し ====================
+
+    def _lookup(self, cache_key):
+        with self._cache_lock:
+            entry = self.cache.get(cache_key)
+            if entry is None:
+                return None
+            self.cache.move_to_end(cache_key)
+            return entry[0]
 
-        for path in image_paths:
-            if path in self.cache:
-                skipped += 1
-                continue
+    def _count(self, hit):
+        with self._cache_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
 
-            try:
-                self.get(path, target_size)
-                loaded += 1
-            except Exception:
-                continue
+    def _add(self, cache_key, img):
+        """img を登録して返す。別スレッドが先に登録していればそちらを返す"""
+        nbytes = img.width * img.height * len(img.getbands())
+        with self._cache_lock:
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                self.cache.move_to_end(cache_key)
+                return entry[0]
+            if nbytes > self.max_size_bytes:
+                return img  # 上限より大きい画像は持たない
 
-        logger.info(f"プリロード完了: {loaded}個読み込み, {skipped}個スキップ")
+            while self.current_size_bytes + nbytes > self.max_size_bytes and self.cache:
+                _, (_, removed_bytes) = self.cache.popitem(last=False)
+                self.current_size_bytes -= removed_bytes
+                self.evictions += 1
 
-    def _add_to_cache(self, image_path, img):
-        width, height = img.size
-        estimated_size = width * height * 4
+            self.cache[cache_key] = (img, nbytes)
+            self.current_size_bytes += nbytes
+        return img
 
-        while self.current_size_bytes + estimated_size > self.max_size_bytes:
-            if not self.cache:
-                break
+    # ==================== 先読み ====================
 
-            removed_path, removed_img = self.cache.popitem(last=False)
-            removed_size = removed_img.size[0] * removed_img.size[1] * 4
-            self.current_size_bytes -= removed_size
+    def preload(self, image_paths, target_size=None, fit="exact", keys=None):
+        """画像を作業スレッドで読み込んでキャッシュに入れる（完了を待たない）
 
-        self.cache[image_path] = img
-        self.current_size_bytes += estimated_size
+        keys を渡す場合は image_paths と同じ並びの内容ハッシュ。Future のリストを返す。
+        """
+        with self._cache_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.preload_workers,
+                                                    thread_name_prefix="ImageCachePreload")
+            executor = self._executor
+        keys = keys if keys is not None else [None] * len(image_paths)
+        futures = [executor.submit(self._preload_one, path, target_size, fit, key)
+                   for path, key in zip(image_paths, keys)]
+        logger.debug(f"プリロード開始: {len(futures)}個")
+        return futures
+
+    def _preload_one(self, image_path, target_size, fit, key):
+        try:
+            self.get(image_path, target_size, key=key, fit=fit)
+            return True
+        except Exception:
+            return False
+
+    def shutdown(self):
+        """先読みの作業スレッドを止める（未着手の先読みは取り消す）"""
+        with self._cache_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # ==================== 管理 ====================
 
     def clear(self):
-        self.cache.clear()
-        self.current_size_bytes = 0
+        with self._cache_lock:
+            self.cache.clear()
+            self.current_size_bytes = 0
+            self.hits = self.misses = self.evictions = 0
         logger.info("ImageCacheをクリア")
 
     def get_stats(self):
-        size_mb = self.current_size_bytes / (1024 * 1024)
-        return {
-            "count": len(self.cache),
-            "size_mb": size_mb,
-            "max_mb": self.max_size_bytes / (1024 * 1024)
-        }
+        with self._cache_lock:
+            requests = self.hits + self.misses
+            return {
+                "count": len(self.cache),
+                "size_mb": self.current_size_bytes / (1024 * 1024),
+                "max_mb": self.max_size_bytes / (1024 * 1024),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+
+def load_cached_image(image_path, target_size, key=None):
+    """共有の ImageCache から target_size の枠に収めた画像を返す（サムネイル読み込み用）"""
+    return ImageCache.get_instance().get(image_path, target_size, key=key, fit="contain")
@@ -0,0 +1,319 @@
+'''
+PicSorterGUI 近傍リスト（k 近傍グラフ）
+
+ベクトルストアの各行について、類似度の高い上位 K 行とその類似度を保持する。
+「類似画像を探す」で基準画像がすでにリストにあれば、フォルダ全体を採点し直さずに
+表示できる。
+
+リストはベクトルストアの隣に ``<格納先>.knn`` として保存し、mmap で開く。
+ストアへ追記された行はバックグラウンドで少しずつリストへ加え、既存の行のリストにも
+新しい行を反映する。コンパクションなどで行番号が変わった場合はキーで対応付け直す。
+
+ファイル形式（リトルエンディアン）:
+    ヘッダ 32 バイト: magic(8) / K(uint32) / key_size(uint32) / 登録行数(uint64) / 予約(8)
+    本体: 行ごとに キー(key_size) / 近傍の行番号 int32 x K / 類似度 float16 x K
+    本体の行 i はベクトルストアの行 i に対応する。近傍は類似度の降順で、空きは行番号 -1。
+'''
+import os
+import struct
+import threading
+import numpy as np
+
+from lib.PicSorterGUILogger import LoggerManager
+from lib.PicSorterGUIVectorStore import KEY_SIZE
+from lib.config_defaults import KNN_NEIGHBORS, KNN_BLOCK_SIZE, ANN_NPROBE
+
+logger = LoggerManager.get_logger(__name__)
+
+KNN_MAGIC = b"PSGVKNN1"
+HEADER_FORMAT = "<8sIIQ8x"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# ファイルを伸ばすときの最小行数（足りなくなったら倍に伸ばす）
+INITIAL_CAPACITY = 1024
+
+# ANN 索引で近傍を探すとき、K のこの倍率まで候補を取る（逆向きの反映にも使う）
+SEARCH_WIDTH = 4
+
+
+def _inverse_norms(matrix, chunk_rows=65536):
+    """各行の L2 ノルムの逆数（ゼロベクトルは 0）"""
+    out = np.zeros(len(matrix), dtype=np.float32)
+    for s in range(0, len(matrix), chunk_rows):
+        norms = np.linalg.norm(matrix[s:s + chunk_rows], axis=1)
+        np.divide(1.0, norms, out=out[s:s + chunk_rows], where=norms > 0)
+    return out
+
+
+def rank_neighbours(rows, scores, k, unique=True):
+    """候補（m x c の行番号と類似度）から行ごとに上位 k 件を降順で選ぶ
+
+    行番号 -1 と類似度 -inf の候補は空きとして扱い、結果の空きは行番号 -1 / 類似度 -inf。
+    unique が真なら同じ行番号の重複を 1 つにまとめる。
+    """
+    rows = np.broadcast_to(rows, scores.shape)
+    scores = np.array(scores, dtype=np.float32)
+    scores[rows < 0] = -np.inf
+    if unique and scores.shape[1] > 1:
+        order = np.argsort(rows, axis=1, kind="stable")
+        sorted_rows = np.take_along_axis(rows, order, axis=1)
+        dup = np.zeros(scores.shape, dtype=bool)
+        dup[:, 1:] = sorted_rows[:, 1:] == sorted_rows[:, :-1]
+        duplicated = np.zeros(scores.shape, dtype=bool)
+        np.put_along_axis(duplicated, order, dup, axis=1)
+        scores[duplicated] = -np.inf
+
+    m, c = scores.shape
+    kk = min(k, c)
+    out_rows = np.full((m, k), -1, dtype=np.int32)
+    out_scores = np.full((m, k), -np.inf, dtype=np.float32)
+    if kk == 0:
+        return out_rows, out_scores
+    top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk] if kk < c else np.arange(c)[None, :].repeat(m, 0)
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    desc = np.argsort(-top_scores, axis=1, kind="stable")
+    top = np.take_along_axis(top, desc, axis=1)
+    out_scores[:, :kk] = np.take_along_axis(top_scores, desc, axis=1)
+    out_rows[:, :kk] = np.take_along_axis(rows, top, axis=1)
+    out_rows[~np.isfinite(out_scores)] = -1
+    return out_rows, out_scores
+
+
+class NeighbourGraph:
+    """ベクトルストア 1 つ分の近傍リスト"""
+
+    def __init__(self, path, k=KNN_NEIGHBORS, key_size=KEY_SIZE):
+        self.path = path
+        self.k = k
+        self.key_size = key_size
+        self.dtype = np.dtype([
+            ("key", f"S{key_size}"),
+            ("rows", "<i4", (k,)),
+            ("scores", "<f2", (k,)),
+        ])
+        self.count = 0
+        self._records = None
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._load()
+
+    # ==================== 保存 / 読み込み ====================
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise ValueError("header is truncated")
+            magic, k, key_size, count = struct.unpack(HEADER_FORMAT, header)
+            if magic != KNN_MAGIC or k != self.k or key_size != self.key_size:
+                raise ValueError("format mismatch")
+            capacity = (os.path.getsize(self.path) - HEADER_SIZE) // self.dtype.itemsize
+            if count > capacity:
+                raise ValueError("body is truncated")
+            self._map(capacity)
+            self.count = count
+        except (OSError, ValueError) as e:
+            logger.warning(f"近傍リストを読み込めません（作り直します）: {e}")
+            self._records = None
+            self.count = 0
+
+    def _map(self, capacity):
+        self._records = (np.memmap(self.path, dtype=self.dtype, mode="r+",
+                                   offset=HEADER_SIZE, shape=(capacity,))
+                         if capacity else None)
+
+    def _unmap(self):
+        if self._records is not None:
+            self._records.flush()
+            self._records = None
+
+    def _reserve(self, n):
+        """本体を n 行以上書けるように伸ばす"""
+        capacity = 0 if self._records is None else len(self._records)
+        if n <= capacity:
+            return
+        capacity = max(n, capacity * 2, INITIAL_CAPACITY)
+        self._unmap()
+        mode = "r+b" if os.path.exists(self.path) else "wb"
+        with open(self.path, mode) as f:
+            if mode == "wb":
+                f.write(self._header())
+            f.truncate(HEADER_SIZE + capacity * self.dtype.itemsize)
+        self._map(capacity)
+
+    def _header(self):
+        return struct.pack(HEADER_FORMAT, KNN_MAGIC, self.k, self.key_size, self.count)
+
+    def save(self):
+        """変更があれば本体を書き出してから登録行数を更新する"""
+        with self._lock:
+            if not self._dirty or self._records is None:
+                return False
+            try:
+                self._records.flush()
+                with open(self.path, "r+b") as f:
+                    f.write(self._header())
+            except OSError as e:
+                logger.error(f"近傍リストの保存に失敗しました: {e}")
+                return False
+            self._dirty = False
+            return True
+
+    def close(self):
+        with self._lock:
+            self.save()
+            self._unmap()
+
+    def clear(self):
+        with self._lock:
+            self._records = None
+            self.count = 0
+            self._dirty = False
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    # ==================== 参照 ====================
+
+    def lookup(self, row, key):
+        """ストアの行 row（キー key）の近傍を (行番号の配列, 類似度の配列) で返す
+
+        まだリストに無い行や、行番号がストアとずれている場合は None。
+        """
+        raw = key.encode("ascii") if isinstance(key, str) else bytes(key)
+        with self._lock:
+            if self._records is None or not 0 <= row < self.count:
+                return None
+            record = self._records[row]
+            if record["key"] != raw:
+                return None
+            valid = record["rows"] >= 0
+            return (record["rows"][valid].astype(np.int64),
+                    record["scores"][valid].astype(np.float32))
+
+    # ==================== 更新 ====================
+
+    def sync(self, keys, matrix, index=None, should_stop=None, max_rows=None):
+        """ストアの保存済み行（keys, matrix）のうち未登録の行をリストに加える
+
+        index（同期済みの IVFIndex）を渡すと、新しい行の近傍を全行ではなく索引で探す。
+        max_rows 行まで処理し、戻り値は処理した行数。
+        """
+        n = len(keys)
+        with self._lock:
+            if self.count > n or (self.count and not np.array_equal(
+                    self._records["key"][:self.count], keys[:self.count])):
+                self._remap(keys)
+            start = self.count
+            stop = n if max_rows is None else min(n, start + max_rows)
+            if start >= stop:
+                return 0
+            self._reserve(n)
+
+        inv = _inverse_norms(matrix[:stop]) if index is None else None
+        for s in range(start, stop, KNN_BLOCK_SIZE):
+            if should_stop and should_stop():
+                break
+            e = min(s + KNN_BLOCK_SIZE, stop)
+            with self._lock:
+                if index is None:
+                    self._add_exact(keys, matrix, inv, s, e)
+                else:
+                    self._add_approx(keys, matrix, index, s, e)
+                self.count = e
+                self._dirty = True
+        return self.count - start
+
+    def _add_exact(self, keys, matrix, inv, s, e):
+        """行 s..e の近傍を行 0..e の全件から求め、既存の行のリストにも反映する"""
+        block = matrix[s:e] * inv[s:e, None]
+        sims = (matrix[:e] @ block.T) * inv[:e, None]  # (e, 新しい行数)
+        sims[np.arange(s, e), np.arange(e - s)] = -np.inf
+
+        rows, scores = rank_neighbours(np.arange(e, dtype=np.int32)[None, :], sims.T, self.k, unique=False)
+        self._write(s, e, keys, rows, scores)
+
+        if s:
+            old = sims[:s]
+            kth = self._records["scores"][:s, -1].astype(np.float32)
+            targets = np.flatnonzero(old.max(axis=1) > kth)
+            if len(targets):
+                self._merge(targets, np.arange(s, e, dtype=np.int32)[None, :], old[targets])
+
+    def _add_approx(self, keys, matrix, index, s, e):
+        """行 s..e の近傍を ANN 索引で求め、見つかった既存の行のリストにも反映する"""
+        width = self.k * SEARCH_WIDTH + 1
+        rows = np.full((e - s, width), -1, dtype=np.int32)
+        scores = np.full((e - s, width), -np.inf, dtype=np.float32)
+        for i, r in enumerate(range(s, e)):
+            found, sims = index.search(matrix, matrix[r:r + 1], width, ANN_NPROBE)
+            rows[i, :len(found)] = found
+            scores[i, :len(found)] = sims
+        # 自身と、まだ登録していない行は除く（後の行は登録時に逆向きで加わる）
+        scores[(rows == np.arange(s, e)[:, None]) | (rows >= e)] = -np.inf
+        new_rows, new_scores = rank_neighbours(rows, scores, self.k)
+        self._write(s, e, keys, new_rows, new_scores)
+
+        # 逆向き: 候補に見つかった登録済みの行のリストに新しい行を加える
+        src = np.repeat(np.arange(s, e, dtype=np.int32), width)
+        tgt = rows.ravel()
+        sc = scores.ravel()
+        keep = np.isfinite(sc)
+        src, tgt, sc = src[keep], tgt[keep], sc[keep]
+        keep = sc > self._records["scores"][tgt, -1].astype(np.float32)
+        src, tgt, sc = src[keep], tgt[keep], sc[keep]
+        if not len(tgt):
+            return
+        order = np.argsort(tgt, kind="stable")
+        src, tgt, sc = src[order], tgt[order], sc[order]
+        targets, first, counts = np.unique(tgt, return_index=True, return_counts=True)
+        group = np.repeat(np.arange(len(targets)), counts)
+        pos = np.arange(len(tgt)) - np.repeat(first, counts)
+        cand_rows = np.full((len(targets), counts.max()), -1, dtype=np.int32)
+        cand_scores = np.full(cand_rows.shape, -np.inf, dtype=np.float32)
+        cand_rows[group, pos] = src
+        cand_scores[group, pos] = sc
+        self._merge(targets, cand_rows, cand_scores)
+
+    def _write(self, s, e, keys, rows, scores):
+        self._records["key"][s:e] = keys[s:e]
+        self._records["rows"][s:e] = rows
+        self._records["scores"][s:e] = scores
+
+    def _merge(self, targets, cand_rows, cand_scores):
+        """登録済みの行 targets のリストに候補を混ぜて上位 K 件に絞る"""
+        cand_rows = np.broadcast_to(cand_rows, cand_scores.shape)
+        rows = np.concatenate([self._records["rows"][targets], cand_rows], axis=1)
+        scores = np.concatenate([self._records["scores"][targets].astype(np.float32), cand_scores], axis=1)
+        rows, scores = rank_neighbours(rows, scores, self.k)
+        self._records["rows"][targets] = rows
+        self._records["scores"][targets] = scores
+
+    def _remap(self, keys):
+        """行番号が変わったストアに合わせ、キーでリストを引き継ぐ
+
+        先頭から続けて引き継げた行までを登録済みとし、それ以降は次の更新で求め直す。
+        """
+        old_keys = self._records["key"][:self.count].tolist() if self.count else []
+        records = self._records[:self.count].copy() if self.count else None
+        new_rows = {k: i for i, k in enumerate(keys.tolist())}
+        old_rows = {k: i for i, k in enumerate(old_keys)}
+        source = np.fromiter((old_rows.get(k, -1) for k in keys.tolist()), dtype=np.int64, count=len(keys))
+        missing = np.flatnonzero(source < 0)
+        count = int(missing[0]) if len(missing) else len(keys)
+
+        self.count = 0
+        self._dirty = True
+        if count:
+            old_to_new = np.fromiter((new_rows.get(k, -1) for k in old_keys),
+                                     dtype=np.int32, count=len(old_keys))
+            kept = records[source[:count]]
+            valid = (kept["rows"] >= 0) & (kept["rows"] < len(old_keys))
+            neighbour_rows = np.where(valid, old_to_new[np.where(valid, kept["rows"], 0)], -1)
+            rows, scores = rank_neighbours(neighbour_rows, kept["scores"], self.k)
+            self._reserve(count)
+            self._write(0, count, keys, rows, scores)
+        self.count = count
+        logger.info(f"近傍リストの行番号を付け直しました: {count}行を引き継ぎ")
@@ -0,0 +1,65 @@
+'''
+PicSorterGUI ベクトル類似度計算
+
+候補ベクトルを L2 正規化済みの float32 行列にまとめておき、
+1 つのクエリとの類似度（コサイン類似度）を行列×ベクトル積 1 回で求める。
+'''
+import numpy as np
+
+from lib.PicSorterGUIExceptions import VectorProcessingError
+
+
+def normalize_rows(vectors):
+    """ベクトル列を L2 正規化した float32 の連続行列（行 = ベクトル）にする
+
+    ゼロベクトルの行はゼロのまま（類似度は 0 になる）。
+    """
+    matrix = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def build_candidate_matrix(vectors, dim=None):
+    """類似度検索の候補行列を作る（vectors が空なら 0 行の行列）"""
+    if len(vectors) == 0:
+        return np.zeros((0, dim or 0), dtype=np.float32)
+    return normalize_rows(vectors)
+
+
+def similarity_scores(query, candidates):
+    """クエリと候補行列の各行とのコサイン類似度を返す（float32 の 1 次元配列）
+
+    candidates は build_candidate_matrix() で作った正規化済み行列。
+    """
+    q = normalize_rows(query)[0]
+    if candidates.shape[0] == 0:
+        return np.zeros(0, dtype=np.float32)
+    if candidates.shape[1] != q.shape[0]:
+        raise VectorProcessingError(
+            f"Vector dimension mismatch: {q.shape[0]} != {candidates.shape[1]}")
+    return candidates @ q
+
+
+def select_top(scores, k=None, threshold=None):
+    """scores のうち threshold 以上で上位 k 件の番号を、スコアの降順の配列で返す
+
+    全体は並べ替えず、argpartition で選んだ範囲の中だけを並べ替える。
+    同じスコアは番号の小さい順。k / threshold が None ならその条件で絞らない。
+    """
+    scores = np.asarray(scores)
+    if threshold is None:
+        idx = np.arange(len(scores))
+    else:
+        idx = np.flatnonzero(scores >= threshold)
+    if k is not None and len(idx) > k:
+        if k <= 0:
+            return idx[:0]
+        idx = np.sort(idx[np.argpartition(-scores[idx], k - 1)[:k]])
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+def rank_by_similarity(query, candidates, threshold=None, k=None):
+    """類似度の高い順に (行番号, スコア) のリストを返す。threshold 未満は除き、最大 k 件"""
+    scores = similarity_scores(query, candidates)
+    return [(int(i), float(scores[i])) for i in select_top(scores, k, threshold)]
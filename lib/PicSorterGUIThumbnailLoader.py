@@ -0,0 +1,192 @@
+'''
+PicSorterGUI サムネイル読み込み
+
+サムネイルのデコードと縮小を作業スレッドで（画像キャッシュを通して）行い、
+できた PIL 画像をメインスレッドへ after() で少しずつ渡して PhotoImage にする。ダイアログを開いてもメインスレッドが
+デコードで止まらず、表示中の項目から順に埋まっていく。
+
+依頼は優先度（小さいほど先）の順に処理する。依頼元のウィジェット（owner）が
+破棄されると、その依頼はまとめて取り消される。
+'''
+import collections
+import itertools
+import queue
+import threading
+import tkinter as tk
+from PIL import Image, ImageTk
+
+from lib.PicSorterGUILogger import LoggerManager
+from lib.PicSorterGUIImageCache import load_cached_image
+from lib.config_defaults import (
+    THUMBNAIL_LOADER_WORKERS, THUMBNAIL_HANDOFF_BATCH, THUMBNAIL_HANDOFF_INTERVAL_MS,
+)
+
+logger = LoggerManager.get_logger(__name__)
+
+PLACEHOLDER_COLOR = "#dddddd"
+
+_placeholders = {}
+
+
+def placeholder_image(size, color=PLACEHOLDER_COLOR):
+    """読み込み待ちの間に表示する無地の PhotoImage（サイズ・色ごとに共有）"""
+    key = (tuple(size), color)
+    if key not in _placeholders:
+        _placeholders[key] = ImageTk.PhotoImage(Image.new("RGB", key[0], color))
+    return _placeholders[key]
+
+
+class ThumbnailJob:
+    """サムネイル 1 枚分の読み込み依頼"""
+
+    __slots__ = ("owner", "path", "size", "key", "callback", "cancelled")
+
+    def __init__(self, owner, path, size, key, callback):
+        self.owner = owner
+        self.path = path
+        self.size = size
+        self.key = key
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class ThumbnailLoader:
+    """作業スレッドでサムネイルを読み込み、メインスレッドへ受け渡す（シングルトン）"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def reset_instance(cls):
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.shutdown()
+            cls._instance = None
+
+    def __init__(self, workers=THUMBNAIL_LOADER_WORKERS, batch=THUMBNAIL_HANDOFF_BATCH,
+                 interval=THUMBNAIL_HANDOFF_INTERVAL_MS, load=load_cached_image,
+                 make_photo=ImageTk.PhotoImage):
+        self.workers = workers
+        self.batch = batch
+        self.interval = interval
+        self._load = load
+        self._make_photo = make_photo
+
+        self._queue = queue.PriorityQueue()
+        self._done = collections.deque()  # 作業スレッド → メインスレッド
+        self._seq = itertools.count()
+        self._threads = []
+        # 以下はメインスレッドだけが触る
+        self._jobs_by_owner = {}
+        self._pending = 0
+        self._root = None
+        self._poll_id = None
+
+    # ==================== 依頼 / 取り消し（メインスレッド） ====================
+
+    def request(self, owner, path, size, callback, priority=0, key=None):
+        """path のサムネイルを読み込み、callback(PhotoImage) をメインスレッドで呼ぶ
+
+        読み込めなかった場合は callback(None) を呼ぶ。取り消した依頼は呼ばない。
+        戻り値の ThumbnailJob.cancel() で個別に取り消せる。
+        """
+        self._start_workers()
+        owner_name = str(owner)
+        if owner_name not in self._jobs_by_owner:
+            self._jobs_by_owner[owner_name] = set()
+            owner.bind("<Destroy>", lambda e: str(e.widget) == owner_name and self.cancel(owner_name),
+                       add="+")
+        job = ThumbnailJob(owner_name, path, tuple(size), key, callback)
+        self._jobs_by_owner[owner_name].add(job)
+        self._pending += 1
+        self._queue.put((priority, next(self._seq), job))
+        if self._root is None:
+            self._root = owner.nametowidget(".")
+        self._schedule()
+        return job
+
+    def cancel(self, owner):
+        """owner（ウィジェットまたはその名前）の未処理の依頼をすべて取り消す"""
+        for job in self._jobs_by_owner.pop(str(owner), ()):
+            job.cancel()
+
+    def shutdown(self):
+        """作業スレッドを止める"""
+        for jobs in self._jobs_by_owner.values():
+            for job in jobs:
+                job.cancel()
+        self._jobs_by_owner = {}
+        for _ in self._threads:
+            self._queue.put((float("inf"), next(self._seq), None))
+        self._threads = []
+
+    # ==================== 作業スレッド ====================
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _worker(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                return
+            img = None
+            if not job.cancelled:
+                try:
+                    img = self._load(job.path, job.size, job.key)
+                except Exception as e:
+                    logger.debug(f"サムネイル読み込み失敗: {job.path} ({e})")
+            self._done.append((job, img))
+
+    # ==================== 受け渡し（メインスレッド） ====================
+
+    def _schedule(self):
+        if self._poll_id is None and self._root is not None:
+            try:
+                self._poll_id = self._root.after(self.interval, self._drain)
+            except tk.TclError:
+                self._root = None  # アプリ終了中
+
+    def _drain(self):
+        """読み込み済みの画像を最大 batch 枚だけ PhotoImage にして callback へ渡す"""
+        self._poll_id = None
+        handed = 0
+        while self._done and handed < self.batch:
+            job, img = self._done.popleft()
+            self._pending -= 1
+            jobs = self._jobs_by_owner.get(job.owner)
+            if jobs is not None:
+                jobs.discard(job)
+            if job.cancelled:
+                continue
+            photo = None
+            if img is not None:
+                try:
+                    photo = self._make_photo(img)
+                except Exception as e:
+                    logger.debug(f"PhotoImage 作成失敗: {job.path} ({e})")
+            try:
+                job.callback(photo)
+            except tk.TclError:
+                pass  # 破棄されかけのウィジェット
+            handed += 1
+        if self._pending > 0:
+            self._schedule()
+
+
+def request_thumbnail(owner, path, size, callback, priority=0, key=None):
+    """共有のサムネイル読み込みに依頼する（ThumbnailLoader.request を参照）"""
+    return ThumbnailLoader.get_instance().request(owner, path, size, callback, priority, key)
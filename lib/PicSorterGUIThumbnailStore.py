@@ -0,0 +1,241 @@
+'''
+PicSorterGUI サムネイル保存
+
+ファイルの内容ハッシュと表示サイズの段階（辺長）をキーに、縮小済みのサムネイルを
+WebP（使えなければ JPEG）で保存する。一度作ったサムネイルは、ダイアログを開き直しても
+元画像をデコードせずに表示できる。表示時に無ければその場で作って保存し、
+ベクトル化の読み込みスレッドもデコードした画像から作っておく。
+
+ファイル形式（リトルエンディアン、どちらも追記専用）:
+    thumbs.pack: 画像データを連結したもの
+    thumbs.idx : ヘッダ 32 バイト（magic(8) / 予約(24)）に続き、
+                 1 件 48 バイトの キー(32) / 辺長(uint32) / 位置(uint64) / 長さ(uint32)
+パックが上限を超えたら両ファイルを空にして作り直す。
+'''
+import io
+import os
+import struct
+import threading
+from PIL import Image, features
+
+from lib.PicSorterGUILogger import LoggerManager
+from lib.PicSorterGUIImageCache import open_image_reduced
+from lib.config_defaults import (
+    THUMBNAIL_DIR, THUMBNAIL_BUCKETS, THUMBNAIL_PREFILL_BUCKETS, THUMBNAIL_QUALITY,
+    THUMBNAIL_PACK_MAX_BYTES,
+)
+
+logger = LoggerManager.get_logger(__name__)
+
+INDEX_MAGIC = b"PSGVTHM1"
+INDEX_HEADER = INDEX_MAGIC + bytes(24)
+RECORD_FORMAT = "<32sIQI"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+KEY_SIZE = 32
+
+THUMBNAIL_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+
+
+class ThumbnailStore:
+    """内容ハッシュ×辺長 → サムネイル画像の永続ストア（シングルトン）"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def reset_instance(cls):
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.close()
+            cls._instance = None
+
+    def __init__(self, path=THUMBNAIL_DIR, buckets=THUMBNAIL_BUCKETS,
+                 max_bytes=THUMBNAIL_PACK_MAX_BYTES):
+        self.path = path
+        self.pack_path = os.path.join(path, "thumbs.pack")
+        self.index_path = os.path.join(path, "thumbs.idx")
+        self.buckets = tuple(sorted(buckets))
+        self.max_bytes = max_bytes
+        self._entries = {}
+        self._pack = None
+        self._pack_size = 0
+        self._file_lock = threading.RLock()
+        self._load()
+
+    # ==================== 読み込み / 管理 ====================
+
+    def _load(self):
+        has_index, has_pack = os.path.exists(self.index_path), os.path.exists(self.pack_path)
+        if not (has_index and has_pack):
+            if has_index or has_pack:
+                self._reset_files()  # 片方だけ残っていても位置が合わないので捨てる
+            return
+        try:
+            pack_size = os.path.getsize(self.pack_path)
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+                raise ValueError("invalid index header")
+            # 書きかけの末尾レコードや、パックに無い範囲を指すレコードは無視する
+            for pos in range(len(INDEX_HEADER), len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+                key, bucket, offset, length = struct.unpack_from(RECORD_FORMAT, data, pos)
+                if offset + length <= pack_size:
+                    self._entries[(key.rstrip(b"\0").decode("ascii"), bucket)] = (offset, length)
+            self._pack_size = pack_size
+            logger.info(f"サムネイル保存を開きました: {len(self._entries)}件 ({pack_size:,} バイト)")
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            logger.warning(f"サムネイル索引を読み込めません（作り直します）: {e}")
+            self._entries = {}
+            self._reset_files()
+
+    def _reset_files(self):
+        self._close_pack()
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.pack_path, "wb"):
+            pass
+        with open(self.index_path, "wb") as f:
+            f.write(INDEX_HEADER)
+        self._pack_size = 0
+
+    def _open_pack(self):
+        if self._pack is None:
+            if not os.path.exists(self.index_path):
+                self._reset_files()
+            self._pack = open(self.pack_path, "a+b")
+        return self._pack
+
+    def _close_pack(self):
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+
+    def close(self):
+        with self._file_lock:
+            self._close_pack()
+
+    def clear(self):
+        """保存済みのサムネイルをすべて削除する"""
+        with self._file_lock:
+            self._entries = {}
+            self._reset_files()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ==================== 参照 / 保存 ====================
+
+    def bucket_for(self, size):
+        """表示サイズ (幅, 高さ) を収める最小の段階の辺長。最大を超えれば None"""
+        side = max(size)
+        for bucket in self.buckets:
+            if side <= bucket:
+                return bucket
+        return None
+
+    def __contains__(self, item):
+        return item in self._entries
+
+    def get(self, key, bucket):
+        """保存済みのサムネイルを PIL 画像で返す。無ければ None"""
+        with self._file_lock:
+            entry = self._entries.get((key, bucket))
+            if entry is None:
+                return None
+            offset, length = entry
+            try:
+                pack = self._open_pack()
+                pack.seek(offset)
+                data = pack.read(length)
+            except OSError as e:
+                logger.warning(f"サムネイルを読み込めません: {e}")
+                return None
+        try:
+            img = Image.open(io.BytesIO(data))
+            img.load()
+            return img
+        except Exception as e:
+            logger.warning(f"サムネイルが壊れています（作り直します）: {e}")
+            with self._file_lock:
+                self._entries.pop((key, bucket), None)
+            return None
+
+    def put(self, key, bucket, img):
+        """bucket の枠に収めたサムネイル img を保存する"""
+        buf = io.BytesIO()
+        img.convert("RGB").save(buf, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+        data = buf.getvalue()
+        raw_key = key.encode("ascii")
+        if len(raw_key) > KEY_SIZE:
+            return False
+        with self._file_lock:
+            if (key, bucket) in self._entries:
+                return True
+            try:
+                if self._pack_size + len(data) > self.max_bytes:
+                    logger.info(f"サムネイル保存が上限に達したため作り直します（{self.max_bytes:,} バイト）")
+                    self._entries = {}
+                    self._reset_files()
+                pack = self._open_pack()
+                offset = self._pack_size
+                pack.write(data)
+                pack.flush()
+                with open(self.index_path, "ab") as f:
+                    f.write(struct.pack(RECORD_FORMAT, raw_key, bucket, offset, len(data)))
+            except OSError as e:
+                logger.error(f"サムネイルの保存に失敗しました: {e}")
+                return False
+            self._pack_size = offset + len(data)
+            self._entries[(key, bucket)] = (offset, len(data))
+            return True
+
+    def add_from_image(self, key, img, buckets=THUMBNAIL_PREFILL_BUCKETS):
+        """デコード済みの画像 img から、まだ無い段階のサムネイルを作って保存する
+
+        img が段階の辺長より小さい場合は（縮小済みの可能性があるため）作らない。
+        """
+        for bucket in buckets:
+            if (key, bucket) in self._entries or max(img.size) < bucket:
+                continue
+            thumb = img.copy()
+            thumb.thumbnail((bucket, bucket))
+            self.put(key, bucket, thumb)
+
+    def thumbnail(self, path, size, key=None):
+        """path の画像を size（幅, 高さ）の枠に収めたサムネイルを返す
+
+        保存済みならそれを縮小して返し、無ければ元画像から作って保存する。
+        key（内容ハッシュ）を省くとハッシュ索引から求める。
+        """
+        bucket = self.bucket_for(size)
+        if bucket is not None and key is None:
+            try:
+                from lib.PicSorterGUIData import calculate_file_hash
+                key = calculate_file_hash(path)
+            except Exception:
+                key = None
+        if bucket is None or key is None:
+            img = open_image_reduced(path, size)
+            img.thumbnail(size)
+            return img
+
+        img = self.get(key, bucket)
+        if img is None:
+            img = open_image_reduced(path, (bucket, bucket)).convert("RGB")
+            img.thumbnail((bucket, bucket))
+            self.put(key, bucket, img)
+        if img.width > size[0] or img.height > size[1]:
+            img = img.copy()
+            img.thumbnail(size)
+        return img
+
+
+def load_thumbnail(path, size, key=None):
+    """共有のサムネイル保存を通して path のサムネイル（PIL 画像）を返す"""
+    return ThumbnailStore.get_instance().thumbnail(path, size, key)
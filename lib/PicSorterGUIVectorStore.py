@@ -0,0 +1,491 @@
+'''
+PicSorterGUI バイナリベクトルストア
+
+float32 の連続行列ファイル (.vec) と固定長キー列ファイル (.keys) の組で
+ベクトルを保持する。どちらも mmap で開くため、起動時の JSON 解析が不要になる。
+
+ファイル形式（どちらもリトルエンディアン）:
+    ヘッダ 32 バイト: magic(8) / dim(uint32) / key_size(uint32) / 予約(16)
+    .vec  本体: count x dim の float32 行列
+    .keys 本体: count x key_size バイトの ASCII キー（NUL 詰め）
+
+新規ベクトルは両ファイルの末尾へ追記する（同じキーは後の行が優先）。
+上書きで不要になった行はバックグラウンドのコンパクションで取り除く。
+
+参照で返すベクトルは 1 行分をコピーした float32 の 1 次元 ndarray で、Python の
+リストへは変換しない。呼び出し側がキャッシュなどに長く持っても mmap を閉じられるよう、
+mmap への行ビューは渡さない（一括処理向けの arrays() / matrix() は使い終わったら手放す）。
+未保存のベクトルも伸長可能な float32 行列に保持する。
+'''
+import os
+import json
+import mmap
+import struct
+import threading
+import numpy as np
+
+from lib.PicSorterGUIExceptions import VectorProcessingError
+from lib.PicSorterGUILogger import LoggerManager
+
+logger = LoggerManager.get_logger(__name__)
+
+VEC_MAGIC = b"PSGVVEC1"
+KEY_MAGIC = b"PSGVKEY1"
+HEADER_FORMAT = "<8sII16x"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+KEY_SIZE = 32
+
+# コンパクションの実行条件（不要行の割合と最小行数）
+COMPACTION_DEAD_RATIO = 0.25
+COMPACTION_MIN_DEAD_ROWS = 256
+COMPACTION_CHUNK_ROWS = 4096
+
+# 未保存ベクトル行列の初期行数（足りなくなったら倍に伸ばす）
+PENDING_INITIAL_ROWS = 64
+
+
+def _pack_header(magic, dim, key_size):
+    return struct.pack(HEADER_FORMAT, magic, dim, key_size)
+
+
+def _read_header(buf, magic, path):
+    if len(buf) < HEADER_SIZE:
+        raise VectorProcessingError(f"Vector store header is truncated: {path}")
+    file_magic, dim, key_size = struct.unpack_from(HEADER_FORMAT, buf, 0)
+    if file_magic != magic:
+        raise VectorProcessingError(f"Invalid vector store file: {path}")
+    return dim, key_size
+
+
+def _encode_key(key, key_size):
+    raw = key.encode("ascii") if isinstance(key, str) else bytes(key)
+    if len(raw) > key_size:
+        raise VectorProcessingError(f"Vector key too long ({len(raw)} > {key_size}): {key}")
+    return raw
+
+
+class VectorFile:
+    """mmap で開く float32 ベクトル行列と、ハッシュ→行のインデックス
+
+    辞書と同じように ``in`` / ``[]`` / ``get`` / ``len`` で参照できる。値は行のコピー。
+    ``vectors[h] = vec`` で追加したベクトルは ``flush()`` まで未保存として保持する。
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.vec_path = base_path + ".vec"
+        self.keys_path = base_path + ".keys"
+        self.dim = 0
+        self.key_size = KEY_SIZE
+        self.count = 0
+        self._vec_mm = None
+        self._keys_mm = None
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._keys = np.empty(0, dtype=f"S{KEY_SIZE}")
+        self._index = None
+        self._pending = {}
+        self._pending_matrix = np.empty((0, 0), dtype=np.float32)
+        self._pending_rows = 0
+        self._lock = threading.RLock()
+        self._compact_thread = None
+        self._generation = 0  # write_all() / clear() で増やす（コンパクション中の置き換えを検出する）
+        self._open()
+
+    # ==================== オープン / クローズ ====================
+
+    def exists(self):
+        return os.path.exists(self.vec_path) and os.path.exists(self.keys_path)
+
+    def _open(self):
+        """ヘッダを読み、本体を mmap する（件数に依らず一定時間）"""
+        self._close_maps()
+        self._index = None
+        if not self.exists():
+            return
+        try:
+            with open(self.vec_path, "rb") as f:
+                self._vec_mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with open(self.keys_path, "rb") as f:
+                self._keys_mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            dim, key_size = _read_header(self._vec_mm, VEC_MAGIC, self.vec_path)
+            _, keys_key_size = _read_header(self._keys_mm, KEY_MAGIC, self.keys_path)
+            if key_size != keys_key_size:
+                raise VectorProcessingError(f"Key size mismatch in vector store: {self.base_path}")
+
+            self.dim = dim
+            self.key_size = key_size
+            # 書き込み途中で終了した場合に備え、両ファイルで揃っている行数だけを有効とする
+            vec_rows = (len(self._vec_mm) - HEADER_SIZE) // (dim * 4) if dim else 0
+            key_rows = (len(self._keys_mm) - HEADER_SIZE) // key_size
+            self.count = min(vec_rows, key_rows)
+
+            if self.count:
+                self._matrix = np.frombuffer(
+                    self._vec_mm, dtype="<f4", count=self.count * dim, offset=HEADER_SIZE
+                ).reshape(self.count, dim)
+                self._keys = np.frombuffer(
+                    self._keys_mm, dtype=f"S{key_size}", count=self.count, offset=HEADER_SIZE
+                )
+            else:
+                self._matrix = np.empty((0, dim), dtype=np.float32)
+                self._keys = np.empty(0, dtype=f"S{key_size}")
+        except VectorProcessingError:
+            self._close_maps()
+            raise
+        except (OSError, ValueError) as e:
+            self._close_maps()
+            logger.error(f"ベクトルストアを開けません: {self.base_path}", exc_info=True)
+            raise VectorProcessingError(f"Cannot open vector store: {e}") from e
+
+    def _close_maps(self):
+        """mmap を閉じる。外部に行列のビューが残っていて閉じられなければ False を返す"""
+        self._matrix = np.empty((0, self.dim), dtype=np.float32)
+        self._keys = np.empty(0, dtype=f"S{self.key_size}")
+        self.count = 0
+        closed = True
+        for mm in (self._vec_mm, self._keys_mm):
+            if mm is not None:
+                try:
+                    mm.close()
+                except BufferError:
+                    # arrays() / matrix() のビューが使用中。マップは GC に任せる
+                    closed = False
+        self._vec_mm = None
+        self._keys_mm = None
+        return closed
+
+    def close(self):
+        with self._lock:
+            self._close_maps()
+            self._index = None
+
+    # ==================== 参照 ====================
+
+    def _ensure_index(self):
+        """ハッシュ→行インデックスを初回参照時に構築する（後の行が優先）"""
+        if self._index is None:
+            self._index = {k.decode("ascii"): i for i, k in enumerate(self._keys.tolist())}
+        return self._index
+
+    def row_of(self, key):
+        with self._lock:
+            return self._ensure_index().get(key)
+
+    def matrix(self):
+        """保存済みベクトル行列（読み取り専用ビュー）を返す"""
+        return self._matrix
+
+    def arrays(self):
+        """保存済みの (キー配列, ベクトル行列) を同じ時点の組で返す（読み取り専用ビュー）"""
+        with self._lock:
+            return self._keys, self._matrix
+
+    def rows_of(self, keys):
+        """各キーの保存済みの行番号を配列で返す（未保存・未登録は -1）"""
+        with self._lock:
+            index = self._ensure_index()
+            return np.fromiter((index.get(k, -1) for k in keys), dtype=np.int64, count=len(keys))
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._pending or key in self._ensure_index()
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key in self._pending:
+                return self._pending_matrix[self._pending[key]].copy()
+            row = self._ensure_index().get(key)
+            if row is None:
+                raise KeyError(key)
+            return self._matrix[row].copy()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, vec):
+        vec = np.asarray(vec, dtype=np.float32).ravel()
+        with self._lock:
+            if not self.dim:
+                self.dim = vec.shape[0]
+            if vec.shape[0] != self.dim:
+                logger.warning(f"次元数が一致しないベクトルをスキップ: {key} ({vec.shape[0]} != {self.dim})")
+                return
+            if self._pending_rows >= self._pending_matrix.shape[0] or self._pending_matrix.shape[1] != self.dim:
+                grown = np.empty((max(PENDING_INITIAL_ROWS, self._pending_rows * 2), self.dim), dtype=np.float32)
+                if self._pending_rows:
+                    grown[:self._pending_rows] = self._pending_matrix[:self._pending_rows]
+                self._pending_matrix = grown
+            # 既存の行は書き換えない（渡した行ビューの値が変わらないよう、上書きも新しい行に置く）
+            self._pending_matrix[self._pending_rows] = vec
+            self._pending[key] = self._pending_rows
+            self._pending_rows += 1
+
+    def _pending_arrays(self):
+        """未保存分をキー配列と float32 行列で返す"""
+        keys = list(self._pending)
+        key_arr = np.array([_encode_key(k, self.key_size) for k in keys], dtype=f"S{self.key_size}")
+        return key_arr, self._pending_matrix[list(self._pending.values())]
+
+    def _clear_pending(self):
+        self._pending.clear()
+        self._pending_matrix = np.empty((0, 0), dtype=np.float32)
+        self._pending_rows = 0
+
+    def __len__(self):
+        with self._lock:
+            index = self._ensure_index()
+            return len(index) + sum(1 for k in self._pending if k not in index)
+
+    def keys(self):
+        with self._lock:
+            index = self._ensure_index()
+            return list(index) + [k for k in self._pending if k not in index]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def has_pending(self):
+        return bool(self._pending)
+
+    # ==================== 書き込み ====================
+
+    def flush(self):
+        """未保存のベクトルを末尾へ追記する（追加分だけの O(new) 書き込み）"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            key_arr, matrix = self._pending_arrays()
+            if not self.exists():
+                self._write_arrays(key_arr, matrix)
+                return len(key_arr)
+            self._append_arrays(key_arr, matrix)
+            added = len(key_arr)
+        self.maybe_compact_async()
+        return added
+
+    def _append_arrays(self, key_arr, matrix):
+        # 末尾の不完全な行を切り詰めてから追記する（.vec → .keys の順で書き、
+        # 途中終了時は両ファイルの短い方の行数が有効になる）
+        count = self.count
+        index = self._index
+        self._close_maps()
+        try:
+            for path, row_bytes, data in (
+                (self.vec_path, self.dim * 4, np.ascontiguousarray(matrix, dtype="<f4").tobytes()),
+                (self.keys_path, self.key_size, key_arr.tobytes()),
+            ):
+                valid_size = HEADER_SIZE + count * row_bytes
+                with open(path, "r+b") as f:
+                    if os.path.getsize(path) != valid_size:
+                        f.truncate(valid_size)
+                    f.seek(valid_size)
+                    f.write(data)
+            self._clear_pending()
+        except OSError as e:
+            logger.error(f"ベクトルストア追記エラー: {self.base_path}", exc_info=True)
+            raise VectorProcessingError(f"Cannot append to vector store: {e}") from e
+        finally:
+            self._open()
+            if index is not None:
+                # 既存分の索引は変わらないので、追記した行だけを足す（O(new)）
+                for row, k in enumerate(self._keys[count:].tolist(), start=count):
+                    index[k.decode("ascii")] = row
+                self._index = index
+
+    def dead_rows(self):
+        """上書き済みで参照されない行数"""
+        with self._lock:
+            return self.count - len(self._ensure_index())
+
+    def needs_compaction(self):
+        dead = self.dead_rows()
+        return dead >= COMPACTION_MIN_DEAD_ROWS and dead >= self.count * COMPACTION_DEAD_RATIO
+
+    def maybe_compact_async(self):
+        """不要行が閾値を超えていればバックグラウンドでコンパクションする"""
+        if not self.needs_compaction():
+            return False
+        if self._compact_thread and self._compact_thread.is_alive():
+            return False
+        self._compact_thread = threading.Thread(target=self._compact_safe, daemon=True)
+        self._compact_thread.start()
+        return True
+
+    def _compact_safe(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error(f"ベクトルストアのコンパクションに失敗: {e}", exc_info=True)
+
+    def compact(self):
+        """参照される行だけを残してファイルを書き直す
+
+        書き出し中もストアの参照・追記は可能で、その間に追記された行は
+        最後の置き換え時にまとめて引き継ぐ。その間に write_all() / clear() で
+        ストアごと置き換えられた場合は、古い内容で上書きしないよう中止する。
+        戻り値は削除した行数。
+        """
+        with self._lock:
+            live = np.array(sorted(self._ensure_index().values()), dtype=np.int64)
+            snap_count = self.count
+            generation = self._generation
+            keys, matrix = self._keys, self._matrix
+            dim, key_size = self.dim, self.key_size
+        removed = snap_count - len(live)
+        if removed <= 0:
+            return 0
+
+        tmp_vec = self.vec_path + ".compact"
+        tmp_keys = self.keys_path + ".compact"
+        with open(tmp_vec, "wb") as fv, open(tmp_keys, "wb") as fk:
+            fv.write(_pack_header(VEC_MAGIC, dim, key_size))
+            fk.write(_pack_header(KEY_MAGIC, dim, key_size))
+            for start in range(0, len(live), COMPACTION_CHUNK_ROWS):
+                rows = live[start:start + COMPACTION_CHUNK_ROWS]
+                fv.write(np.ascontiguousarray(matrix[rows]).tobytes())
+                fk.write(keys[rows].tobytes())
+        del keys, matrix
+
+        with self._lock:
+            if self._generation != generation:
+                for path in (tmp_vec, tmp_keys):
+                    os.remove(path)
+                logger.info("書き出し中にベクトルストアが置き換えられたため、コンパクションを中止しました")
+                return 0
+            if self.count > snap_count:
+                with open(tmp_vec, "ab") as fv, open(tmp_keys, "ab") as fk:
+                    fv.write(np.ascontiguousarray(self._matrix[snap_count:]).tobytes())
+                    fk.write(self._keys[snap_count:].tobytes())
+            if not self._close_maps():
+                # マップが開いたままでは Windows で置き換えられないので、次の機会に回す
+                self._open()
+                for path in (tmp_vec, tmp_keys):
+                    os.remove(path)
+                logger.info("行列のビューが使用中のため、ベクトルストアのコンパクションを延期しました")
+                return 0
+            try:
+                os.replace(tmp_vec, self.vec_path)
+                os.replace(tmp_keys, self.keys_path)
+            finally:
+                self._open()
+        logger.info(f"ベクトルストアをコンパクションしました: {removed}行を削除")
+        return removed
+
+    def write_all(self, items):
+        """{key: vector} をストアとして書き出す（一時ファイル経由で置き換え）"""
+        with self._lock:
+            key_arr, matrix = self._to_arrays(items)
+            self._generation += 1
+            self._write_arrays(key_arr, matrix)
+            return len(key_arr)
+
+    def _to_arrays(self, items):
+        """{key: vector} をキー配列と float32 行列に変換する（次元不一致は除外）"""
+        keys = list(items.keys())
+        dim = self.dim
+        if keys and not dim:
+            dim = len(items[keys[0]])
+            self.dim = dim
+        matrix = np.empty((len(keys), dim), dtype="<f4")
+        valid = []
+        for key in keys:
+            vec = np.asarray(items[key], dtype="<f4").ravel()
+            if vec.shape[0] != dim:
+                logger.warning(f"次元数が一致しないベクトルをスキップ: {key} ({vec.shape[0]} != {dim})")
+                continue
+            matrix[len(valid)] = vec
+            valid.append(_encode_key(key, self.key_size))
+        return np.array(valid, dtype=f"S{self.key_size}"), matrix[:len(valid)]
+
+    def _write_arrays(self, key_arr, matrix):
+        os.makedirs(os.path.dirname(self.base_path) or ".", exist_ok=True)
+        tmp_vec = self.vec_path + ".tmp"
+        tmp_keys = self.keys_path + ".tmp"
+        try:
+            with open(tmp_vec, "wb") as f:
+                f.write(_pack_header(VEC_MAGIC, self.dim, self.key_size))
+                f.write(np.ascontiguousarray(matrix, dtype="<f4").tobytes())
+            with open(tmp_keys, "wb") as f:
+                f.write(_pack_header(KEY_MAGIC, self.dim, self.key_size))
+                f.write(key_arr.tobytes())
+
+            # Windows では mmap 中のファイルを置き換えられないため先に閉じる
+            self._close_maps()
+            os.replace(tmp_vec, self.vec_path)
+            os.replace(tmp_keys, self.keys_path)
+            self._clear_pending()
+        except OSError as e:
+            logger.error(f"ベクトルストア書き込みエラー: {self.base_path}", exc_info=True)
+            raise VectorProcessingError(f"Cannot write vector store: {e}") from e
+        finally:
+            self._open()
+
+    def clear(self):
+        """ストアファイルを削除する"""
+        with self._lock:
+            self._generation += 1
+            self._close_maps()
+            self._clear_pending()
+            self._index = None
+            for path in (self.vec_path, self.keys_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.dim = 0
+
+    def file_size(self):
+        size = 0
+        for path in (self.vec_path, self.keys_path):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+
+def migrate_json_vectors(json_path, store):
+    """旧形式の vectordata.json をバイナリストアへ一括変換する
+
+    store には VectorFile か、次元数を受け取って格納先の VectorFile（該当なしなら None）を
+    返す関数を渡す。変換後の JSON は ``.migrated`` を付けて退避する。戻り値は変換件数。
+    """
+    if not os.path.exists(json_path):
+        return 0
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except json.JSONDecodeError as e:
+        logger.error(f"旧ベクトルファイルのJSON解析エラー: {json_path}", exc_info=True)
+        raise VectorProcessingError(f"Invalid JSON in vector file: {e}") from e
+    except IOError as e:
+        logger.error(f"旧ベクトルファイル読み込みエラー: {json_path}", exc_info=True)
+        raise VectorProcessingError(f"Cannot read vector file: {e}") from e
+
+    if callable(store):
+        dim = len(next(iter(data.values()))) if data else 0
+        store = store(dim)
+        if store is None:
+            logger.warning(f"旧ベクトルの次元({dim})に対応するモデルが無いため移行しません: {json_path}")
+            return 0
+
+    if not data:
+        written = 0
+    elif store.exists():
+        # 既にデータのある格納先へは、未登録のキーだけを追記する
+        for key, vec in data.items():
+            if key not in store:
+                store[key] = vec
+        written = store.flush()
+    else:
+        written = store.write_all(data)
+    try:
+        os.replace(json_path, json_path + ".migrated")
+    except OSError:
+        logger.warning(f"旧ベクトルファイルを退避できませんでした: {json_path}")
+    logger.info(f"vectordata.json をバイナリストアへ移行しました: {written}/{len(data)}件")
+    return written
@@ -0,0 +1,143 @@
+'''
+PicSorterGUI 仮想化グリッド
+
+項目数がいくら多くても、表示範囲に掛かる行（と前後の余分の行）の分だけカードの
+ウィジェットを作り、スクロールで範囲外に出たカードを範囲内の項目へ使い回す。
+カードの中身は呼び出し側が bind_card(card, index) で差し替える。チェック状態などの
+項目の状態は呼び出し側のモデル（リスト）が持ち、カードはその表示だけを受け持つ。
+'''
+import tkinter as tk
+
+from lib.config_defaults import VIRTUAL_GRID_OVERSCAN_ROWS
+
+
+def visible_rows(top, height, row_height, row_count, overscan=VIRTUAL_GRID_OVERSCAN_ROWS):
+    """スクロール位置 top から高さ height の範囲に掛かる行を (開始, 終了) で返す
+
+    前後に overscan 行ずつ広げ、0 〜 row_count に収める。終了は含まない。
+    """
+    if row_count <= 0 or row_height <= 0 or height <= 0:
+        return 0, 0
+    first = max(0, int(top // row_height) - overscan)
+    last = min(row_count, int(-(-(top + height) // row_height)) + overscan)
+    return first, max(first, last)
+
+
+class VirtualGrid(tk.Frame):
+    """表示範囲のカードだけを作って使い回すスクロールグリッド
+
+    create_card(parent): 空のカード（ウィジェット）を作って返す
+    bind_card(card, index): カードの中身を index 番目の項目に差し替える
+    release_card(card): カードが範囲外に出たときに呼ぶ（省略可。読み込みの取り消しなど）
+    """
+
+    def __init__(self, parent, card_size, create_card, bind_card, release_card=None, padding=5,
+                 overscan=VIRTUAL_GRID_OVERSCAN_ROWS, bg="#ffffff", **kwargs):
+        super().__init__(parent, bg=bg, **kwargs)
+        self.card_width, self.card_height = card_size
+        self.padding = padding
+        self.cell_width = self.card_width + 2 * padding
+        self.cell_height = self.card_height + 2 * padding
+        self.create_card = create_card
+        self.bind_card = bind_card
+        self.release_card = release_card
+        self.overscan = overscan
+
+        self.count = 0
+        self.col_count = 1
+        self._bound = {}  # 項目番号 -> (カード, キャンバス上のウィンドウ ID)
+        self._free = []   # 範囲外に出て使い回しを待つ (カード, ウィンドウ ID)
+
+        self.canvas = tk.Canvas(self, borderwidth=0, highlightthickness=0, bg=bg)
+        self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.canvas.bind("<Configure>", self._on_configure)
+        self.bind_mouse_wheel(self.canvas)
+
+    # ==================== 項目数 / 再描画 ====================
+
+    def set_count(self, count, rebind=True):
+        """項目数を count にする
+
+        rebind=False なら項目の並びは変わらず末尾が増減しただけとみなし、
+        範囲外に出たカードの解放と新しく入った項目のカードの割り当てだけを行う。
+        """
+        self.count = max(0, count)
+        self._update(rebind=rebind)
+
+    def refresh(self):
+        """項目の状態が変わったとき、表示中のカードの中身だけを差し替える"""
+        self._update(rebind=True)
+
+    def scroll_to_top(self):
+        self.canvas.yview_moveto(0)
+        self._update()
+
+    def visible_range(self, overscan=None):
+        """表示範囲（既定では前後の余分を含む）に掛かる項目を (開始, 終了) で返す"""
+        if overscan is None:
+            overscan = self.overscan
+        first, last = visible_rows(self.canvas.canvasy(0), self.canvas.winfo_height(),
+                                   self.cell_height, self._row_count(), overscan)
+        return first * self.col_count, min(self.count, last * self.col_count)
+
+    def _row_count(self):
+        return -(-self.count // self.col_count)
+
+    def _update(self, rebind=False):
+        width = max(self.canvas.winfo_width(), self.cell_width)
+        height = max(self._row_count() * self.cell_height, 1)
+        self.canvas.configure(scrollregion=(0, 0, width, height))
+
+        start, end = self.visible_range()
+        for index in [i for i in self._bound if not start <= i < end]:
+            card, window_id = self._bound.pop(index)
+            self.canvas.itemconfigure(window_id, state="hidden")
+            self._free.append((card, window_id))
+            if self.release_card is not None:
+                self.release_card(card)
+
+        for index in range(start, end):
+            entry = self._bound.get(index)
+            if entry is None:
+                entry = self._free.pop() if self._free else self._new_card()
+                self._bound[index] = entry
+                self.bind_card(entry[0], index)
+            elif rebind:
+                self.bind_card(entry[0], index)
+            row, col = divmod(index, self.col_count)
+            self.canvas.coords(entry[1], col * self.cell_width + self.padding,
+                               row * self.cell_height + self.padding)
+            self.canvas.itemconfigure(entry[1], state="normal")
+
+    def _new_card(self):
+        card = self.create_card(self.canvas)
+        window_id = self.canvas.create_window(0, 0, window=card, anchor="nw",
+                                              width=self.card_width, height=self.card_height)
+        self._bind_wheel_recursive(card)
+        return card, window_id
+
+    # ==================== イベント ====================
+
+    def _on_configure(self, event):
+        self.col_count = max(1, event.width // self.cell_width)
+        self._update()
+
+    def _on_scrollbar(self, *args):
+        self.canvas.yview(*args)
+        self._update()
+
+    def bind_mouse_wheel(self, widget):
+        widget.bind("<MouseWheel>", self._on_mouse_wheel)
+
+    def _bind_wheel_recursive(self, widget):
+        self.bind_mouse_wheel(widget)
+        for child in widget.winfo_children():
+            self._bind_wheel_recursive(child)
+
+    def _on_mouse_wheel(self, event):
+        self.canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+        self._update()
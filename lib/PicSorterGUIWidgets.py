@@ -1,23 +1,33 @@
 
 import os
+import bisect
 import tkinter as tk
 from tkinter import messagebox, ttk, filedialog
 from PIL import Image, ImageTk
 import random
+import numpy as np
 import threading
 import time
 
 from lib.PicSorterGUILogger import get_logger
 from lib.PicSorterGUIState import get_app_state
-from lib.PicSorterGUIAI import (VectorEngine, check_model_cached, download_model,
+from lib.PicSorterGUIAI import (VectorEngine, FeaturePipeline, check_model_cached, download_model,
                                 get_model_cache_dir, apply_model_cache_dir, move_model_files)
 from lib.PicSorterGUILib import GetGazoFiles
-from lib.config_defaults import AI_MODELS, DEFAULT_AI_MODEL, SUPPORTED_IMAGE_FORMATS
+from lib.PicSorterGUIData import VectorStore, model_namespace, rename_file, iter_file_hashes
+from lib.PicSorterGUIImageCache import ImageCache, open_image_reduced
+from lib.PicSorterGUIThumbnailLoader import request_thumbnail, placeholder_image
+from lib.PicSorterGUIVirtualGrid import VirtualGrid
+from lib.PicSorterGUISimilarity import build_candidate_matrix, similarity_scores, select_top
+from lib.PicSorterGUIClustering import SimilarityGraph, get_clustering_engine, benchmark_clustering
+from lib.config_defaults import (AI_MODELS, DEFAULT_AI_MODEL, SUPPORTED_IMAGE_FORMATS,
+                                 CLUSTER_GRAPH_MARGIN, CLUSTER_METHODS, DEFAULT_CLUSTER_METHOD, ANN_TOP_K,
+                                 VISUAL_SORT_PRELOAD_COUNT, VISUAL_SORT_THRESHOLD_INTERVAL_MS)
 
 import sys
 
 try:
-    from PicSorterGUILogic import calculate_file_hash, load_vectors
+    from PicSorterGUILogic import calculate_file_hash
 except ImportError:
     pass
 
@@ -25,6 +35,19 @@ logger = get_logger(__name__)
 app_state = get_app_state()
 
 
+def _candidate_matrix(cache):
+    """AutoSort のベクトルキャッシュから (パス列, 正規化済み候補行列) を返す
+
+    初回だけ作って cache に保持し、グループ詳細やピックアップの度に作り直さない。
+    """
+    if "candidates" not in cache:
+        vec_map = cache["vec_map"]
+        paths = [p for p, h in cache["hash_map"].items() if h in vec_map]
+        vecs = [vec_map[cache["hash_map"][p]] for p in paths]
+        cache["candidates"] = (paths, build_candidate_matrix(vecs))
+    return cache["candidates"]
+
+
 class ModelSelectDialog(tk.Toplevel):
     """AIモデル選択ダイアログ"""
     def __init__(self, parent, current_model_key=None, on_select=None):
@@ -399,33 +422,36 @@ class RowWidget(tk.Frame):
         self._image_loaded = False
         self._thumb_img = None
 
+        # サムネイルは表示するときに load_thumbnail() で読み込みを依頼する
         self.lbl_thumb = tk.Label(self, bg="#dddddd", width=64, height=64) if show_thumb else None
         if self.lbl_thumb:
             self.lbl_thumb.pack(side=tk.LEFT, padx=(0, 5))
-            if show_thumb:
-                self.load_thumbnail()
 
         text = f"[基準] {os.path.basename(filepath)}" if is_target else f"({score:.1%}) {os.path.basename(filepath)}"
         fg = "blue" if is_target else "black"
         self.lbl_text = tk.Label(self, text=text, font=("MS Gothic", 9), anchor="w", bg=self.cget("bg"), fg=fg)
         self.lbl_text.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
-    def load_thumbnail(self):
+    def load_thumbnail(self, priority=0):
+        """サムネイルの読み込みを依頼する（届くまでは無地の画像を表示）"""
         if self._image_loaded: return
-        try:
-            with Image.open(self.filepath) as img:
-                img.thumbnail((64, 64))
-                self._thumb_img = ImageTk.PhotoImage(img)
-                if self.lbl_thumb:
-                    self.lbl_thumb.config(image=self._thumb_img, width=0, height=0)
-        except Exception:
-            pass
         self._image_loaded = True
+        if self.lbl_thumb:
+            self.lbl_thumb.config(image=placeholder_image((64, 64)), width=0, height=0)
+        request_thumbnail(self.winfo_toplevel(), self.filepath, (64, 64), self._on_thumbnail, priority)
+
+    def _on_thumbnail(self, photo):
+        if photo is None: return
+        self._thumb_img = photo
+        if self.lbl_thumb:
+            self.lbl_thumb.config(image=photo, width=0, height=0)
 
     def set_thumbnail_visible(self, visible):
         if visible:
             if not self.lbl_thumb:
                 self.lbl_thumb = tk.Label(self, bg="#dddddd")
+                if self._thumb_img:
+                    self.lbl_thumb.config(image=self._thumb_img)
             self.lbl_thumb.pack(side=tk.LEFT, padx=(0, 5), before=self.lbl_text)
             self.load_thumbnail()
         else:
@@ -501,7 +527,7 @@ class SimilarityMoveDialog(tk.Toplevel):
 
     def prepare_data_thread(self):
         try:
-            from PicSorterGUILogic import calculate_file_hash, load_vectors, save_vectors
+            from PicSorterGUILogic import calculate_file_hash
 
             def update_status(text, loaded_count=0, total_count=0):
                  self.after(0, lambda: self.lb_status.config(text=text))
@@ -509,66 +535,71 @@ class SimilarityMoveDialog(tk.Toplevel):
                      self.after(0, lambda: self.title(f"準備中... {loaded_count}/{total_count}"))
 
             engine = VectorEngine.get_instance()
-            vectors = load_vectors()
+            vectors = VectorStore.get_instance().bind(engine.model_key)
 
             t_hash = calculate_file_hash(self.target_file)
+            all_items = os.listdir(self.folder_path)
+            files = GetGazoFiles(all_items, self.folder_path)
+            total = len(files)
+            paths = [os.path.join(self.folder_path, f) for f in files]
+            paths = [p for p in paths if p != self.target_file]
+            # キーは 1 回だけ求め、近傍リストでの表示と通常の計算の両方で使う
+            update_status("キーを確認中...")
+            hashed = list(iter_file_hashes(paths))
+            if self.stop_thread: return
+            if self._show_stored_neighbours(vectors, t_hash, hashed):
+                return
             if t_hash not in vectors:
                  vec = engine.get_image_feature(self.target_file)
-                 if vec: vectors[t_hash] = vec
+                 if vec is not None: vectors.put(t_hash, vec)
             t_vec = vectors.get(t_hash)
 
-            if not t_vec:
+            if t_vec is None:
                 self.after(0, lambda: messagebox.showerror("エラー", "基準画像のベクトル計算に失敗しました"))
                 self.after(0, self.destroy)
                 return
 
-            all_items = os.listdir(self.folder_path)
-            files = GetGazoFiles(all_items, self.folder_path)
-            total = len(files)
-
-            candidates_data = []
+            cand_paths = []
+            cand_vecs = []
             vectors_updated = False
 
             start_time = time.time()
             chunk_start_time = start_time
 
             count = 0
-            for i, f in enumerate(files):
-                if self.stop_thread: return
-
-                full = os.path.join(self.folder_path, f)
-                if full == self.target_file: continue
-
-                h = calculate_file_hash(full)
-                if h not in vectors:
-                    try:
-                        vec = engine.get_image_feature(full)
-                        if vec:
-                            vectors[h] = vec
-                            vectors_updated = True
-                    except Exception as e:
-                        logger.warning(f"オンデマンドベクトル計算失敗: {f} - {e}")
-
-                if h in vectors:
-                    score = engine.compare_features(t_vec, vectors[h])
-                    candidates_data.append((full, score))
+            pipeline = FeaturePipeline(engine, vectors, should_stop=lambda: self.stop_thread)
+            items = ((h, full) for full, h in hashed)
 
+            for h, full, vec, is_new in pipeline.run(items):
+                if self.stop_thread: return
                 count += 1
 
+                if vec is None:
+                    if h is not None:
+                        logger.warning(f"オンデマンドベクトル計算失敗: {os.path.basename(full)}")
+                else:
+                    vectors_updated = vectors_updated or is_new
+                    cand_paths.append(full)
+                    cand_vecs.append(vec)
+
                 if count % 10 == 0:
                     current = time.time()
                     elapsed = current - chunk_start_time
                     chunk_start_time = current
                     update_status(f"計算中... {count}/{total}", count, total)
 
+            if self.stop_thread: return
+
             if vectors_updated:
                 self.after(0, lambda: self.lb_status.config(text="ベクトル保存中..."))
                 try:
-                    save_vectors(vectors)
+                    vectors.flush()
                 except Exception as e:
                     logger.error(f"ベクトル保存エラー: {e}")
 
-            candidates_data.sort(key=lambda x: x[1], reverse=True)
+            # 候補をまとめて 1 回の行列×ベクトル積でスコア化する
+            scores = similarity_scores(t_vec, build_candidate_matrix(cand_vecs, len(t_vec)))
+            candidates_data = [(cand_paths[i], float(scores[i])) for i in select_top(scores).tolist()]
 
             self.after(0, lambda: self.finalize_preparation(candidates_data))
 
@@ -577,30 +608,70 @@ class SimilarityMoveDialog(tk.Toplevel):
             self.after(0, lambda: messagebox.showerror("エラー", f"データ準備中にエラー: {e}"))
             self.after(0, self.destroy)
 
-    def finalize_preparation(self, candidates_data):
+    def _show_stored_neighbours(self, vectors, t_hash, hashed):
+        """フォルダ内の全画像のベクトルが保存済みなら、推論せずに一覧を作る
+
+        hashed は基準画像以外の (パス, キー) のリスト。近傍リストに基準画像があれば、
+        まずその近傍（ライブラリ全体での上位）を表示し、続けて残りの候補を
+        1 回の行列×ベクトル積で厳密に採点して加える。
+        ベクトルの無い画像があれば False を返し、通常の計算に任せる。
+        """
+        key_paths = {}
+        for full, h in hashed:
+            if h is None:
+                return False
+            key_paths.setdefault(h, []).append(full)
+        if t_hash not in vectors or not all(key in vectors for key in key_paths):
+            return False
+        neighbours = vectors.neighbours(t_hash, list(key_paths))
+        if neighbours is None or self.stop_thread:
+            return False
+
+        first = [(path, score) for key, score in neighbours for path in key_paths[key]]
+        logger.info(f"近傍リストから類似画像を表示します: {len(first)}件")
+        self.after(0, lambda: self.finalize_preparation(first, complete=False))
+
+        shown = {key for key, _ in neighbours}
+        rest = vectors.score(vectors[t_hash], [key for key in key_paths if key not in shown])
+        if self.stop_thread:
+            return True
+        rest_data = [(path, score) for key, score in rest for path in key_paths[key]]
+        self.after(0, lambda: self.finalize_preparation(rest_data))
+        return True
+
+    def finalize_preparation(self, candidates_data, complete=True):
+        """候補を一覧に加える。complete=False なら残りの採点中として移動はまだ許可しない"""
         if self.stop_thread: return
 
-        self.is_calculating = False
+        # 残りの採点が終わるまでは計算中のまま（しきい値の変更は完了時にまとめて反映する）
+        self.is_calculating = not complete
         self.lb_status.config(text="リスト構築中...")
         self.title("スマート移動 - 類似画像も一緒に移動")
 
-        self.row_widgets.append(RowWidget(self.scroll_frame.scrollable_frame, self.target_file, 1.0, is_target=True, show_thumb=self.var_show_thumb.get()))
+        if not self.row_widgets:
+            self.row_widgets.append(RowWidget(self.scroll_frame.scrollable_frame, self.target_file, 1.0, is_target=True, show_thumb=self.var_show_thumb.get()))
 
         for f, score in candidates_data:
             rw = RowWidget(self.scroll_frame.scrollable_frame, f, score, show_thumb=self.var_show_thumb.get())
             self.row_widgets.append(rw)
+        # 基準画像を先頭に、後から加えた候補も含めてスコア順に並べ直す
+        self.row_widgets.sort(key=lambda rw: (not rw.is_target, -rw.score))
 
-        self.btn_execute.config(state=tk.NORMAL)
-        self.update_list_filter()
-        self.lb_status.config(text="準備完了")
+        self.update_list_filter(force=True)
+        if complete:
+            self.btn_execute.config(state=tk.NORMAL)
+            self.lb_status.config(text="準備完了")
+        else:
+            self.lb_status.config(text="近傍リストから表示中（残りを計算中...）")
 
     def update_thumbnail_visibility(self):
         show = self.var_show_thumb.get()
         for rw in self.row_widgets:
             rw.set_thumbnail_visible(show)
 
-    def update_list_filter(self):
-        if self.is_calculating: return
+    def update_list_filter(self, force=False):
+        """しきい値以上の行を表示する。計算中は force=True のときだけ並べ直す"""
+        if self.is_calculating and not force: return
 
         threshold = self.var_threshold.get()
         count = 0
@@ -620,10 +691,11 @@ class SimilarityMoveDialog(tk.Toplevel):
         for child in self.scroll_frame.scrollable_frame.winfo_children():
             child.pack_forget()
 
-        for rw in visible_widgets:
+        # 上の行から順に読み込まれるよう、表示順を優先度にする
+        for order, rw in enumerate(visible_widgets):
             rw.pack(fill=tk.X, expand=True)
             if rw.show_thumb:
-                rw.load_thumbnail()
+                rw.load_thumbnail(priority=order)
 
         self.lb_status.config(text=f"移動対象: {count}件")
 
@@ -668,6 +740,7 @@ class GroupDetailWindow(tk.Toplevel):
         self.parent_dialog = parent_dialog
         self.group = group
         self._thumb_refs = []
+        self._thumb_jobs = []  # 読み込み中のサムネイル（再描画時に取り消す）
         self._member_vars = []  # 各画像のチェック状態
         self._thumb_size = 100  # サムネイルサイズ（ホイールで変更可能）
         self._exec_thread = None
@@ -700,20 +773,16 @@ class GroupDetailWindow(tk.Toplevel):
             return
         hash_map = cache["hash_map"]
         vec_map = cache["vec_map"]
-        engine = cache["engine"]
 
         seed_hash = hash_map.get(self._seed_path)
         if not seed_hash or seed_hash not in vec_map:
             return
         seed_vec = vec_map[seed_hash]
 
-        for path, h in hash_map.items():
-            if path == self._seed_path:
-                self._all_similarities[path] = 1.0
-                continue
-            if h in vec_map:
-                sim = engine.compare_features(seed_vec, vec_map[h])
-                self._all_similarities[path] = sim
+        paths, matrix = _candidate_matrix(cache)
+        scores = similarity_scores(seed_vec, matrix)
+        self._all_similarities.update(zip(paths, scores.tolist()))
+        self._all_similarities[self._seed_path] = 1.0
 
     def _build_ui(self):
         # ヘッダー
@@ -890,6 +959,9 @@ class GroupDetailWindow(tk.Toplevel):
         self._prev_members = list(self.group["members"])
 
         # 内部フレームをクリア
+        for job in self._thumb_jobs:
+            job.cancel()
+        self._thumb_jobs = []
         for w in self._inner.winfo_children():
             w.destroy()
         self._thumb_refs = []
@@ -906,21 +978,16 @@ class GroupDetailWindow(tk.Toplevel):
             cell.grid(row=r, column=c, sticky="nsew")
             cell.bind("<MouseWheel>", self._mousewheel_handler)
 
-            # サムネイル
-            try:
-                with Image.open(path) as img:
-                    img.thumbnail((size, size))
-                    tk_img = ImageTk.PhotoImage(img)
-                    self._thumb_refs.append(tk_img)
-                    lbl = tk.Label(cell, image=tk_img, bg="#ffffff",
-                                   cursor="hand2")
-                    lbl.pack()
-                    lbl.bind("<MouseWheel>", self._mousewheel_handler)
-                    lbl.bind("<Button-1>",
-                             lambda e, p=path: self._preview_image(p))
-            except Exception:
-                tk.Label(cell, text="?", bg="#eeeeee",
-                         width=size // 8, height=size // 16).pack()
+            # サムネイル（届くまでは無地の画像、上の行から順に読み込む）
+            lbl = tk.Label(cell, image=placeholder_image((size, size)), bg="#ffffff",
+                           cursor="hand2")
+            lbl.pack()
+            lbl.bind("<MouseWheel>", self._mousewheel_handler)
+            lbl.bind("<Button-1>",
+                     lambda e, p=path: self._preview_image(p))
+            self._thumb_jobs.append(request_thumbnail(
+                self, path, (size, size),
+                lambda photo, l=lbl: self._set_cell_thumbnail(l, photo, size), priority=i))
 
             # 類似度表示
             sim = self._all_similarities.get(path)
@@ -952,6 +1019,15 @@ class GroupDetailWindow(tk.Toplevel):
         for c in range(cols):
             self._inner.columnconfigure(c, weight=1)
 
+    def _set_cell_thumbnail(self, lbl, photo, size):
+        if photo is None:
+            lbl.config(image="", text="?", bg="#eeeeee", cursor="",
+                       width=size // 8, height=size // 16)
+            lbl.unbind("<Button-1>")
+            return
+        self._thumb_refs.append(photo)
+        lbl.config(image=photo)
+
     def _preview_image(self, path):
         """画像をプレビュー表示"""
         try:
@@ -1156,7 +1232,7 @@ class GroupDetailWindow(tk.Toplevel):
                                 new_name = f"{word}{sep}{num}{sep}{stem}{ext}"
                             else:
                                 new_name = f"{stem}{sep}{word}{sep}{num}{ext}"
-                            os.rename(fp, os.path.join(dirname, new_name))
+                            rename_file(fp, os.path.join(dirname, new_name))
                             rename_count += 1
                         except Exception:
                             pass
@@ -1296,6 +1372,22 @@ class AutoSortDialog(tk.Toplevel):
         self.bind("<Left>", _on_left)
         self.bind("<Right>", _on_right)
 
+        # 分類方法
+        frame_method = tk.Frame(self)
+        frame_method.pack(fill=tk.X, padx=12, pady=(6, 0))
+        tk.Label(frame_method, text="分類方法:", font=("MS Gothic", 9)).pack(side=tk.LEFT)
+        self.var_method = tk.StringVar(value=CLUSTER_METHODS[DEFAULT_CLUSTER_METHOD]["name"])
+        self.cb_method = ttk.Combobox(frame_method, textvariable=self.var_method, state="readonly",
+                                      values=[m["name"] for m in CLUSTER_METHODS.values()],
+                                      font=("MS Gothic", 9), width=12)
+        self.cb_method.pack(side=tk.LEFT, padx=(4, 6))
+        self.lbl_method_desc = tk.Label(frame_method, font=("MS Gothic", 7), fg="#888888", anchor="w",
+                                        text=CLUSTER_METHODS[DEFAULT_CLUSTER_METHOD]["description"],
+                                        wraplength=330, justify=tk.LEFT)
+        self.lbl_method_desc.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.cb_method.bind("<<ComboboxSelected>>", lambda e: self.lbl_method_desc.config(
+            text=CLUSTER_METHODS[self._selected_method()]["description"]))
+
         # 統計表示
         frame_stats = tk.Frame(self, bd=1, relief=tk.SUNKEN, padx=10, pady=8)
         frame_stats.pack(fill=tk.X, padx=12, pady=8)
@@ -1362,13 +1454,26 @@ class AutoSortDialog(tk.Toplevel):
         self._set_status("停止中...")
         self._log("--- 停止要求を受け付けました ---")
 
+    def _selected_method(self):
+        """コンボボックスで選択中の分類方法のキー"""
+        name = self.var_method.get()
+        for key, info in CLUSTER_METHODS.items():
+            if info["name"] == name:
+                return key
+        return DEFAULT_CLUSTER_METHOD
+
+    def _set_controls_state(self, state):
+        """しきい値スライダーと分類方法の有効/無効を切り替える"""
+        self.scale.config(state=state)
+        self.cb_method.config(state="readonly" if state == tk.NORMAL else tk.DISABLED)
+
     def _start_analysis(self):
         """分析を開始（初回はベクトル計算+クラスタリング、2回目以降はクラスタリングのみ）"""
         if self._thread and self._thread.is_alive():
             messagebox.showinfo("処理中", "現在処理中です。完了までお待ちください。", parent=self)
             return
         self.stop_flag = False
-        self.scale.config(state=tk.DISABLED)
+        self._set_controls_state(tk.DISABLED)
         self.btn_action.config(text="停止", command=self._stop, state=tk.NORMAL)
         self.btn_close.config(state=tk.DISABLED)
         self._thread = threading.Thread(target=self._run_sort, daemon=True)
@@ -1397,13 +1502,11 @@ class AutoSortDialog(tk.Toplevel):
             self.btn_action.config(text="分析開始", command=self._start_analysis,
                                    state=tk.NORMAL)
             self.btn_close.config(text="閉じる", state=tk.NORMAL)
-            self.scale.config(state=tk.NORMAL)
+            self._set_controls_state(tk.NORMAL)
         self.after(0, _ui)
 
     def _run_sort(self):
         try:
-            from PicSorterGUILogic import calculate_file_hash, load_vectors, save_vectors
-
             # ベクトル計算（初回のみ）
             if self._vec_cache is None:
                 self._set_status("画像を読み込み中...")
@@ -1423,20 +1526,19 @@ class AutoSortDialog(tk.Toplevel):
                 self._set_status("AIモデルを準備中...")
                 engine = VectorEngine.get_instance()
 
-                try:
-                    vectors = load_vectors()
-                except Exception:
-                    vectors = {}
+                vectors = VectorStore.get_instance().bind(engine.model_key)
 
                 full_paths = [os.path.join(self.folder, f) for f in files]
                 hash_map = {}
                 vec_map = {}
 
+                pipeline = FeaturePipeline(engine, vectors, should_stop=lambda: self.stop_flag)
+                items = ((h, path) for path, h in iter_file_hashes(full_paths))
+
                 start_time = time.time()
-                for i, path in enumerate(full_paths):
+                for i, (h, path, vec, _) in enumerate(pipeline.run(items)):
                     if self.stop_flag:
-                        self._finish(stopped=True)
-                        return
+                        break
 
                     # 経過時間と推定残り時間
                     elapsed = time.time() - start_time
@@ -1452,23 +1554,24 @@ class AutoSortDialog(tk.Toplevel):
                     fname = os.path.basename(path)
                     self._set_status(
                         f"ベクトル計算中... {i+1}/{total} {fname}{time_info}")
-                    try:
-                        h = calculate_file_hash(path)
-                        hash_map[path] = h
-                        if h not in vectors:
-                            vec = engine.get_image_feature(path)
-                            if vec:
-                                vectors[h] = vec
-                        if h in vectors:
-                            vec_map[h] = vectors[h]
-                    except Exception as e:
-                        self._log(f"スキップ: {os.path.basename(path)} ({e})")
+                    if h is None:
+                        self._log(f"スキップ: {fname} (ハッシュ計算失敗)")
+                        continue
+                    hash_map[path] = h
+                    if vec is None:
+                        self._log(f"スキップ: {fname} (ベクトル計算失敗)")
+                    else:
+                        vec_map[h] = vec
+
+                if self.stop_flag:
+                    self._finish(stopped=True)
+                    return
 
                 total_elapsed = time.time() - start_time
                 self._log(f"ベクトル計算完了: {self._format_elapsed(total_elapsed)}")
 
                 try:
-                    save_vectors(vectors)
+                    vectors.flush()
                 except Exception:
                     pass
 
@@ -1484,7 +1587,6 @@ class AutoSortDialog(tk.Toplevel):
             # キャッシュからデータ取得
             hash_map = self._vec_cache["hash_map"]
             vec_map = self._vec_cache["vec_map"]
-            engine = self._vec_cache["engine"]
 
             # 移動・リネーム済みファイルを除外（現在フォルダに存在するもののみ）
             current_files = set()
@@ -1508,64 +1610,58 @@ class AutoSortDialog(tk.Toplevel):
             threshold = self.var_threshold.get()
             self._log(f"しきい値: {threshold*100:.0f}%  対象: {len(full_paths)}枚")
 
-            # 貪欲クラスタリング（全画像対象）
-            unprocessed = list(full_paths)
-            unprocessed_set = set(full_paths)
-            group_count = 0
-            isolated_count = 0
-            processed_count = 0
-            groups = []
-
-            self._set_stats(total=len(full_paths), processed=0, groups=0, isolated=0)
-            self._set_status("グループ分析中...")
-
-            while unprocessed and not self.stop_flag:
-                while unprocessed and unprocessed[0] not in unprocessed_set:
-                    unprocessed.pop(0)
-                if not unprocessed:
-                    break
-
-                seed_path = unprocessed.pop(0)
-                unprocessed_set.discard(seed_path)
-
-                seed_hash = hash_map.get(seed_path)
-                if not seed_hash or seed_hash not in vec_map:
-                    isolated_count += 1
-                    processed_count += 1
-                    self._set_stats(processed=processed_count, isolated=isolated_count)
-                    continue
-
-                seed_vec = vec_map[seed_hash]
+            # 類似度グラフ（初回、または前回の下限より低いしきい値のときだけ作る）
+            graph = self._vec_cache.get("graph")
+            if graph is None or not graph.covers(threshold):
+                graph_paths = [p for p in self._vec_cache["full_paths"] if hash_map.get(p) in vec_map]
+                floor = max(0.0, threshold - CLUSTER_GRAPH_MARGIN)
+                self._set_status("類似度グラフ作成中...")
+                start_time = time.time()
+                graph = SimilarityGraph.build(
+                    build_candidate_matrix([vec_map[hash_map[p]] for p in graph_paths]),
+                    floor, keep_threshold=threshold, should_stop=lambda: self.stop_flag,
+                    progress=lambda done, n_edges: self._set_status(
+                        f"類似度グラフ作成中... {done}/{len(graph_paths)}  ({n_edges:,}組)"))
+                if graph is None:
+                    self._finish(stopped=True)
+                    return
+                self._vec_cache["graph"] = graph
+                self._vec_cache["graph_paths"] = graph_paths
+                self._log(f"類似度グラフ作成: {len(graph):,}組 (下限 {graph.floor*100:.0f}%)  "
+                          f"{self._format_elapsed(time.time() - start_time)}")
+            else:
+                self._log(f"作成済みの類似度グラフを使用 ({len(graph):,}組)")
+            graph_paths = self._vec_cache["graph_paths"]
 
-                similar_paths = []
-                for candidate in unprocessed:
-                    if candidate not in unprocessed_set:
-                        continue
-                    c_hash = hash_map.get(candidate)
-                    if not c_hash or c_hash not in vec_map:
-                        continue
-                    if engine.compare_features(seed_vec, vec_map[c_hash]) >= threshold:
-                        similar_paths.append(candidate)
+            # クラスタリング（全画像対象、ベクトルの無い画像は孤立扱い）
+            active = np.array([p in current_files for p in graph_paths], dtype=bool)
+            vec_paths = graph_paths
+            no_vec_count = len(full_paths) - int(active.sum())
 
-                processed_count += 1
+            self._set_stats(total=len(full_paths), processed=no_vec_count, groups=0, isolated=no_vec_count)
+            method = get_clustering_engine(self._selected_method())
+            self._set_status(f"グループ分析中（{method.name}）...")
+            self._log(f"分類方法: {method.name}")
 
-                if similar_paths:
-                    group_count += 1
-                    group_members = [seed_path] + similar_paths
-                    groups.append({
-                        "group_num": group_count,
-                        "members": group_members,
-                    })
-                    self._log(f"グループ {group_count}: {len(group_members)}枚")
+            def on_progress(processed, n_groups, n_isolated):
+                self._set_stats(processed=no_vec_count + processed, groups=n_groups,
+                                isolated=no_vec_count + n_isolated)
 
-                    for fp in similar_paths:
-                        unprocessed_set.discard(fp)
+            start_time = time.time()
+            clusters, isolated_rows = method.cluster(
+                graph, threshold, active=active, should_stop=lambda: self.stop_flag, progress=on_progress)
+            self._log(f"グループ分析: {self._format_elapsed(time.time() - start_time)}")
 
-                    processed_count += len(similar_paths)
-                    self._set_stats(processed=processed_count, groups=group_count)
-                else:
-                    isolated_count += 1
-                    self._set_stats(processed=processed_count, isolated=isolated_count)
+            groups = []
+            for rows in clusters:
+                group_members = [vec_paths[r] for r in rows]
+                groups.append({
+                    "group_num": len(groups) + 1,
+                    "members": group_members,
+                })
+                self._log(f"グループ {len(groups)}: {len(group_members)}枚")
+            isolated_count = no_vec_count + len(isolated_rows)
+            self._vec_cache["active"] = active
 
             if self.stop_flag:
                 self._finish(stopped=True)
@@ -1592,16 +1688,23 @@ class AutoSortDialog(tk.Toplevel):
         for child in widget.winfo_children():
             self._bind_wheel_recursive(child, handler)
 
-    def _load_thumbnail(self, path, size=(64, 64)):
-        """サムネイル画像を読み込んでImageTk.PhotoImageを返す"""
-        try:
-            with Image.open(path) as img:
-                img.thumbnail(size)
-                tk_img = ImageTk.PhotoImage(img)
-                self._thumb_refs.append(tk_img)
-                return tk_img
-        except Exception:
-            return None
+    def _load_thumbnail(self, label, path, size=(64, 64), priority=0, refs=None):
+        """label に無地の画像を表示し、サムネイルの読み込みを依頼する
+
+        読み込めたら label の画像を差し替えて参照を refs（既定は _thumb_refs）に保持し、
+        読み込めなければ label を隠す。
+        """
+        refs = self._thumb_refs if refs is None else refs
+        label.config(image=placeholder_image(size))
+
+        def _on_ready(photo):
+            if photo is None:
+                label.pack_forget()
+                return
+            refs.append(photo)
+            label.config(image=photo)
+
+        return request_thumbnail(self, path, size, _on_ready, priority)
 
     def _show_confirmation(self):
         """クラスタリング結果の確認UIを表示（サムネイル付き、クリックで詳細）"""
@@ -1727,11 +1830,10 @@ class AutoSortDialog(tk.Toplevel):
             row.pack(fill=tk.X, padx=6, pady=2)
 
             # サムネイル
-            thumb = self._load_thumbnail(group["members"][0])
-            if thumb:
-                lbl_img = tk.Label(row, image=thumb, bg="#f0f4ff", cursor="hand2")
-                lbl_img.pack(side=tk.LEFT, padx=(4, 6), pady=2)
-                lbl_img.bind("<Button-1>", lambda e, g=group: self._open_group_detail(g))
+            lbl_img = tk.Label(row, bg="#f0f4ff", cursor="hand2")
+            lbl_img.pack(side=tk.LEFT, padx=(4, 6), pady=2)
+            lbl_img.bind("<Button-1>", lambda e, g=group: self._open_group_detail(g))
+            self._load_thumbnail(lbl_img, group["members"][0], priority=len(self._group_vars))
 
             cb = tk.Checkbutton(
                 row, variable=var, bg="#f0f4ff", activebackground="#f0f4ff",
@@ -1786,8 +1888,8 @@ class AutoSortDialog(tk.Toplevel):
             # 行内の全ウィジェットにホイールバインド
             self._bind_wheel_recursive(row, self._confirm_wheel_handler)
 
-        # 閾値スライダーを有効化
-        self.scale.config(state=tk.NORMAL)
+        # 閾値スライダー・分類方法を有効化
+        self._set_controls_state(tk.NORMAL)
 
         # ボタンを差し替え: 「再分析」「実行」「閉じる」
         for w in self._btn_frame.winfo_children():
@@ -1796,6 +1898,9 @@ class AutoSortDialog(tk.Toplevel):
         self.btn_reanalyze = tk.Button(self._btn_frame, text="再分析", width=10,
                                        command=self._start_reanalyze, font=("MS Gothic", 10))
         self.btn_reanalyze.pack(side=tk.LEFT, padx=5)
+        self.btn_benchmark = tk.Button(self._btn_frame, text="手法比較", width=8,
+                                       command=self._start_benchmark, font=("MS Gothic", 10))
+        self.btn_benchmark.pack(side=tk.LEFT, padx=5)
         self.btn_action = tk.Button(self._btn_frame, text="実行", width=14,
                                     command=self._execute_selected, font=("MS Gothic", 10))
         self.btn_action.pack(side=tk.LEFT, padx=5)
@@ -1888,22 +1993,16 @@ class AutoSortDialog(tk.Toplevel):
 
         hash_map = cache["hash_map"]
         vec_map = cache["vec_map"]
-        engine = cache["engine"]
         seed_hash = hash_map.get(seed_path)
         if not seed_hash or seed_hash not in vec_map:
             return
         seed_vec = vec_map[seed_hash]
 
         # 全画像との類似度を計算し上位10件を取得
-        sims = []
-        for path, h in hash_map.items():
-            if path == seed_path:
-                continue
-            if h in vec_map:
-                sim = engine.compare_features(seed_vec, vec_map[h])
-                sims.append((path, sim))
-        sims.sort(key=lambda x: x[1], reverse=True)
-        top10 = sims[:10]
+        paths, matrix = _candidate_matrix(cache)
+        scores = similarity_scores(seed_vec, matrix)
+        top10 = [(paths[i], float(scores[i])) for i in select_top(scores, 11).tolist()
+                 if paths[i] != seed_path][:10]
 
         if not top10:
             tk.Label(frame, text="類似画像なし", font=("MS Gothic", 8),
@@ -1919,18 +2018,13 @@ class AutoSortDialog(tk.Toplevel):
         thumb_row = tk.Frame(frame, bg="#e8ecf8")
         thumb_row.pack(fill=tk.X, padx=4, pady=2)
 
-        for path, sim in top10:
+        for rank, (path, sim) in enumerate(top10):
             cell = tk.Frame(thumb_row, bg="#e8ecf8")
             cell.pack(side=tk.LEFT, padx=1)
-            try:
-                with Image.open(path) as img:
-                    img.thumbnail((50, 50))
-                    tk_img = ImageTk.PhotoImage(img)
-                    self._group_pickup_refs[idx].append(tk_img)
-                    lbl = tk.Label(cell, image=tk_img, bg="#e8ecf8")
-                    lbl.pack()
-            except Exception:
-                tk.Label(cell, text="?", bg="#ddd", width=6, height=3).pack()
+            lbl = tk.Label(cell, bg="#e8ecf8")
+            lbl.pack()
+            self._load_thumbnail(lbl, path, (50, 50), priority=rank,
+                                 refs=self._group_pickup_refs[idx])
             tk.Label(cell, text=f"{sim*100:.0f}%", font=("MS Gothic", 6),
                      bg="#e8ecf8", fg="#666666").pack()
 
@@ -1986,11 +2080,47 @@ class AutoSortDialog(tk.Toplevel):
 
         self._log(f"\n--- 再分析開始 (しきい値: {self.var_threshold.get()*100:.0f}%) ---")
         self.stop_flag = False
-        self.scale.config(state=tk.DISABLED)
+        self._set_controls_state(tk.DISABLED)
         self.geometry("520x560")
         self._thread = threading.Thread(target=self._run_sort, daemon=True)
         self._thread.start()
 
+    def _start_benchmark(self):
+        """同じフォルダ・しきい値で全分類方法を実行し、所要時間とグループ数を比較表示する"""
+        cache = self._vec_cache
+        if not cache or "graph" not in cache:
+            return
+        threshold = self.var_threshold.get()
+        if not cache["graph"].covers(threshold):
+            messagebox.showinfo("手法比較", "しきい値を下げたため類似度グラフの作り直しが必要です。\n"
+                                "先に「再分析」を実行してください。", parent=self)
+            return
+        self.btn_benchmark.config(state=tk.DISABLED)
+
+        def _task():
+            try:
+                results = benchmark_clustering(cache["graph"], threshold, active=cache.get("active"))
+            except Exception as e:
+                logger.error(f"手法比較エラー: {e}", exc_info=True)
+                results = None
+
+            def _ui():
+                if not self.winfo_exists():
+                    return
+                self.btn_benchmark.config(state=tk.NORMAL)
+                if results is None:
+                    messagebox.showerror("手法比較", "手法比較中にエラーが発生しました", parent=self)
+                    return
+                lines = [f"しきい値 {threshold*100:.0f}%  ({len(cache['graph_paths'])}枚)", ""]
+                for r in results:
+                    lines.append(f"{r['name']}: {r['seconds']*1000:.0f}ms  グループ{r['groups']}件 "
+                                 f"({r['grouped']}枚, 最大{r['largest']}枚)  孤立{r['isolated']}枚")
+                    logger.info(f"手法比較 {r['key']}: {r}")
+                messagebox.showinfo("手法比較", "\n".join(lines), parent=self)
+            self.after(0, _ui)
+
+        threading.Thread(target=_task, daemon=True).start()
+
     def _format_elapsed(self, seconds):
         """秒数を 分:秒 or 時:分:秒 の文字列に変換"""
         s = int(seconds)
@@ -2199,7 +2329,7 @@ class AutoSortDialog(tk.Toplevel):
                                 new_name = f"{stem}{sep}{word}{sep}{num}{ext}"
 
                             new_path = os.path.join(dirname, new_name)
-                            os.rename(fp, new_path)
+                            rename_file(fp, new_path)
                             total_rename_count += 1
                         except Exception as e:
                             self._log(f"  リネーム失敗: {os.path.basename(fp)} ({e})")
@@ -2336,54 +2466,37 @@ class VisualSortWindow(tk.Toplevel):
         self.init_status_bar()
         self.init_bottom_frame()
 
-        self.candidates = []
         self.is_loading = False
         self.stop_thread = False
+        # 表示のモデル: スコア降順の結果と同じ並びのチェック状態。しきい値以上の結果は
+        # 先頭から visible_count 件で、スコアの符号を反転した昇順の列を二分探索して求める
         self.all_results = []
+        self.selected = []
+        self._neg_scores = []
+        self.visible_count = 0
         self.score_boundaries = []
-
-        self.col_count = 5
-        self.bind("<Configure>", self.on_resize)
-        self.resize_timer = None
+        self._threshold_job = None
 
         self.start_analysis()
 
     def on_refresh(self):
         if self.is_loading: return
 
-        for widget in self.grid_frame.winfo_children():
-            widget.destroy()
-        self.candidates = []
         self.all_results = []
+        self.selected = []
+        self._neg_scores = []
+        self.visible_count = 0
+        self.grid_view.set_count(0)
 
         self.start_analysis()
 
-    def on_resize(self, event):
-        if self.resize_timer:
-            self.after_cancel(self.resize_timer)
-        self.resize_timer = self.after(200, self._process_resize)
-
-    def _process_resize(self):
-        try:
-            width = self.scroll_view.winfo_width()
-            if width <= 100: return
-
-            card_width = 220
-            new_col_count = max(1, width // card_width)
-
-            if new_col_count != self.col_count:
-                self.col_count = new_col_count
-                self.refresh_grid()
-        except:
-            pass
-
     def init_top_frame(self):
         self.canvas_target = tk.Canvas(self.frame_top, bg="#222222", highlightthickness=0)
         self.canvas_target.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
         try:
-            pil_img = Image.open(self.target_file)
             base_height = 280
+            pil_img = open_image_reduced(self.target_file, (1, base_height), fit="cover")
             h_percent = (base_height / float(pil_img.size[1]))
             w_size = int((float(pil_img.size[0]) * float(h_percent)))
             pil_img = pil_img.resize((w_size, base_height), Image.Resampling.LANCZOS)
@@ -2479,10 +2592,10 @@ class VisualSortWindow(tk.Toplevel):
         self.lbl_detail_progress.config(text="")
 
     def init_bottom_frame(self):
-        self.scroll_view = ScrollableFrame(self.frame_bot)
-        self.scroll_view.pack(fill=tk.BOTH, expand=True)
-
-        self.grid_frame = self.scroll_view.scrollable_frame
+        # 表示範囲のカードだけを作り、スクロールに合わせて使い回す
+        self.grid_view = VirtualGrid(self.frame_bot, (200, 220), self.create_image_card,
+                                     self.bind_image_card, self.release_image_card, bg="#dddddd")
+        self.grid_view.pack(fill=tk.BOTH, expand=True)
 
     def start_analysis(self):
         self.lbl_status.config(text="AI分析中...")
@@ -2492,12 +2605,37 @@ class VisualSortWindow(tk.Toplevel):
     def _analysis_task(self):
         try:
             from PicSorterGUILogic import (
-                calculate_file_hash, load_vectors, save_vectors,
-                load_analysis_cache, save_analysis_cache
+                calculate_file_hash, load_analysis_cache, load_unchanged_analysis,
+                save_analysis_cache, directory_digests
             )
 
             folder = os.path.dirname(self.target_file)
             folder_name = os.path.basename(folder)
+            ref_folders = self.app_state.reference_folders
+
+            # キャッシュキーにフォルダ情報を含める
+            ref_key = folder
+            if ref_folders:
+                sorted_refs = sorted(e["path"] + (":sub" if e.get("include_subfolders") else "") for e in ref_folders)
+                ref_key = folder + "|" + "|".join(sorted_refs)
+            t_hash = calculate_file_hash(self.target_file)
+            # 以降のベクトルの参照・追加とキャッシュは、開始時のモデルの格納先に固定する
+            vectors = VectorStore.get_instance().bind()
+
+            # 対象のフォルダがどれも前回の分析から変わっていなければ、ファイルを列挙せずに結果を使う
+            unchanged = load_unchanged_analysis(ref_key, t_hash, vectors.namespace)
+            if unchanged is not None:
+                reused, hashed = unchanged
+                file_keys = {}
+                for full_path, f_hash in hashed:
+                    file_keys.setdefault(f_hash, []).append(full_path)
+                cached = [(path, score) for key, score in reused for path in file_keys.get(key, ())]
+                self.after(0, lambda: self._update_detail(
+                    step="キャッシュヒット",
+                    file="前回の分析結果を使用（フォルダ変更なし）",
+                    progress=f"{len(cached)}枚"))
+                self.after(0, lambda: self._on_analysis_complete(cached, 0, from_cache=True))
+                return
 
             # ステップ1: フォルダスキャン（複数フォルダ対応）
             self.after(0, lambda: self._update_detail(
@@ -2506,16 +2644,18 @@ class VisualSortWindow(tk.Toplevel):
                 progress=""))
 
             # ターゲット画像のフォルダからファイル収集
+            # フォルダのダイジェストは列挙する前に取る（列挙中の変更は次回の確認で見つかる）
+            dir_digests = directory_digests([folder])
             all_full_paths = set()
             base_files = GetGazoFiles(os.listdir(folder), folder)
             for f in base_files:
                 all_full_paths.add(os.path.normpath(os.path.join(folder, f)))
 
             # 参照フォルダからファイル収集
-            ref_folders = self.app_state.reference_folders
             for ref_entry in ref_folders:
                 ref_path = ref_entry.get("path", "")
                 include_sub = ref_entry.get("include_subfolders", False)
+                dir_digests.update(directory_digests([ref_path]))
                 if not os.path.isdir(ref_path):
                     continue
 
@@ -2525,6 +2665,8 @@ class VisualSortWindow(tk.Toplevel):
 
                 if include_sub:
                     for root_dir, dirs, filenames in os.walk(ref_path):
+                        # 下位フォルダは os.walk が中を列挙する前にダイジェストを取る
+                        dir_digests.update(directory_digests([os.path.join(root_dir, d) for d in dirs]))
                         for fn in filenames:
                             if fn.lower().endswith(SUPPORTED_IMAGE_FORMATS):
                                 all_full_paths.add(os.path.normpath(os.path.join(root_dir, fn)))
@@ -2549,23 +2691,40 @@ class VisualSortWindow(tk.Toplevel):
             self.after(0, lambda: self._update_detail(
                 step="[2/5] キャッシュ確認",
                 file=os.path.basename(self.target_file)))
-            t_hash = calculate_file_hash(self.target_file)
 
-            # キャッシュキーにフォルダ情報を含める
-            ref_key = folder
-            if ref_folders:
-                sorted_refs = sorted(e["path"] + (":sub" if e.get("include_subfolders") else "") for e in ref_folders)
-                ref_key = folder + "|" + "|".join(sorted_refs)
-            cached = load_analysis_cache(ref_key, t_hash, file_count)
-            if cached is not None:
-                valid = all(os.path.exists(path) for path, _ in cached)
-                if valid:
-                    self.after(0, lambda: self._update_detail(
-                        step="キャッシュヒット",
-                        file="前回の分析結果を使用",
-                        progress=f"{len(cached)}枚"))
-                    self.after(0, lambda: self._on_analysis_complete(cached, 0, from_cache=True))
-                    return
+            # 各ファイルのキー（内容が変わっていなければハッシュ索引から stat だけで分かる）
+            target_norm = os.path.normpath(self.target_file)
+            paths = [p for p in files_full if os.path.normpath(p) != target_norm]
+            self.after(0, lambda n=len(paths): self._update_detail(progress=f"{n}枚のキーを確認中..."))
+            hashed = list(iter_file_hashes(paths))
+            file_keys = {}
+            for full_path, f_hash in hashed:
+                if f_hash is not None:
+                    file_keys.setdefault(f_hash, []).append(full_path)
+
+            # ファイル集合が同じならそのまま使い、変わっていれば増えた候補だけを採点する
+            cached = load_analysis_cache(ref_key, t_hash, hashed, vectors.namespace)
+            reused, new_keys = cached if cached is not None else ([], None)
+            if cached is not None and not new_keys:
+                cached = [(path, score) for key, score in reused for path in file_keys[key]]
+                self.after(0, lambda: self._update_detail(
+                    step="キャッシュヒット",
+                    file="前回の分析結果を使用",
+                    progress=f"{len(cached)}枚"))
+                self.after(0, lambda: self._on_analysis_complete(cached, 0, from_cache=True))
+                # 次回はフォルダのダイジェストだけで判定できるよう、記録し直す
+                save_analysis_cache(ref_key, t_hash, reused, hashed, list(file_keys),
+                                    vectors.namespace, dir_digests)
+                return
+            if new_keys is not None:
+                wanted = set(new_keys)
+                hashed_todo = [(p, h) for p, h in hashed if h in wanted]
+                self.after(0, lambda n=len(reused), m=len(new_keys): self._update_detail(
+                    step="キャッシュ部分一致",
+                    file=f"前回の結果{n}件を再利用",
+                    progress=f"未採点{m}件"))
+            else:
+                hashed_todo = hashed
 
             # ステップ3: AIモデル準備
             self.after(0, lambda: self._update_detail(
@@ -2573,7 +2732,11 @@ class VisualSortWindow(tk.Toplevel):
                 file="ベクトルデータ読み込み中...",
                 progress=""))
             engine = VectorEngine.get_instance()
-            vectors = load_vectors()
+            if model_namespace(engine.model_key) != vectors.namespace:
+                # キャッシュ確認の後にモデルが切り替わった
+                self.after(0, lambda: messagebox.showwarning(
+                    "警告", "分析中にAIモデルが切り替わりました。もう一度実行してください。", parent=self))
+                return
             self.after(0, lambda n=len(vectors): self._update_detail(
                 file=f"既存ベクトル: {n:,}件",
                 progress=""))
@@ -2584,51 +2747,40 @@ class VisualSortWindow(tk.Toplevel):
                 file=os.path.basename(self.target_file)))
             if t_hash not in vectors:
                 vec = engine.get_image_feature(self.target_file)
-                if vec: vectors[t_hash] = vec
+                if vec is not None: vectors.put(t_hash, vec)
 
             t_vec = vectors.get(t_hash)
-            if not t_vec:
+            if t_vec is None:
                 self.after(0, lambda: messagebox.showerror("Error", "Failed to compute vector"))
                 return
 
             # ステップ4: 類似度計算
-            results = []
+            key_paths = {}
             count = 0
             new_vectors = 0
             start_time = time.time()
             vectors_updated = False
 
-            target_norm = os.path.normpath(self.target_file)
-            for full_path in files_full:
-                if os.path.normpath(full_path) == target_norm:
-                    continue
+            pipeline = FeaturePipeline(engine, vectors, should_stop=lambda: self.stop_thread)
+            items = ((f_hash, full_path) for full_path, f_hash in hashed_todo)
 
+            for f_hash, full_path, v, is_new in pipeline.run(items):
                 f_name = os.path.basename(full_path)
-                f_hash = calculate_file_hash(full_path)
+                count += 1
 
-                if f_hash not in vectors:
-                    self.after(0, lambda fn=f_name: self._update_detail(
-                        step="[4/5] ベクトル化 + 類似度計算",
-                        file=f"[新規] {fn}"))
-                    try:
-                        v = engine.get_image_feature(full_path)
-                        if v:
-                            vectors[f_hash] = v
-                            vectors_updated = True
-                            new_vectors += 1
-                    except Exception:
-                        pass
-                else:
-                    if count % 5 == 0:
+                if v is not None:
+                    if is_new:
+                        vectors_updated = True
+                        new_vectors += 1
+                        self.after(0, lambda fn=f_name: self._update_detail(
+                            step="[4/5] ベクトル化 + 類似度計算",
+                            file=f"[新規] {fn}"))
+                    elif count % 5 == 0:
                         self.after(0, lambda fn=f_name: self._update_detail(
                             step="[4/5] 類似度計算",
                             file=fn))
+                    key_paths.setdefault(f_hash, []).append(full_path)
 
-                if f_hash in vectors:
-                    score = engine.compare_features(t_vec, vectors[f_hash])
-                    results.append((full_path, score))
-
-                count += 1
                 elapsed = time.time() - start_time
                 self.after(0, lambda c=count, t=file_count, e=elapsed, nv=new_vectors: self._update_detail(
                     progress=f"{c}/{t}枚  {e:.1f}秒" + (f"  新規{nv}件" if nv > 0 else "")))
@@ -2638,131 +2790,178 @@ class VisualSortWindow(tk.Toplevel):
                 self.after(0, lambda: self._update_detail(
                     step="[5/5] ベクトルデータ保存",
                     file=f"新規{new_vectors}件を保存中..."))
-                save_vectors(vectors)
+                vectors.flush()
 
             self.after(0, lambda: self._update_detail(
                 step="[5/5] 結果整理",
                 file="スコア順にソート中..."))
-            results.sort(key=lambda x: x[1], reverse=True)
+            # 候補が少なければ全件を厳密に採点し、多ければ ANN 索引で上位 ANN_TOP_K 件を近似で求める
+            scored, complete = vectors.search(t_vec, list(key_paths))
+            scored_keys = list(key_paths)
+            if new_keys is not None:
+                # キャッシュから引き継いだ結果と、今回採点した分を合わせて並べ直す
+                scored = reused + scored
+                order = select_top(np.array([score for _, score in scored], dtype=np.float32))
+                scored = [scored[i] for i in order.tolist()]
+                wanted = set(new_keys)
+                scored_keys += [key for key in file_keys if key not in wanted]
+            results = [(path, score) for key, score in scored for path in file_keys[key]]
             elapsed = time.time() - start_time
 
-            # キャッシュ保存
-            self.after(0, lambda: self._update_detail(
-                step="[5/5] キャッシュ保存",
-                file="分析結果をキャッシュに保存中..."))
-            save_analysis_cache(ref_key, t_hash, results, file_count)
+            # キャッシュ保存（パスではなくファイルのキーで持つ）。近似で件数を打ち切った結果は
+            # 全件の結果として再利用されないよう保存しない
+            if complete:
+                self.after(0, lambda: self._update_detail(
+                    step="[5/5] キャッシュ保存",
+                    file="分析結果をキャッシュに保存中..."))
+                save_analysis_cache(ref_key, t_hash, scored, hashed, scored_keys, vectors.namespace,
+                                    dir_digests)
 
-            self.after(0, lambda: self._on_analysis_complete(results, elapsed))
+            self.after(0, lambda: self._on_analysis_complete(results, elapsed, capped=not complete))
 
         except Exception as e:
             logger.error(f"Analysis error: {e}")
             self.after(0, lambda: messagebox.showerror("Error", str(e)))
 
-    def _on_analysis_complete(self, results, elapsed, from_cache=False):
+    def _on_analysis_complete(self, results, elapsed, from_cache=False, capped=False):
         if from_cache:
             self.lbl_status.config(text=f"キャッシュから読込 ({len(results)}枚)")
+        elif capped:
+            # ANN 索引による近似で、類似度の上位 ANN_TOP_K 件のキーだけを表示している
+            self.lbl_status.config(
+                text=f"完了 ({elapsed:.2f}秒, 近似検索の上位{ANN_TOP_K:,}件まで: {len(results)}枚)")
         else:
             self.lbl_status.config(text=f"完了 ({elapsed:.2f}秒, {len(results)}枚)")
         self._clear_detail()
-        self.all_results = results
+        self.all_results = sorted(results, key=lambda r: r[1], reverse=True)
+        self.selected = [False] * len(results)
+        self._neg_scores = [-score for _, score in self.all_results]
         self._compute_score_boundaries()
         self.refresh_grid()
+        self.grid_view.scroll_to_top()
+        # 表示範囲の次にスクロールで出てくるカードのサムネイルを画像キャッシュに先読みしておく
+        _, end = self.grid_view.visible_range()
+        upcoming = self.all_results[end:min(self.visible_count, end + VISUAL_SORT_PRELOAD_COUNT)]
+        ImageCache.get_instance().preload([path for path, _ in upcoming], (180, 150), fit="contain")
+
+    def refresh_grid(self, rebind=True):
+        """しきい値以上の結果（スコア降順の先頭 visible_count 件）を表示する
+
+        rebind=False はしきい値だけが変わった場合で、増減した末尾のカードだけを触る。
+        """
+        count = bisect.bisect_right(self._neg_scores, -self.var_threshold.get())
+        if rebind or count != self.visible_count:
+            self.visible_count = count
+            self.grid_view.set_count(count, rebind=rebind)
+        self.lbl_visible_count.config(text=f"{count}枚")
+
+    def create_image_card(self, parent):
+        """空のカードを作る（中身は bind_image_card で差し替える）"""
+        frame = tk.Frame(parent, bd=2, relief=tk.RIDGE, bg="white", width=200, height=220)
+        frame.pack_propagate(False)
 
-    def refresh_grid(self):
-        for widget in self.grid_frame.winfo_children():
-            widget.destroy()
-
-        self.candidates = []
-        threshold = self.var_threshold.get()
-
-        col_count = self.col_count
-        row = 0
-        col = 0
-
-        visible_count = 0
-
-        for path, score in self.all_results:
-            if score < threshold: continue
-
-            card = self.create_image_card(self.grid_frame, path, score)
-            card.grid(row=row, column=col, padx=5, pady=5, sticky="nsew")
-
-            self.candidates.append({'path': path, 'score': score, 'widget': card})
+        frame.lbl_img = tk.Label(frame, bg="white")
+        frame.lbl_img.pack(pady=5)
 
-            visible_count += 1
-            col += 1
-            if col >= col_count:
-                col = 0
-                row += 1
+        frame.lbl_score = tk.Label(frame, bg="white", font=("Arial", 10, "bold"))
+        frame.lbl_score.pack()
 
-        self.lbl_visible_count.config(text=f"{visible_count}枚")
+        # チェック状態の正はモデル（self.selected）で、BooleanVar は表示用
+        frame.var_selected = tk.BooleanVar(value=False)
+        frame.chk = tk.Checkbutton(frame, bg="white", anchor="w", variable=frame.var_selected,
+                                   command=lambda: self._on_card_check(frame))
+        frame.chk.pack(fill=tk.X, padx=5)
 
-    def create_image_card(self, parent, path, score):
-        frame = tk.Frame(parent, bd=2, relief=tk.RIDGE, bg="white", width=200, height=220)
-        frame.pack_propagate(False)
-
-        try:
-            with Image.open(path) as img:
-                img.thumbnail((180, 150))
-                tk_img = ImageTk.PhotoImage(img)
-        except:
-             tk_img = None
+        frame.index = None
+        frame.path = None
+        frame.job = None
+        return frame
 
-        lbl_img = tk.Label(frame, image=tk_img, bg="white")
-        lbl_img.image = tk_img
-        lbl_img.pack(pady=5)
+    def bind_image_card(self, frame, pos):
+        """カードの中身を pos 番目の結果に差し替える"""
+        path, score = self.all_results[pos]
+        frame.index = pos
+
+        if frame.path != path:  # 同じ画像のままなら（チェック状態の更新など）読み直さない
+            frame.path = path
+            if frame.job is not None:
+                frame.job.cancel()
+            frame.lbl_img.config(image=placeholder_image((180, 150)))
+            frame.lbl_img.image = None
+            # 画面内のカードを先に、前後の余分のカードを後に読み込む
+            start, end = self.grid_view.visible_range(overscan=0)
+            frame.job = request_thumbnail(
+                self, path, (180, 150),
+                lambda photo, f=frame, p=path: self._set_card_thumbnail(f, p, photo),
+                priority=0 if start <= pos < end else 1)
 
         color = "red" if score > 0.9 else "black"
-        tk.Label(frame, text=f"{score:.1%}", fg=color, bg="white", font=("Arial", 10, "bold")).pack()
+        frame.lbl_score.config(text=f"{score:.1%}", fg=color)
+        frame.chk.config(text=os.path.basename(path))
+        frame.var_selected.set(self.selected[pos])
 
-        var = tk.BooleanVar(value=False)
-        chk = tk.Checkbutton(frame, text=os.path.basename(path), bg="white", anchor="w", variable=var)
-        chk.pack(fill=tk.X, padx=5)
+    def _set_card_thumbnail(self, frame, path, photo):
+        if frame.path != path:
+            return
+        frame.job = None
+        frame.lbl_img.config(image=photo or "")
+        frame.lbl_img.image = photo
 
-        frame.var_selected = var
+    def release_image_card(self, frame):
+        """範囲外に出たカードの読み込みを取り消す（読み込み前なら次の割り当てで読み直す）"""
+        if frame.job is not None:
+            frame.job.cancel()
+            frame.job = None
+            frame.path = None
 
-        return frame
+    def _on_card_check(self, frame):
+        if frame.index is not None:
+            self.selected[frame.index] = frame.var_selected.get()
 
     def on_slider_change(self, val):
-        self.refresh_grid()
+        # ドラッグ中の連続した変更はまとめ、最短間隔ごとに最新の値だけを反映する
+        if self._threshold_job is None:
+            self._threshold_job = self.after(VISUAL_SORT_THRESHOLD_INTERVAL_MS, self._apply_threshold)
+
+    def _apply_threshold(self):
+        self._threshold_job = None
+        self.refresh_grid(rebind=False)
 
     def _compute_score_boundaries(self):
-        scores = sorted(set(score for _, score in self.all_results), reverse=True)
-        self.score_boundaries = scores
+        # 昇順（二分探索用）
+        self.score_boundaries = sorted(set(-s for s in self._neg_scores))
 
     def jump_to_next_boundary(self):
         if not self.score_boundaries:
             return
-        current = self.var_threshold.get()
-        for s in self.score_boundaries:
-            if s < current:
-                self.var_threshold.set(s)
-                self.scale.set(s)
-                self.refresh_grid()
-                return
+        # 現在のしきい値より小さい最大のスコア
+        i = bisect.bisect_left(self.score_boundaries, self.var_threshold.get())
+        if i == 0:
+            return
+        s = self.score_boundaries[i - 1]
+        self.var_threshold.set(s)
+        self.scale.set(s)
+        self.refresh_grid(rebind=False)
 
     def jump_to_prev_boundary(self):
-        if not self.all_results:
-            return
-        threshold = self.var_threshold.get()
-        visible_scores = [score for _, score in self.all_results if score >= threshold]
-        if not visible_scores:
+        if not self.visible_count:
             return
-        min_score = min(visible_scores)
+        # 表示中の最小スコア（降順の末尾）を外すしきい値にする
+        min_score = self.all_results[self.visible_count - 1][1]
         new_threshold = min_score + 0.001
         if new_threshold > 1.0:
             new_threshold = 1.0
         self.var_threshold.set(new_threshold)
         self.scale.set(new_threshold)
-        self.refresh_grid()
+        self.refresh_grid(rebind=False)
 
     def select_all(self):
-        for c in self.candidates:
-            c['widget'].var_selected.set(True)
+        self.selected[:self.visible_count] = [True] * self.visible_count
+        self.grid_view.refresh()
 
     def deselect_all(self):
-        for c in self.candidates:
-            c['widget'].var_selected.set(False)
+        self.selected[:self.visible_count] = [False] * self.visible_count
+        self.grid_view.refresh()
 
     def _browse_dest_folder(self):
         """参照ボタン: 既存フォルダを選択して移動先に設定"""
@@ -2773,7 +2972,8 @@ class VisualSortWindow(tk.Toplevel):
             self.var_dest.set(path)
 
     def execute_action(self, action_type):
-        targets = [c['path'] for c in self.candidates if c['widget'].var_selected.get()]
+        targets = [path for (path, _), checked in zip(self.all_results[:self.visible_count], self.selected)
+                   if checked]
         if not targets:
             messagebox.showinfo("info", "画像が選択されていません")
             return
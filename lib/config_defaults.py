@@ -48,7 +48,86 @@ MIN_AI_THRESHOLD = 0.0
 MAX_AI_THRESHOLD = 1.0
 
 AI_BATCH_SLEEP = 0.01
+AI_INFERENCE_BATCH_SIZE = 0  # 1回の推論でまとめる画像数（0 = デバイスに合わせて自動）
+AI_AUTO_BATCH_SIZE_CPU = 16
+AI_AUTO_BATCH_SIZE_GPU = 64
+AI_DECODE_WORKERS = min(4, os.cpu_count() or 2)  # ベクトル化時の画像読み込み・前処理スレッド数
+AI_PIPELINE_QUEUE_SIZE = 64  # 前処理済みで推論待ちにできる画像数の上限
 VECTOR_PROCESSING_TIMEOUT = 300
+VECTOR_FLUSH_INTERVAL = 30  # 未保存ベクトルの定期フラッシュ間隔（秒）
+# 画像の前処理（デコード・リサイズ・正規化）を変えたら上げる。ベクトルの格納先がモデルごと・版ごとに分かれる
+VECTOR_PREPROCESS_VERSION = 2  # 2: JPEG draft / reduce による縮小デコード
+HASH_INDEX_FLUSH_ROWS = 256  # ハッシュ索引の未保存行がこの数に達したら追記保存する
+HASH_BUFFER_SIZE = 4 * 1024 * 1024  # ハッシュ計算の読み込みバッファ（バイト）
+HASH_MAX_WORKERS = min(8, os.cpu_count() or 4)  # 並列ハッシュ計算のスレッド数
+# ファイルのキー（内容ハッシュ）の方式: "blake2b"（全体・高速） / "sampled"（サイズ+先頭末尾） / "md5"（旧形式）
+FILE_HASH_MODE = "blake2b"
+FILE_HASH_SAMPLE_SIZE = 64 * 1024  # sampled で先頭・末尾から読むバイト数
+KEY_PATH_MEMORY = 100000  # MD5 キーの既存データ引き継ぎ用に覚えておく キー→パス の件数
+CLUSTER_BLOCK_SIZE = 256  # オート仕分けのクラスタリングで 1 回の行列積にまとめるシード数
+CLUSTER_GRAPH_MARGIN = 0.10  # 類似度グラフに残す範囲（分析時のしきい値からこの分だけ下まで）
+CLUSTER_GRAPH_MAX_EDGES = 5_000_000  # 類似度グラフの辺数の上限（超えたら下限を引き上げる）
+CLUSTER_DENSITY_MIN_SAMPLES = 3  # 密度ベースで中心とみなす近傍数（自身を含む）
+CLUSTER_AVERAGE_MAX_COMPONENT = 4000  # 平均連結法で類似度行列を作る成分の上限枚数（超えたら貪欲法）
+
+# 近似最近傍（ANN）索引: 候補がこの件数未満なら全件を厳密に採点する
+ANN_MIN_VECTORS = 50000
+ANN_NPROBE = 32  # 検索で調べるリスト数（増やすと取りこぼしが減り、遅くなる）
+ANN_TOP_K = 2000  # ANN 検索で返す最大件数
+ANN_KMEANS_ITERATIONS = 8
+ANN_TRAIN_PER_LIST = 32  # k-means の学習に使う 1 リストあたりの標本数
+ANN_RETRAIN_FACTOR = 4  # 学習時の行数のこの倍率を超えたら索引を作り直す
+
+# 近傍リスト（k 近傍グラフ）: 各ベクトルの類似上位 K 件を保存し「類似画像を探す」で再計算を省く
+KNN_NEIGHBORS = 32
+KNN_BLOCK_SIZE = 256  # 近傍リストの更新で 1 回の行列積にまとめる行数
+KNN_ROWS_PER_RUN = 4096  # バックグラウンド更新 1 回で処理する最大行数
+KNN_UPDATE_INTERVAL = 60  # バックグラウンド更新の間隔（秒）
+
+# サムネイルの保存: 表示サイズをこの辺長の段階に切り上げて保存する（最大を超える表示は保存しない）
+THUMBNAIL_BUCKETS = (64, 128, 192, 320)
+THUMBNAIL_PREFILL_BUCKETS = (64, 192)  # ベクトル化のデコードついでに作る段階
+THUMBNAIL_QUALITY = 80  # WebP / JPEG の品質
+THUMBNAIL_PACK_MAX_BYTES = 512 * 1024 * 1024  # サムネイルパックの上限（超えたら作り直す）
+
+# メモリ上の画像キャッシュ: 表示サイズをこの辺長の段階に切り上げ、段階ごとに縮小済みの画像を持つ
+IMAGE_CACHE_MAX_MB = 256
+IMAGE_CACHE_BUCKETS = (64, 128, 192, 320, 512, 768, 1024, 1536, 2048, 3072, 4096)
+IMAGE_CACHE_PRELOAD_WORKERS = 2  # 先読み用の作業スレッド数
+VISUAL_SORT_PRELOAD_COUNT = 200  # Visual Sort の結果表示時に、表示範囲の次から先読みする件数
+VISUAL_SORT_THRESHOLD_INTERVAL_MS = 30  # しきい値スライダーの変更を表示へ反映する最短間隔（ミリ秒）
+
+# サムネイルの読み込み: 作業スレッドでデコードし、メインスレッドで少しずつ PhotoImage にする
+THUMBNAIL_LOADER_WORKERS = 4
+THUMBNAIL_HANDOFF_BATCH = 16  # 1 回の受け渡しで PhotoImage にする最大枚数
+THUMBNAIL_HANDOFF_INTERVAL_MS = 15  # 受け渡しの間隔（ミリ秒）
+
+# 仮想化グリッド: 表示範囲の前後に余分に作っておくカードの行数（スクロール時のちらつき防止）
+VIRTUAL_GRID_OVERSCAN_ROWS = 2
+
+# 分析結果キャッシュの合計サイズの上限（超えたら最も古く使われたエントリから削除する）
+ANALYSIS_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+DEFAULT_CLUSTER_METHOD = "greedy"
+
+CLUSTER_METHODS = {
+    "greedy": {
+        "name": "貪欲法",
+        "description": "先頭の画像から順に、しきい値以上の画像をまとめる（従来の方法）",
+    },
+    "components": {
+        "name": "連結成分",
+        "description": "しきい値以上でつながる画像をすべて同じグループにする（順序に依存しない）",
+    },
+    "average": {
+        "name": "平均連結",
+        "description": "グループ間の平均類似度がしきい値以上の間まとめ続ける（連写の分割に強い）",
+    },
+    "density": {
+        "name": "密度ベース",
+        "description": "近傍の多い画像を中心にまとめ、まばらな画像は孤立にする（DBSCAN 方式）",
+    },
+}
 
 DEFAULT_AI_MODEL = "mobilenet_v3_small"
 
@@ -122,8 +201,13 @@ COLOR_STATUS_FG = "#000000"
 # ===========================
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data")
-VECTOR_DATA_FILE = os.path.join(DATA_DIR, "vectordata.json")
-ANALYSIS_CACHE_FILE = os.path.join(DATA_DIR, "analysis_cache.json")
+VECTOR_DATA_FILE = os.path.join(DATA_DIR, "vectordata.json")  # 旧形式（移行元）
+VECTOR_STORE_DIR = os.path.join(DATA_DIR, "vectors")
+VECTOR_STORE_BASE = os.path.join(VECTOR_STORE_DIR, "vectors")  # モデル別分割前の旧形式（移行元）
+HASH_INDEX_FILE = os.path.join(VECTOR_STORE_DIR, "hash_index.tsv")
+ANALYSIS_CACHE_DIR = os.path.join(DATA_DIR, "analysis_cache")
+THUMBNAIL_DIR = os.path.join(DATA_DIR, "thumbnails")
+ANALYSIS_CACHE_FILE = os.path.join(DATA_DIR, "analysis_cache.json")  # 旧形式（起動時に削除）
 CONFIG_FILE = "config.json"
 LOG_DIR = "logs"
 
@@ -0,0 +1,185 @@
+'''
+test_analysis_cache.py - 分析結果キャッシュのテスト
+対象: lib/PicSorterGUIAnalysisCache.py, load_analysis_cache / save_analysis_cache (lib/PicSorterGUIData.py)
+'''
+import os
+
+import numpy as np
+
+from lib.PicSorterGUIAnalysisCache import AnalysisCache, files_fingerprint
+
+
+def _keys(n, start=0):
+    return [f"b:{i:030d}" for i in range(start, start + n)]
+
+
+def _cache(tmp_path, **kwargs):
+    return AnalysisCache(str(tmp_path / "analysis_cache"), legacy_path=None, **kwargs)
+
+
+class TestAnalysisCache:
+    """AnalysisCache の保存・参照・削除のテスト"""
+
+    def test_round_trip(self, tmp_path):
+        """保存したキーと float16 精度の類似度、指紋、候補が読み戻せること"""
+        cache = _cache(tmp_path)
+        keys = _keys(100)
+        scores = np.linspace(1.0, 0.0, 100)
+        assert cache.put("ns|folder|t", keys, scores, "fp", _keys(300))
+        entry = cache.get("ns|folder|t")
+        assert entry["keys"] == keys
+        assert entry["fingerprint"] == "fp"
+        assert len(entry["candidates"]) == 300
+        np.testing.assert_allclose(entry["scores"], scores, atol=1e-3)
+        assert cache.get("ns|folder|other") is None
+
+    def test_paths_round_trip_compact(self, tmp_path):
+        """フォルダとファイルのパスが UTF-8 のまま保存され、日本語や空の一覧も読み戻せること"""
+        cache = _cache(tmp_path)
+        dirs = {"/写真/旅行": "0" * 32, "/missing": ""}
+        files = [(f"/写真/旅行/画像{i}.jpg", k) for i, k in enumerate(_keys(3))]
+        cache.put("k", _keys(3), np.ones(3), "fp", _keys(3), dirs, files + [("/x.jpg", None)])
+        entry = cache.get("k")
+        assert entry["dirs"] == dirs
+        assert entry["files"] == files
+        with np.load(cache._entry_path("k")) as data:
+            assert data["file_paths"].dtype == np.uint8  # 固定長の UTF-32 ではない
+
+        cache.put("empty", [], [], "fp", [], {}, [])
+        assert cache.get("empty")["dirs"] == {} and cache.get("empty")["files"] == []
+
+    def test_one_file_per_entry(self, tmp_path):
+        """エントリごとに別ファイルで、上書きしても他のエントリは変わらないこと"""
+        cache = _cache(tmp_path)
+        cache.put("a", _keys(10), np.ones(10), "fp", _keys(10))
+        cache.put("b", _keys(5), np.ones(5), "fp", _keys(5))
+        cache.put("a", _keys(3), np.zeros(3), "fp2", _keys(3))
+        assert cache.info()[1] == 2
+        assert cache.get("a")["fingerprint"] == "fp2"
+        assert cache.get("b")["keys"] == _keys(5)
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        """上限を超えたら、最後に使われたのが古いエントリから削除されること"""
+        cache = _cache(tmp_path)
+        for name in ("a", "b", "c"):
+            cache.put(name, _keys(200), np.ones(200), "fp", _keys(200))
+        entry_size = os.path.getsize(cache._entry_path("a"))
+        cache.get("a")  # a を最後に使ったことにする
+
+        cache.max_bytes = entry_size * 3
+        cache.put("d", _keys(200), np.ones(200), "fp", _keys(200))
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert cache.info()[0] <= cache.max_bytes
+
+    def test_ledger_restored_from_mtime(self, tmp_path, monkeypatch):
+        """起動時に更新時刻から使用順とサイズを読み、保存のたびにフォルダを走査しないこと"""
+        cache = _cache(tmp_path)
+        for i, name in enumerate(("a", "b", "c")):
+            cache.put(name, _keys(200), np.ones(200), "fp", _keys(200))
+            os.utime(cache._entry_path(name), ns=((3 - i) * 10**9, (3 - i) * 10**9))
+        entry_size = os.path.getsize(cache._entry_path("a"))
+
+        cache = _cache(tmp_path, max_bytes=entry_size * 3)
+        assert cache.info() == (entry_size * 3, 3)
+        scans = []
+        original = os.scandir
+        monkeypatch.setattr(os, "scandir", lambda path: scans.append(path) or original(path))
+        cache.put("d", _keys(200), np.ones(200), "fp", _keys(200))
+        monkeypatch.undo()
+        assert scans == []
+        assert cache.get("c") is None  # 更新時刻が最も古い
+        assert cache.get("a") is not None
+        assert cache.info()[0] <= cache.max_bytes
+
+    def test_corrupt_entry_is_dropped(self, tmp_path):
+        """壊れたエントリは None を返して削除されること"""
+        cache = _cache(tmp_path)
+        cache.put("a", _keys(10), np.ones(10), "fp", _keys(10))
+        with open(cache._entry_path("a"), "wb") as f:
+            f.write(b"broken")
+        assert cache.get("a") is None
+        assert not os.path.exists(cache._entry_path("a"))
+
+    def test_legacy_json_removed_and_clear(self, tmp_path):
+        """旧形式の JSON は削除され、clear() で全エントリが消えること"""
+        legacy = tmp_path / "analysis_cache.json"
+        legacy.write_text("{}", encoding="utf-8")
+        cache = AnalysisCache(str(tmp_path / "analysis_cache"), legacy_path=str(legacy))
+        assert not legacy.exists()
+        cache.put("a", _keys(10), np.ones(10), "fp", _keys(10))
+        cache.clear()
+        assert cache.info() == (0, 0)
+
+
+class TestFilesFingerprint:
+    """files_fingerprint のテスト"""
+
+    def test_order_independent_and_sensitive(self):
+        """並び順に依存せず、名前・内容（キー）・増減のどれでも変わること"""
+        hashed = [("/a/1.jpg", "k1"), ("/a/2.jpg", "k2")]
+        fp = files_fingerprint(hashed)
+        assert files_fingerprint(list(reversed(hashed))) == fp
+        assert files_fingerprint([("/a/1.jpg", "k2"), ("/a/2.jpg", "k1")]) != fp
+        assert files_fingerprint([("/a/1.jpg", "k1"), ("/a/3.jpg", "k2")]) != fp
+        assert files_fingerprint(hashed[:1]) != fp
+
+
+class TestLoadAnalysisCache:
+    """load_analysis_cache / save_analysis_cache の差分判定のテスト"""
+
+    def test_full_and_partial_hits(self, tmp_path, monkeypatch):
+        """同じファイル集合なら全件再利用し、入れ替えたら消えた分を除いて増えた分だけ返すこと"""
+        from lib.PicSorterGUIData import load_analysis_cache, save_analysis_cache
+        monkeypatch.setattr(AnalysisCache, "_instance", _cache(tmp_path))
+        keys = _keys(5)
+        hashed = [(f"/f/{i}.jpg", k) for i, k in enumerate(keys)]
+        results = [(keys[i], 0.9 - 0.1 * i) for i in range(5)]
+        assert load_analysis_cache("/f", "t", hashed) is None
+
+        save_analysis_cache("/f", "t", results, hashed, keys)
+        got, new_keys = load_analysis_cache("/f", "t", hashed)
+        assert new_keys == []
+        assert [k for k, _ in got] == keys
+
+        # 0.jpg を削除し、新しい 9.jpg を追加（ファイル数は同じ）
+        changed = hashed[1:] + [("/f/9.jpg", "b:new")]
+        got, new_keys = load_analysis_cache("/f", "t", changed)
+        assert [k for k, _ in got] == keys[1:]
+        assert new_keys == ["b:new"]
+
+    def test_unchanged_directories_skip_file_checks(self, tmp_path, monkeypatch):
+        """フォルダの中身が同じなら (結果, hashed) を返し、変わったら None になること"""
+        from lib.PicSorterGUIData import directory_digests, load_unchanged_analysis, save_analysis_cache
+        monkeypatch.setattr(AnalysisCache, "_instance", _cache(tmp_path))
+        folder = tmp_path / "photos"
+        folder.mkdir()
+        for i in range(3):
+            (folder / f"{i}.jpg").write_bytes(b"x" * i)
+        later = str(tmp_path / "not_yet")
+        keys = _keys(3)
+        hashed = [(str(folder / f"{i}.jpg"), k) for i, k in enumerate(keys)] + [(str(folder / "x.jpg"), None)]
+        results = [(keys[i], 0.9 - 0.1 * i) for i in range(3)]
+
+        save_analysis_cache("/f", "t", results, hashed, keys)
+        assert load_unchanged_analysis("/f", "t") is None  # フォルダのダイジェストを記録していない
+
+        digests = directory_digests([str(folder), later])
+        assert digests[later] == ""
+        save_analysis_cache("/f", "t", results, hashed, keys, dirs=digests)
+        got, files = load_unchanged_analysis("/f", "t")
+        assert [k for k, _ in got] == keys
+        assert files == hashed[:3]  # キーの無いファイルは持たない
+
+        # 同じ名前への上書き（フォルダの更新時刻は変わらない）
+        st = os.stat(folder)
+        (folder / "1.jpg").write_bytes(b"overwritten")
+        os.utime(folder, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert load_unchanged_analysis("/f", "t") is None
+
+        # 無かったフォルダが作られた
+        save_analysis_cache("/f", "t", results, hashed, keys, dirs=directory_digests([str(folder), later]))
+        assert load_unchanged_analysis("/f", "t") is not None
+        os.mkdir(later)
+        assert load_unchanged_analysis("/f", "t") is None
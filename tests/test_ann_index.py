@@ -0,0 +1,147 @@
+'''
+test_ann_index.py - 近似最近傍（IVF）索引のテスト
+対象: lib/PicSorterGUIANNIndex.py, VectorStore.search (lib/PicSorterGUIData.py)
+'''
+import numpy as np
+
+from lib.PicSorterGUIANNIndex import IVFIndex
+from lib.PicSorterGUISimilarity import normalize_rows
+from lib.PicSorterGUIVectorStore import VectorFile
+
+
+def _clustered(n=4000, dim=32, centers=40, seed=0):
+    rng = np.random.default_rng(seed)
+    c = rng.standard_normal((centers, dim))
+    m = c[rng.integers(0, centers, n)] + 0.4 * rng.standard_normal((n, dim))
+    return normalize_rows(m)
+
+
+def _keys(n, start=0):
+    return np.array([f"{i:032d}".encode() for i in range(start, start + n)], dtype="S32")
+
+
+class TestIVFIndex:
+    """IVFIndex の同期・検索・保存のテスト"""
+
+    def test_recall(self, tmp_path):
+        """厳密検索の上位に対して十分な再現率があり、nprobe を増やすと上がること"""
+        m = _clustered()
+        index = IVFIndex(str(tmp_path / "a.ivf"))
+        index.sync(_keys(len(m)), m)
+        rng = np.random.default_rng(1)
+        recalls = {}
+        for nprobe in (2, 16):
+            hits = 0
+            for q in m[rng.choice(len(m), 20, replace=False)]:
+                exact = set(np.argsort(-(m @ q))[:50].tolist())
+                rows, _ = index.search(m, q, 50, nprobe=nprobe)
+                hits += len(exact & set(rows.tolist()))
+            recalls[nprobe] = hits / (20 * 50)
+        assert recalls[16] >= 0.9
+        assert recalls[16] >= recalls[2]
+
+    def test_scores_sorted_and_exact(self, tmp_path):
+        """返る類似度が降順で、行の厳密な類似度と一致すること"""
+        m = _clustered()
+        index = IVFIndex(str(tmp_path / "a.ivf"))
+        index.sync(_keys(len(m)), m)
+        rows, scores = index.search(m, m[0], 30)
+        assert rows[0] == 0
+        assert np.all(np.diff(scores) <= 0)
+        np.testing.assert_allclose(scores, m[rows] @ m[0], rtol=1e-5)
+
+    def test_incremental_and_persisted(self, tmp_path):
+        """追記分だけが振り分けられ、保存した索引を読み直して使えること"""
+        m = _clustered()
+        path = str(tmp_path / "a.ivf")
+        index = IVFIndex(path)
+        index.sync(_keys(3000), m[:3000])
+        centroids = index.centroids.copy()
+        index.sync(_keys(len(m)), m)
+        np.testing.assert_array_equal(index.centroids, centroids)
+        assert len(index.assign) == len(m)
+        assert index.save()
+
+        reloaded = IVFIndex(path)
+        np.testing.assert_array_equal(reloaded.assign, index.assign)
+        rows, _ = reloaded.search(m, m[3500], 5)
+        assert rows[0] == 3500
+
+    def test_remap_after_row_change(self, tmp_path):
+        """行番号が変わってもキーで振り分けが引き継がれること"""
+        m = _clustered()
+        keys = _keys(len(m))
+        index = IVFIndex(str(tmp_path / "a.ivf"))
+        index.sync(keys, m)
+        before = dict(zip(keys.tolist(), index.assign.tolist()))
+
+        keep = np.arange(len(m))[::2]
+        index.sync(keys[keep], m[keep])
+        assert index.assign.tolist() == [before[k] for k in keys[keep].tolist()]
+
+
+class TestVectorStoreSearch:
+    """VectorStore.search のテスト"""
+
+    def _store(self, tmp_path, m):
+        from lib.PicSorterGUIData import VectorStore
+        store = VectorStore(str(tmp_path), legacy_json_path=None)
+        store.put_many((k.decode(), v) for k, v in zip(_keys(len(m)).tolist(), m))
+        store.flush()
+        return store
+
+    def test_exact_for_small_sets(self, tmp_path):
+        """候補が少なければ全候補を厳密な類似度の降順で返し、threshold で絞れること"""
+        m = _clustered(n=300)
+        store = self._store(tmp_path, m)
+        keys = [k.decode() for k in _keys(300).tolist()][::3]
+        results, complete = store.search(m[0], keys)
+        assert complete
+        assert [k for k, _ in results][0] == keys[0]
+        assert sorted(k for k, _ in results) == sorted(keys)
+        expected = sorted((float(m[i] @ m[0]) for i in range(0, 300, 3)), reverse=True)
+        np.testing.assert_allclose([s for _, s in results], expected, atol=1e-5)
+        # 厳密な採点では k で打ち切らず、しきい値だけで絞る
+        assert store.search(m[0], keys, k=5) == (results, True)
+        assert store.search(m[0], keys, threshold=0.5) == ([r for r in results if r[1] >= 0.5], True)
+        store.close()
+
+    def test_ann_filters_candidates_and_unsaved(self, tmp_path):
+        """ANN 検索で候補外・上書き済みの行が除かれ、未保存のベクトルも含まれること"""
+        m = _clustered()
+        store = self._store(tmp_path, m)
+        keys = [k.decode() for k in _keys(len(m)).tolist()]
+        store.put(keys[10], m[0])          # 上書き（古い行は使われなくなる）
+        store.flush()
+        store.put("x" * 32, m[0])          # 未保存
+        candidates = keys[:2000] + ["x" * 32]
+
+        results, complete = store.search(m[0], candidates, k=100, min_ann=0)
+        found = dict(results)
+        assert not complete
+        assert len(results) <= 100
+        assert set(found) <= set(candidates)
+        assert found["x" * 32] > 0.999
+        assert found[keys[10]] > 0.999
+        assert [k for k, _ in results].count(keys[10]) == 1
+        store.close()
+
+    def test_index_saved_on_flush_not_per_query(self, tmp_path, monkeypatch):
+        """検索ごとには索引を書き出さず、flush() で変更があるときだけ保存すること"""
+        m = _clustered()
+        store = self._store(tmp_path, m)
+        keys = [k.decode() for k in _keys(len(m)).tolist()]
+        ivf = tmp_path / f"{store.namespace}.ivf"
+        saved = []
+        save = IVFIndex.save
+        monkeypatch.setattr(IVFIndex, "save", lambda self: saved.append(save(self)) or saved[-1])
+
+        for i in range(3):
+            store.search(m[i], keys, k=10, min_ann=0)
+        assert not ivf.exists()
+        store.flush()
+        assert ivf.exists() and saved == [True]
+        store.search(m[0], keys, k=10, min_ann=0)
+        store.flush()
+        assert saved == [True, False]  # 変更が無ければ書き出さない
+        store.close()
@@ -0,0 +1,217 @@
+'''
+test_clustering.py - クラスタリング手法・類似度グラフのテスト
+対象: lib/PicSorterGUIClustering.py
+'''
+import numpy as np
+
+from lib.PicSorterGUIClustering import (
+    greedy_cluster, greedy_cluster_graph, SimilarityGraph, CLUSTERING_ENGINES,
+    AverageLinkageClustering, DensityClustering, get_clustering_engine, benchmark_clustering,
+)
+from lib.PicSorterGUISimilarity import normalize_rows
+
+
+def _reference_cluster(matrix, threshold):
+    """1 枚ずつ比較する従来の貪欲クラスタリング"""
+    m = normalize_rows(matrix)
+    unprocessed = list(range(len(m)))
+    done = set()
+    groups, isolated = [], []
+    while unprocessed:
+        seed = unprocessed.pop(0)
+        if seed in done:
+            continue
+        done.add(seed)
+        similar = [c for c in unprocessed if c not in done and float(m[seed] @ m[c]) >= threshold]
+        if similar:
+            groups.append([seed] + similar)
+            done.update(similar)
+        else:
+            isolated.append(seed)
+    return groups, isolated
+
+
+def _planted(n_clusters=12, per_cluster=15, noise=40, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim))
+    rows = [c + 0.2 * rng.standard_normal((per_cluster, dim)) for c in centers]
+    rows.append(rng.standard_normal((noise, dim)))
+    matrix = np.vstack(rows).astype(np.float32)
+    return matrix[rng.permutation(len(matrix))]
+
+
+class TestGreedyCluster:
+    """greedy_cluster のテスト"""
+
+    def test_matches_reference(self):
+        """1 枚ずつ比較する場合と同じグループ・孤立になること"""
+        matrix = _planted()
+        for threshold in (0.5, 0.8, 0.95):
+            for block_size in (1, 7, 256):
+                assert greedy_cluster(matrix, threshold, block_size=block_size) == \
+                    _reference_cluster(matrix, threshold)
+
+    def test_empty(self):
+        """入力が空なら空の結果を返すこと"""
+        assert greedy_cluster(np.zeros((0, 4), dtype=np.float32), 0.5) == ([], [])
+
+    def test_progress_and_stop(self):
+        """進捗が通知され、停止要求で打ち切られること"""
+        matrix = _planted()
+        calls = []
+        greedy_cluster(matrix, 0.8, block_size=16, progress=lambda *a: calls.append(a))
+        assert calls[-1][0] == len(matrix)
+
+        groups, isolated = greedy_cluster(matrix, 0.8, block_size=16, should_stop=lambda: True)
+        assert groups == [] and isolated == []
+
+
+class TestSimilarityGraph:
+    """SimilarityGraph / greedy_cluster_graph のテスト"""
+
+    def test_edges_sorted_and_filtered(self):
+        """辺が降順に並び、しきい値で先頭部分が切り出されること"""
+        matrix = _planted()
+        graph = SimilarityGraph.build(matrix, 0.5, block_size=16)
+        assert np.all(np.diff(graph.scores) <= 0)
+        assert np.all(graph.rows < graph.cols)
+        rows, cols, scores = graph.edges(0.8)
+        assert np.all(scores >= np.float32(0.8))
+        assert len(scores) == int(np.sum(graph.scores >= np.float32(0.8)))
+
+    def test_recluster_matches_matrix(self):
+        """下限以上のしきい値ではグラフからの再クラスタリングが行列版と一致すること"""
+        matrix = _planted()
+        graph = SimilarityGraph.build(matrix, 0.5, block_size=16)
+        for threshold in (0.5, 0.7, 0.9):
+            assert graph.covers(threshold)
+            assert greedy_cluster_graph(graph, threshold) == greedy_cluster(matrix, threshold)
+        assert not graph.covers(0.4)
+
+    def test_active_mask(self):
+        """active で除いた行は無いものとして扱われること"""
+        matrix = _planted()
+        graph = SimilarityGraph.build(matrix, 0.6)
+        active = np.ones(len(matrix), dtype=bool)
+        active[::3] = False
+        kept = np.flatnonzero(active)
+        groups, isolated = greedy_cluster_graph(graph, 0.8, active=active)
+        ref_groups, ref_isolated = greedy_cluster(matrix[kept], 0.8)
+        assert groups == [[int(kept[i]) for i in g] for g in ref_groups]
+        assert isolated == [int(kept[i]) for i in ref_isolated]
+
+    def test_max_edges_raises_floor(self):
+        """辺数の上限を超えると下限が上がり、keep_threshold 以上の結果は変わらないこと"""
+        matrix = _planted()
+        full = SimilarityGraph.build(matrix, 0.3)
+        graph = SimilarityGraph.build(matrix, 0.3, keep_threshold=0.9, max_edges=200, block_size=8)
+        assert graph.floor > 0.3
+        assert len(graph) <= max(200, int(np.sum(full.scores >= np.float32(0.9))))
+        assert greedy_cluster_graph(graph, 0.9) == greedy_cluster_graph(full, 0.9)
+        assert greedy_cluster_graph(graph, graph.floor) == greedy_cluster_graph(full, graph.floor)
+
+    def test_stop_returns_none(self):
+        """停止要求があれば None を返すこと"""
+        assert SimilarityGraph.build(_planted(), 0.5, should_stop=lambda: True) is None
+
+
+def _reference_average(matrix, threshold):
+    """総当たりの平均連結法（平均類似度が最大の組から threshold 以上の間まとめる）"""
+    sim = normalize_rows(matrix) @ normalize_rows(matrix).T
+    clusters = [[i] for i in range(len(sim))]
+    while len(clusters) > 1:
+        best, pair = -np.inf, None
+        for a in range(len(clusters)):
+            for b in range(a + 1, len(clusters)):
+                s = sim[np.ix_(clusters[a], clusters[b])].mean()
+                if s > best:
+                    best, pair = s, (a, b)
+        if best < threshold:
+            break
+        a, b = pair
+        clusters[a] = clusters[a] + clusters.pop(b)
+    return sorted(sorted(c) for c in clusters if len(c) > 1)
+
+
+def _as_sets(groups):
+    return sorted(sorted(g) for g in groups)
+
+
+class TestClusteringEngines:
+    """ClusteringEngine 各手法のテスト"""
+
+    def test_components_matches_union_find(self):
+        """連結成分がしきい値以上の辺による成分と一致し、並び順に依存しないこと"""
+        matrix = _planted(noise=60)
+        graph = SimilarityGraph.build(matrix, 0.3)
+        groups, isolated = get_clustering_engine("components").cluster(graph, 0.55)
+
+        parent = list(range(len(matrix)))
+        def find(x):
+            while parent[x] != x:
+                x = parent[x]
+            return x
+        rows, cols, _ = graph.edges(0.55)
+        for r, c in zip(rows.tolist(), cols.tolist()):
+            parent[find(r)] = find(c)
+        comps = {}
+        for i in range(len(matrix)):
+            comps.setdefault(find(i), []).append(i)
+        assert _as_sets(groups) == _as_sets(c for c in comps.values() if len(c) > 1)
+        assert sorted(isolated) == sorted(c[0] for c in comps.values() if len(c) == 1)
+
+        perm = np.random.default_rng(1).permutation(len(matrix))
+        shuffled = SimilarityGraph.build(matrix[perm], 0.3)
+        groups2, _ = get_clustering_engine("components").cluster(shuffled, 0.55)
+        assert _as_sets([perm[i] for i in g] for g in groups2) == _as_sets(groups)
+
+    def test_average_matches_reference(self):
+        """平均連結が総当たりの実装と同じグループになること"""
+        matrix = _planted(n_clusters=4, per_cluster=6, noise=10, dim=8, seed=3)
+        graph = SimilarityGraph.build(matrix, 0.0)
+        for threshold in (0.3, 0.6, 0.85):
+            groups, isolated = get_clustering_engine("average").cluster(graph, threshold)
+            assert _as_sets(groups) == _reference_average(matrix, threshold)
+            assert len(isolated) + sum(len(g) for g in groups) == len(matrix)
+
+    def test_average_large_component_falls_back(self):
+        """上限を超える成分は貪欲法で分けられること"""
+        matrix = _planted()
+        graph = SimilarityGraph.build(matrix, 0.5)
+        engine = AverageLinkageClustering(max_component=5)
+        groups, isolated = engine.cluster(graph, 0.8)
+        assert _as_sets(groups) == _as_sets(greedy_cluster(matrix, 0.8)[0])
+
+    def test_density_core_border_noise(self):
+        """中心・境界・ノイズが DBSCAN と同じ扱いになること"""
+        # 0-1-2 は互いに近い中心、3 は 2 だけに近い境界、4 はノイズ
+        angles = np.deg2rad([0, 2, 4, 20, 90])
+        matrix = np.stack([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32)
+        graph = SimilarityGraph.build(matrix, 0.0)
+        threshold = float(np.cos(np.deg2rad(17)))
+        groups, isolated = DensityClustering(min_samples=3).cluster(graph, threshold)
+        assert _as_sets(groups) == [[0, 1, 2, 3]]
+        assert isolated == [4]
+
+    def test_representative_first_and_active(self):
+        """先頭が代表になり、active で除いた行は結果に含まれないこと"""
+        matrix = _planted()
+        graph = SimilarityGraph.build(matrix, 0.5)
+        active = np.ones(len(matrix), dtype=bool)
+        active[::4] = False
+        for key in CLUSTERING_ENGINES:
+            groups, isolated = get_clustering_engine(key).cluster(graph, 0.8, active=active)
+            seen = [i for g in groups for i in g] + list(isolated)
+            assert sorted(seen) == np.flatnonzero(active).tolist(), key
+            if key != "greedy":
+                for g in groups:
+                    sub = normalize_rows(matrix[g])
+                    assert g[0] == g[int(np.argmax(sub @ sub.sum(axis=0)))]
+
+    def test_benchmark(self):
+        """全手法の結果と所要時間が返ること"""
+        graph = SimilarityGraph.build(_planted(), 0.5)
+        results = benchmark_clustering(graph, 0.8)
+        assert [r["key"] for r in results] == list(CLUSTERING_ENGINES)
+        assert all(r["groups"] == 12 and r["seconds"] >= 0 for r in results)
+        assert get_clustering_engine("unknown").key == "greedy"
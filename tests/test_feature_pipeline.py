@@ -0,0 +1,190 @@
+'''
+test_feature_pipeline.py - ベクトル化パイプラインのテスト
+対象: lib/PicSorterGUIFeaturePipeline.py (FeaturePipeline)
+
+torch を使わず、偽の推論エンジンで読み込み段と推論段のつなぎ方を確かめる。
+'''
+import threading
+import time
+
+import numpy as np
+
+from lib.PicSorterGUIFeaturePipeline import FeaturePipeline
+
+
+class FakeEngine:
+    """load_tensor / infer_tensors / get_batch_size / _add_to_cache だけを持つ推論エンジンの代役"""
+
+    def __init__(self, batch_size=4, broken=()):
+        self.batch_size = batch_size
+        self.broken = set(broken)
+        self.loaded = []
+        self.batches = []
+        self.cached = {}
+        self._lock = threading.Lock()
+
+    def get_batch_size(self):
+        return self.batch_size
+
+    def load_tensor(self, path, thumbnail_key=None):
+        with self._lock:
+            self.loaded.append(path)
+        if path in self.broken:
+            raise OSError("broken image")
+        return path
+
+    def infer_tensors(self, tensors):
+        self.batches.append(list(tensors))
+        return [np.full(4, len(t), dtype=np.float32) for t in tensors]
+
+    def _add_to_cache(self, path, vec):
+        self.cached[path] = vec
+
+
+class FakeVectors:
+    """辞書で get / put だけを持つ VectorStore の代役"""
+
+    def __init__(self, stored=None):
+        self.data = dict(stored or {})
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def put(self, key, vec):
+        self.data[key] = vec
+
+
+def _items(n, prefix="p"):
+    return [(f"k{i}", f"{prefix}{i}") for i in range(n)]
+
+
+def _decode_threads():
+    return [t for t in threading.enumerate() if t.name.startswith("decode-") and t.is_alive()]
+
+
+class TestFeaturePipeline:
+    """FeaturePipeline の受け渡し・バッチ・背圧・中断・統計のテスト"""
+
+    def test_all_items_returned(self):
+        """保存済みは読み込まずに返し、新規分は推論して保存すること"""
+        stored = np.ones(4, dtype=np.float32)
+        engine = FakeEngine(batch_size=3)
+        vectors = FakeVectors({"k0": stored})
+        results = list(FeaturePipeline(engine, vectors, decode_workers=2).run(_items(7)))
+
+        by_key = {key: (path, vec, is_new) for key, path, vec, is_new in results}
+        assert sorted(by_key) == [f"k{i}" for i in range(7)]
+        assert by_key["k0"][1] is stored and by_key["k0"][2] is False
+        assert "p0" not in engine.loaded
+        for i in range(1, 7):
+            assert by_key[f"k{i}"][2] is True
+            assert f"k{i}" in vectors.data
+            assert f"p{i}" in engine.cached
+
+    def test_failures_pass_through(self):
+        """キーが None の項目と読み込みに失敗した画像は、ベクトル None で返すこと"""
+        engine = FakeEngine(batch_size=2, broken={"p1"})
+        items = [("k0", "p0"), ("k1", "p1"), (None, "nohash"), ("k3", "p3")]
+        results = list(FeaturePipeline(engine, FakeVectors(), decode_workers=1).run(items))
+
+        vecs = {path: vec for _, path, vec, _ in results}
+        assert len(results) == 4
+        assert vecs["p1"] is None and vecs["nohash"] is None
+        assert vecs["p0"] is not None and vecs["p3"] is not None
+        assert "nohash" not in engine.loaded
+
+    def test_batches_bounded(self):
+        """推論は batch_size 枚以下のバッチで行い、端数も最後に推論すること"""
+        engine = FakeEngine(batch_size=4)
+        results = list(FeaturePipeline(engine, FakeVectors(), decode_workers=2).run(_items(10)))
+
+        assert len(results) == 10
+        assert all(1 <= len(b) <= 4 for b in engine.batches)
+        assert sum(len(b) for b in engine.batches) == 10
+
+    def test_batch_size_from_engine(self):
+        """batch_size を省略するとエンジンの推奨値を使うこと"""
+        assert FeaturePipeline(FakeEngine(batch_size=16), FakeVectors()).batch_size == 16
+        assert FeaturePipeline(FakeEngine(batch_size=16), FakeVectors(), batch_size=5).batch_size == 5
+
+    def test_duplicate_keys_inferred_once(self):
+        """同じキーの画像がバッチ内に複数あっても 1 回だけ推論し、全員に結果を返すこと"""
+        engine = FakeEngine(batch_size=4)
+        items = [("same", "a"), ("same", "b"), ("other", "c"), ("same", "d")]
+        results = list(FeaturePipeline(engine, FakeVectors(), decode_workers=1).run(items))
+
+        assert engine.batches == [["a", "c"]]
+        assert sorted(path for _, path, vec, _ in results if vec is not None) == ["a", "b", "c", "d"]
+
+    def test_duplicate_keys_across_batches(self):
+        """同じキーの画像が別のバッチにまたがっても 1 回だけ読み込み・推論し、全員に結果を返すこと"""
+        engine = FakeEngine(batch_size=1, broken={"x1"})
+        items = [("same", "a"), ("other", "c"), ("same", "b"), ("bad", "x1"),
+                 ("same", "d"), ("bad", "x2")]
+        results = list(FeaturePipeline(engine, FakeVectors(), decode_workers=2).run(items))
+
+        assert sorted(engine.loaded) == ["a", "c", "x1"]
+        assert sorted(b[0] for b in engine.batches) == ["a", "c"]
+        vecs = {path: vec for _, path, vec, _ in results}
+        assert sorted(vecs) == ["a", "b", "c", "d", "x1", "x2"]
+        assert vecs["x1"] is None and vecs["x2"] is None  # 同じ内容なので読み込みも失敗扱い
+        for path in ("b", "d"):
+            np.testing.assert_array_equal(vecs[path], vecs["a"])
+            assert path in engine.cached
+
+    def test_batch_failure_continues(self):
+        """推論に失敗したバッチは全件 None で返し、以降のバッチは続けること"""
+        class FlakyEngine(FakeEngine):
+            def infer_tensors(self, tensors):
+                if not self.batches:
+                    self.batches.append(list(tensors))
+                    raise RuntimeError("out of memory")
+                return super().infer_tensors(tensors)
+
+        engine = FlakyEngine(batch_size=2)
+        results = list(FeaturePipeline(engine, FakeVectors(), decode_workers=1).run(_items(4)))
+
+        failed = [path for _, path, vec, _ in results if vec is None]
+        assert len(results) == 4
+        assert sorted(failed) == sorted(engine.batches[0])
+
+    def test_backpressure(self):
+        """推論段が止まっている間、読み込みはキューの上限を超えて先走らないこと"""
+        engine = FakeEngine(batch_size=2)
+        pipeline = FeaturePipeline(engine, FakeVectors(), decode_workers=2, queue_size=2)
+        gen = pipeline.run(_items(50))
+        next(gen)
+        time.sleep(0.3)  # 消費を止めている間に読み込みスレッドを走らせる
+        # 推論済み 2 枚 + キュー 2 枚 + 各スレッドが入れ待ちで抱える 1 枚
+        assert len(engine.loaded) <= 2 + 2 + 2
+        gen.close()
+        assert _decode_threads() == []
+
+    def test_should_stop_cancels(self):
+        """should_stop が真になったら途中で終わり、読み込みスレッドも止まること"""
+        stop = threading.Event()
+        engine = FakeEngine(batch_size=2)
+        pipeline = FeaturePipeline(engine, FakeVectors(), should_stop=stop.is_set,
+                                   decode_workers=2, queue_size=2)
+        results = []
+        for result in pipeline.run(_items(200)):
+            results.append(result)
+            if len(results) == 3:
+                stop.set()
+
+        assert len(results) < 200
+        assert len(engine.loaded) < 200
+        assert _decode_threads() == []
+
+    def test_stats_counts(self):
+        """統計は読み込んだ枚数（失敗を含む）と推論した枚数を数えること"""
+        engine = FakeEngine(batch_size=3, broken={"p2"})
+        vectors = FakeVectors({"k0": np.zeros(4, dtype=np.float32)})
+        pipeline = FeaturePipeline(engine, vectors, decode_workers=2)
+        list(pipeline.run(_items(8)))
+
+        assert pipeline.stats["decode"][0] == 7  # 保存済みの k0 は読み込まない
+        assert pipeline.stats["infer"][0] == 6   # 読み込みに失敗した p2 は推論しない
+        rates = pipeline.throughput()
+        assert set(rates) == {"decode", "infer"}
+        assert all(rate >= 0 for rate in rates.values())
@@ -0,0 +1,224 @@
+'''
+test_hash_index.py - ファイルハッシュ索引のテスト
+対象: lib/PicSorterGUIHashIndex.py
+'''
+import os
+
+from lib.PicSorterGUIHashIndex import HashIndex
+
+
+def _write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+class TestHashIndex:
+    """HashIndex の登録・参照テスト"""
+
+    def test_lookup_after_record(self, tmp_path):
+        """登録したハッシュが stat 一致時に引けること"""
+        index = HashIndex(str(tmp_path / "hash_index.tsv"))
+        f = _write(tmp_path / "a.jpg", b"aaaa")
+        assert index.lookup(f) is None
+        index.record(f, os.stat(f), "h1")
+        assert index.lookup(f) == "h1"
+
+    def test_modified_file_misses(self, tmp_path):
+        """サイズや更新時刻が変わったファイルは引けないこと"""
+        index = HashIndex(str(tmp_path / "hash_index.tsv"))
+        f = _write(tmp_path / "a.jpg", b"aaaa")
+        index.record(f, os.stat(f), "h1")
+        _write(tmp_path / "a.jpg", b"aaaaaa")
+        assert index.lookup(f) is None
+
+    def test_persisted_across_instances(self, tmp_path):
+        """flush 後に別インスタンスから引けること"""
+        path = str(tmp_path / "hash_index.tsv")
+        index = HashIndex(path)
+        f = _write(tmp_path / "a.jpg", b"aaaa")
+        index.record(f, os.stat(f), "h1")
+        assert index.flush() == 1
+
+        assert HashIndex(path).lookup(f) == "h1"
+
+    def test_torn_line_ignored(self, tmp_path):
+        """書き込み途中の行は無視され、次の保存で書き直されること"""
+        path = str(tmp_path / "hash_index.tsv")
+        index = HashIndex(path)
+        f = _write(tmp_path / "a.jpg", b"aaaa")
+        index.record(f, os.stat(f), "h1")
+        index.flush()
+        with open(path, "a", encoding="utf-8") as fh:
+            fh.write("1\t2\t3")
+
+        reopened = HashIndex(path)
+        assert len(reopened) == 1
+        g = _write(tmp_path / "b.jpg", b"bb")
+        reopened.record(g, os.stat(g), "h2")
+        reopened.flush()
+        assert len(HashIndex(path)) == 2
+
+    def test_algorithm_change_discards(self, tmp_path):
+        """ハッシュ方式が変わった索引は使わないこと"""
+        path = str(tmp_path / "hash_index.tsv")
+        index = HashIndex(path, algorithm="md5")
+        f = _write(tmp_path / "a.jpg", b"aaaa")
+        index.record(f, os.stat(f), "h1")
+        index.flush()
+
+        assert HashIndex(path, algorithm="other").lookup(f) is None
+
+    def test_record_move(self, tmp_path):
+        """移動後も移動先でハッシュが引けること"""
+        index = HashIndex(str(tmp_path / "hash_index.tsv"))
+        src = _write(tmp_path / "a.jpg", b"aaaa")
+        st = os.stat(src)
+        index.record(src, st, "h1")
+        os.makedirs(tmp_path / "sub")
+        dst = str(tmp_path / "sub" / "a.jpg")
+        os.rename(src, dst)
+        index.record_move(src, st, dst)
+        assert index.lookup(dst) == "h1"
+
+
+class TestIterFileHashes:
+    """iter_file_hashes の並列ハッシュ計算テスト"""
+
+    def test_hashes_match_blake2b(self, tmp_path, monkeypatch):
+        """全ファイルのハッシュが BLAKE2b と一致し、読めないファイルは None になること"""
+        import hashlib
+        from lib import PicSorterGUIData
+
+        monkeypatch.setattr(PicSorterGUIData.HashIndex, "_instance",
+                            HashIndex(str(tmp_path / "hash_index.tsv")))
+        paths = {}
+        for i in range(20):
+            data = bytes([i]) * (i * 1000 + 1)
+            paths[_write(tmp_path / f"{i}.jpg", data)] = "b:" + hashlib.blake2b(data, digest_size=15).hexdigest()
+        missing = str(tmp_path / "missing.jpg")
+
+        results = dict(PicSorterGUIData.iter_file_hashes(list(paths) + [missing], max_workers=4))
+        assert results.pop(missing) is None
+        assert results == paths
+
+        # 2 回目は索引から返る
+        assert dict(PicSorterGUIData.iter_file_hashes(list(paths))) == paths
+
+    def test_parallel_and_bounded(self, tmp_path, monkeypatch):
+        """max_workers 本まで同時に計算し、投入は max_workers の 2 倍までに抑えること"""
+        import threading
+        import time
+        from lib import PicSorterGUIData
+
+        monkeypatch.setattr(PicSorterGUIData.HashIndex, "_instance",
+                            HashIndex(str(tmp_path / "hash_index.tsv")))
+        lock = threading.Lock()
+        calls = []
+        active = [0, 0]  # 現在数, 最大数
+
+        def slow_hash(path, mode=None, size=None):
+            with lock:
+                calls.append(path)
+                active[0] += 1
+                active[1] = max(active[1], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return "b:" + os.path.basename(path)
+
+        monkeypatch.setattr(PicSorterGUIData, "_hash_file_contents", slow_hash)
+        paths = [_write(tmp_path / f"{i}.jpg", b"x") for i in range(30)]
+
+        results = PicSorterGUIData.iter_file_hashes(paths, max_workers=3)
+        next(results)
+        assert len(calls) <= 3 * 2 + 1  # 最初の完了分を補充した 1 件まで
+        rest = dict(results)
+        assert len(rest) == 29
+        assert 1 < active[1] <= 3
+
+
+class TestFileHashModes:
+    """ファイルキーの方式と旧 MD5 キーの引き継ぎテスト"""
+
+    def test_key_formats(self, tmp_path):
+        """どの方式もキー長が 32 文字で、方式ごとに接頭辞が付くこと"""
+        import hashlib
+        from lib.PicSorterGUIData import _hash_file_contents, FILE_HASH_SAMPLE_SIZE
+
+        small = _write(tmp_path / "small.jpg", b"abc")
+        large = _write(tmp_path / "large.jpg", b"x" * (FILE_HASH_SAMPLE_SIZE * 3))
+        assert _hash_file_contents(small, mode="md5") == hashlib.md5(b"abc").hexdigest()
+        assert _hash_file_contents(small, mode="blake2b").startswith("b:")
+        assert _hash_file_contents(small, mode="sampled") == _hash_file_contents(small, mode="blake2b")
+        assert _hash_file_contents(large, mode="sampled").startswith("s:")
+        for path in (small, large):
+            for mode in ("md5", "blake2b", "sampled"):
+                assert len(_hash_file_contents(path, mode=mode)) == 32
+
+    def test_sampled_collision_resolved(self, tmp_path, monkeypatch):
+        """先頭・末尾が同じで中身の違うファイルは別のキーになること"""
+        from lib import PicSorterGUIData
+
+        monkeypatch.setattr(PicSorterGUIData, "FILE_HASH_MODE", "sampled")
+        monkeypatch.setattr(PicSorterGUIData.HashIndex, "_instance",
+                            HashIndex(str(tmp_path / "hash_index.tsv"), algorithm="sampled"))
+        size = PicSorterGUIData.FILE_HASH_SAMPLE_SIZE
+        head, tail = b"h" * size, b"t" * size
+        a = _write(tmp_path / "a.jpg", head + b"A" * 100 + tail)
+        b = _write(tmp_path / "b.jpg", head + b"B" * 100 + tail)
+        c = _write(tmp_path / "c.jpg", head + b"A" * 100 + tail)
+
+        keys = dict(PicSorterGUIData.iter_file_hashes([a, b, c], max_workers=1))
+        assert keys[a] != keys[b]
+        assert keys[a] == keys[c]
+
+    def test_sampled_collision_across_runs(self, tmp_path, monkeypatch):
+        """別の実行や単体の計算でも、索引にある別ファイルとの衝突を全体ハッシュで区別すること"""
+        from lib import PicSorterGUIData
+
+        monkeypatch.setattr(PicSorterGUIData, "FILE_HASH_MODE", "sampled")
+        index_path = str(tmp_path / "hash_index.tsv")
+        monkeypatch.setattr(PicSorterGUIData.HashIndex, "_instance",
+                            HashIndex(index_path, algorithm="sampled"))
+        size = PicSorterGUIData.FILE_HASH_SAMPLE_SIZE
+        head, tail = b"h" * size, b"t" * size
+        a = _write(tmp_path / "a.jpg", head + b"A" * 100 + tail)
+        b = _write(tmp_path / "b.jpg", head + b"B" * 100 + tail)
+        c = _write(tmp_path / "c.jpg", head + b"C" * 100 + tail)
+
+        key_a = dict(PicSorterGUIData.iter_file_hashes([a]))[a]
+        assert key_a.startswith("s:")
+        key_b = dict(PicSorterGUIData.iter_file_hashes([b]))[b]
+        assert key_b.startswith("b:")
+        PicSorterGUIData.HashIndex.get_instance().close()
+
+        # 索引を開き直しても、どのファイルの指紋かは行から分かる
+        monkeypatch.setattr(PicSorterGUIData.HashIndex, "_instance",
+                            HashIndex(index_path, algorithm="sampled"))
+        key_c = PicSorterGUIData.calculate_file_hash(c)
+        assert key_c.startswith("b:") and key_c != key_b
+
+        # 索引に載ったファイルは全体を読み直さない
+        calls = []
+        monkeypatch.setattr(PicSorterGUIData, "_hash_file_contents",
+                            lambda *args, **kwargs: calls.append(args))
+        assert dict(PicSorterGUIData.iter_file_hashes([a, b, c])) == {a: key_a, b: key_b, c: key_c}
+        assert PicSorterGUIData.calculate_file_hash(a) == key_a
+        assert calls == []
+
+    def test_legacy_md5_vector_is_aliased(self, tmp_path, monkeypatch):
+        """MD5 キーで保存済みのベクトルが新しいキーで引けること"""
+        from lib import PicSorterGUIData
+        from lib.PicSorterGUIData import VectorStore
+
+        monkeypatch.setattr(PicSorterGUIData.HashIndex, "_instance",
+                            HashIndex(str(tmp_path / "hash_index.tsv")))
+        f = _write(tmp_path / "a.jpg", b"image-bytes")
+        store = VectorStore(str(tmp_path / "vectors"), legacy_json_path=None)
+        store.put(PicSorterGUIData.legacy_file_hash(f), [1.0, 2.0, 3.0])
+
+        key = PicSorterGUIData.calculate_file_hash(f)
+        assert key.startswith("b:")
+        assert key in store
+        assert store.get(key).tolist() == [1.0, 2.0, 3.0]
+        store.close()
@@ -0,0 +1,116 @@
+'''
+test_image_cache.py - 画像キャッシュのテスト
+対象: lib/PicSorterGUIImageCache.py (ImageCache)
+'''
+import os
+import threading
+
+from PIL import Image
+
+import lib.PicSorterGUIImageCache as image_cache_module
+from lib.PicSorterGUIImageCache import ImageCache
+
+
+def _save(tmp_path, name, size=(800, 600), color=(200, 100, 50)):
+    path = tmp_path / name
+    Image.new("RGB", size, color).save(path, "JPEG")
+    return str(path)
+
+
+def _cache(**kwargs):
+    # サムネイル保存の段階（64/128/192/320）を避け、ディスクに書かないようにする
+    kwargs.setdefault("buckets", (100, 400))
+    return ImageCache(**kwargs)
+
+
+def _count_decodes(monkeypatch):
+    calls = []
+    original = image_cache_module.open_image_reduced
+
+    def counting(path, size, fit="contain"):
+        calls.append((path, size))
+        return original(path, size, fit)
+
+    monkeypatch.setattr(image_cache_module, "open_image_reduced", counting)
+    return calls
+
+
+class TestImageCache:
+    """ImageCache の段階・派生画像・追い出し・統計のテスト"""
+
+    def test_variant_hit_returns_same_image(self, tmp_path, monkeypatch):
+        """同じサイズの 2 回目はデコードも縮小もせず同じ画像を返すこと"""
+        calls = _count_decodes(monkeypatch)
+        path = _save(tmp_path, "a.jpg")
+        cache = _cache()
+        first = cache.get(path, (300, 225))
+        second = cache.get(path, (300, 225))
+        assert first is second
+        assert first.size == (300, 225)
+        assert len(calls) == 1
+        stats = cache.get_stats()
+        assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    def test_sizes_share_bucket_base(self, tmp_path, monkeypatch):
+        """同じ段階に収まるサイズは基準画像を共有し、デコードは 1 回で済むこと"""
+        calls = _count_decodes(monkeypatch)
+        path = _save(tmp_path, "a.jpg")
+        cache = _cache()
+        img = cache.get(path, (300, 300), fit="contain")
+        assert img.size == (300, 225)
+        assert cache.get(path, (200, 150)).size == (200, 150)
+        assert cache.get(path, (80, 80), fit="contain").size == (80, 60)  # 別の段階
+        assert [size for _, size in calls] == [(400, 400), (100, 100)]
+
+    def test_eviction_counts_variants(self, tmp_path):
+        """派生画像もバイト数に数え、上限を超えたら古いものから追い出すこと"""
+        path = _save(tmp_path, "a.jpg")
+        cache = _cache(max_size_mb=1)
+        for side in range(200, 400, 20):
+            cache.get(path, (side, side))
+        stats = cache.get_stats()
+        assert cache.current_size_bytes == sum(n for _, n in cache.cache.values())
+        assert cache.current_size_bytes <= cache.max_size_bytes
+        assert stats["evictions"] > 0
+
+    def test_modified_file_is_reloaded(self, tmp_path):
+        """キーを渡さない場合、ファイルが変わったら読み直すこと"""
+        path = _save(tmp_path, "a.jpg", color=(255, 0, 0))
+        cache = _cache()
+        assert cache.get(path, (50, 50)).getpixel((10, 10))[0] > 200
+        _save(tmp_path, "a.jpg", color=(0, 0, 255))
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert cache.get(path, (50, 50)).getpixel((10, 10))[0] < 50
+
+    def test_concurrent_gets(self, tmp_path):
+        """複数スレッドから同時に読んでも合計バイト数が崩れないこと"""
+        paths = [_save(tmp_path, f"{i}.jpg") for i in range(8)]
+        cache = _cache(max_size_mb=2)
+        errors = []
+
+        def worker(offset):
+            try:
+                for i in range(40):
+                    cache.get(paths[(i + offset) % len(paths)], (100 + (i % 3) * 50,) * 2)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+        assert cache.current_size_bytes == sum(n for _, n in cache.cache.values())
+        assert cache.current_size_bytes <= cache.max_size_bytes
+
+    def test_preload(self, tmp_path):
+        """先読みした画像は、後の取得でキャッシュヒットになること"""
+        paths = [_save(tmp_path, f"{i}.jpg") for i in range(4)]
+        cache = _cache()
+        futures = cache.preload(paths, (90, 90), fit="contain")
+        assert all(f.result(timeout=10) for f in futures)
+        cache.get(paths[0], (90, 90), fit="contain")
+        assert cache.get_stats()["hits"] == 1
+        cache.shutdown()
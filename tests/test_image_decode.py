@@ -0,0 +1,44 @@
+'''
+test_image_decode.py - 縮小デコードのテスト
+対象: lib/PicSorterGUIImageCache.py (decode_reduced / open_image_reduced)
+'''
+from PIL import Image
+
+from lib.PicSorterGUIImageCache import open_image_reduced
+
+
+def _save(tmp_path, name, size, fmt):
+    path = tmp_path / name
+    Image.new("RGB", size, (200, 100, 50)).save(path, fmt)
+    return str(path)
+
+
+class TestOpenImageReduced:
+    """open_image_reduced の縮尺選択テスト"""
+
+    def test_jpeg_uses_draft(self, tmp_path):
+        """JPEG は枠を下回らない範囲で縮小デコードされること"""
+        path = _save(tmp_path, "a.jpg", (4000, 3000), "JPEG")
+        img = open_image_reduced(path, (180, 150))
+        assert img.width < 4000
+        assert img.width >= 180 or img.height >= 150
+        img.thumbnail((180, 150))
+        assert img.size == (180, 135)
+
+    def test_png_uses_reduce(self, tmp_path):
+        """JPEG 以外は reduce で整数分の1に縮小されること"""
+        path = _save(tmp_path, "a.png", (2000, 1000), "PNG")
+        img = open_image_reduced(path, (200, 200))
+        assert img.size == (200, 100)
+
+    def test_cover_keeps_short_side(self, tmp_path):
+        """cover は短辺が目標以上に保たれること"""
+        path = _save(tmp_path, "a.jpg", (4000, 3000), "JPEG")
+        img = open_image_reduced(path, (256, 256), fit="cover")
+        assert min(img.size) >= 256
+        assert img.width < 4000
+
+    def test_small_image_unchanged(self, tmp_path):
+        """目標より小さい画像はそのまま読み込まれること"""
+        path = _save(tmp_path, "a.png", (100, 80), "PNG")
+        assert open_image_reduced(path, (180, 150)).size == (100, 80)
@@ -0,0 +1,164 @@
+'''
+test_knn_graph.py - 近傍リスト（k 近傍グラフ）のテスト
+対象: lib/PicSorterGUIKNNGraph.py, VectorStore.neighbours / update_neighbours (lib/PicSorterGUIData.py)
+'''
+import numpy as np
+
+from lib.PicSorterGUIANNIndex import IVFIndex
+from lib.PicSorterGUIKNNGraph import NeighbourGraph, rank_neighbours
+from lib.PicSorterGUISimilarity import normalize_rows
+
+
+def _clustered(n=1000, dim=32, centers=20, seed=0):
+    rng = np.random.default_rng(seed)
+    c = rng.standard_normal((centers, dim))
+    m = c[rng.integers(0, centers, n)] + 0.4 * rng.standard_normal((n, dim))
+    return normalize_rows(m)
+
+
+def _keys(n, start=0):
+    return np.array([f"{i:032d}".encode() for i in range(start, start + n)], dtype="S32")
+
+
+def _exact_neighbours(m, k):
+    sims = m @ m.T
+    np.fill_diagonal(sims, -np.inf)
+    return np.argsort(-sims, axis=1, kind="stable")[:, :k], sims
+
+
+def _graph_rows(graph, keys):
+    return [graph.lookup(i, keys[i].decode())[0] for i in range(graph.count)]
+
+
+class TestRankNeighbours:
+    """rank_neighbours のテスト"""
+
+    def test_top_k_sorted_and_unique(self):
+        """重複と空きを除いた上位 k 件が降順で返ること"""
+        rows = np.array([[3, 5, 3, -1, 7]])
+        scores = np.array([[0.9, 0.5, 0.9, 1.0, 0.7]], dtype=np.float32)
+        out_rows, out_scores = rank_neighbours(rows, scores, 4)
+        assert out_rows.tolist() == [[3, 7, 5, -1]]
+        assert out_scores[0, :3].tolist() == [np.float32(0.9), np.float32(0.7), np.float32(0.5)]
+        assert out_scores[0, 3] == -np.inf
+
+
+class TestNeighbourGraph:
+    """NeighbourGraph の更新・保存・付け直しのテスト"""
+
+    def test_exact_matches_brute_force(self, tmp_path):
+        """少しずつ更新しても、全件から求めた上位 K 件と一致すること"""
+        m = _clustered()
+        keys = _keys(len(m))
+        graph = NeighbourGraph(str(tmp_path / "a.knn"), k=8)
+        # 既存行への逆向きの反映を通るよう、複数回に分けて追加する
+        graph.sync(keys[:300], m[:300])
+        graph.sync(keys, m, max_rows=400)
+        graph.sync(keys, m)
+        assert graph.count == len(m)
+
+        expected, sims = _exact_neighbours(m, 8)
+        for i, rows in enumerate(_graph_rows(graph, keys)):
+            # float16 で保存するため、同点付近の入れ替わりは類似度で比べる
+            np.testing.assert_allclose(np.sort(sims[i, rows]), np.sort(sims[i, expected[i]]), atol=2e-3)
+
+    def test_persisted(self, tmp_path):
+        """保存したリストを読み直して同じ近傍が得られ、続きから更新されること"""
+        m = _clustered()
+        keys = _keys(len(m))
+        path = str(tmp_path / "a.knn")
+        graph = NeighbourGraph(path, k=8)
+        graph.sync(keys, m, max_rows=600)
+        before = _graph_rows(graph, keys)
+        graph.close()
+
+        graph = NeighbourGraph(path, k=8)
+        assert graph.count == 600
+        for a, b in zip(before, _graph_rows(graph, keys)):
+            np.testing.assert_array_equal(a, b)
+        assert graph.sync(keys, m) == 400
+        assert graph.lookup(0, "0" * 32) is not None
+        assert graph.lookup(0, "x" * 32) is None
+        graph.close()
+
+    def test_remap_after_row_change(self, tmp_path):
+        """行番号が変わってもキーで近傍を引き継ぎ、同じ画像を指すこと"""
+        m = _clustered()
+        keys = _keys(len(m))
+        graph = NeighbourGraph(str(tmp_path / "a.knn"), k=8)
+        graph.sync(keys, m)
+        before = {keys[i]: {keys[r] for r in rows} for i, rows in enumerate(_graph_rows(graph, keys))}
+
+        # 先頭 100 行を取り除いたストア（コンパクション相当）
+        keys2, m2 = keys[100:], m[100:]
+        assert graph.sync(keys2, m2, max_rows=0) == 0
+        assert graph.count == len(keys2)
+        for i, rows in enumerate(_graph_rows(graph, keys2)):
+            assert {keys2[r] for r in rows} <= before[keys2[i]]
+
+    def test_approx_with_index(self, tmp_path):
+        """ANN 索引で求めた近傍が厳密な近傍を十分に含むこと"""
+        m = _clustered(n=3000)
+        keys = _keys(len(m))
+        index = IVFIndex(str(tmp_path / "a.ivf"))
+        index.sync(keys, m)
+        graph = NeighbourGraph(str(tmp_path / "a.knn"), k=10)
+        graph.sync(keys, m, index)
+
+        expected, _ = _exact_neighbours(m, 10)
+        hits = sum(len(set(rows.tolist()) & set(expected[i].tolist()))
+                   for i, rows in enumerate(_graph_rows(graph, keys)))
+        assert hits / expected.size >= 0.9
+
+
+class TestVectorStoreNeighbours:
+    """VectorStore.neighbours / update_neighbours のテスト"""
+
+    def _store(self, tmp_path, m):
+        from lib.PicSorterGUIData import VectorStore
+        store = VectorStore(str(tmp_path), legacy_json_path=None)
+        store.put_many((k.decode(), v) for k, v in zip(_keys(len(m)).tolist(), m))
+        store.flush()
+        return store
+
+    def test_neighbours_and_late_candidates(self, tmp_path):
+        """登録済みなら近傍を返し、後から追加した候補も採点して加えること"""
+        m = _clustered(n=500)
+        store = self._store(tmp_path, m)
+        keys = [k.decode() for k in _keys(len(m)).tolist()]
+        assert store.neighbours(keys[0]) is None
+        assert store.update_neighbours() == 500
+        assert (tmp_path / f"{store.namespace}.knn").exists()
+
+        results = store.neighbours(keys[0])
+        assert keys[0] not in dict(results)
+        assert [s for _, s in results] == sorted((s for _, s in results), reverse=True)
+
+        late = "y" * 32
+        store.put(late, m[0])  # 未保存で近傍リストにも無い
+        candidates = keys[:50] + [late]
+        found = dict(store.neighbours(keys[0], candidates))
+        assert set(found) <= set(candidates)
+        assert found[late] > 0.999
+        store.close()
+
+    def test_neighbours_plus_score_is_exact(self, tmp_path):
+        """近傍リストの結果に残りの候補の score() を合わせると、全候補の厳密な採点と一致すること"""
+        m = _clustered(n=600)
+        store = self._store(tmp_path, m)
+        keys = [k.decode() for k in _keys(len(m)).tolist()]
+        store.update_neighbours()
+
+        candidates = keys[1::3]  # 近傍リストの上位に入らない候補も多い
+        first = dict(store.neighbours(keys[0], candidates))
+        assert len(first) < len(candidates)
+        rest = store.score(store[keys[0]], [k for k in candidates if k not in first])
+        merged = {**first, **dict(rest)}
+
+        rows = np.array([keys.index(k) for k in candidates])
+        expected = dict(zip(candidates, (m[rows] @ m[0]).tolist()))
+        assert set(merged) == set(candidates)
+        for key, score in merged.items():
+            assert abs(score - expected[key]) < 1e-3  # 近傍リストのスコアは float16
+        assert [s for _, s in rest] == sorted((s for _, s in rest), reverse=True)
+        store.close()
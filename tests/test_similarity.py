@@ -0,0 +1,89 @@
+'''
+test_similarity.py - ベクトル類似度計算のテスト
+対象: lib/PicSorterGUISimilarity.py
+'''
+import numpy as np
+import pytest
+
+from lib.PicSorterGUIExceptions import VectorProcessingError
+from lib.PicSorterGUISimilarity import (
+    normalize_rows, build_candidate_matrix, similarity_scores, rank_by_similarity, select_top,
+)
+
+
+class TestNormalizeRows:
+    """normalize_rows のテスト"""
+
+    def test_unit_length(self):
+        """各行が長さ 1 の float32 連続行列になること"""
+        m = normalize_rows([[3.0, 4.0], [0.0, 2.0]])
+        assert m.dtype == np.float32
+        assert m.flags["C_CONTIGUOUS"]
+        assert np.allclose(np.linalg.norm(m, axis=1), 1.0)
+
+    def test_zero_row_stays_zero(self):
+        """ゼロベクトルの行はゼロのままであること"""
+        m = normalize_rows([[0.0, 0.0], [1.0, 1.0]])
+        assert np.all(m[0] == 0)
+
+
+class TestSimilarityScores:
+    """similarity_scores / rank_by_similarity のテスト"""
+
+    def test_matches_pairwise_cosine(self):
+        """ペアごとのコサイン類似度と一致すること"""
+        rng = np.random.default_rng(0)
+        query = rng.normal(size=16)
+        vecs = rng.normal(size=(20, 16))
+        scores = similarity_scores(query.tolist(), build_candidate_matrix(vecs.tolist()))
+        expected = vecs @ query / (np.linalg.norm(vecs, axis=1) * np.linalg.norm(query))
+        assert np.allclose(scores, expected, atol=1e-5)
+
+    def test_empty_candidates(self):
+        """候補が空なら空の配列を返すこと"""
+        scores = similarity_scores([1.0, 0.0], build_candidate_matrix([], 2))
+        assert scores.shape == (0,)
+
+    def test_dimension_mismatch(self):
+        """次元が異なる場合は VectorProcessingError になること"""
+        with pytest.raises(VectorProcessingError):
+            similarity_scores([1.0, 0.0, 0.0], build_candidate_matrix([[1.0, 0.0]]))
+
+    def test_rank_with_threshold(self):
+        """スコア降順で threshold 未満が除かれること"""
+        candidates = build_candidate_matrix([[0.0, 1.0], [1.0, 0.0], [1.0, 1.0]])
+        ranked = rank_by_similarity([1.0, 0.0], candidates, threshold=0.5)
+        assert [i for i, _ in ranked] == [1, 2]
+        assert ranked[0][1] == pytest.approx(1.0)
+
+    def test_rank_top_k(self):
+        """k 件に絞った結果が全件を並べた先頭 k 件と一致すること"""
+        rng = np.random.default_rng(1)
+        candidates = build_candidate_matrix(rng.normal(size=(200, 8)))
+        query = rng.normal(size=8)
+        full = rank_by_similarity(query, candidates)
+        assert rank_by_similarity(query, candidates, k=15) == full[:15]
+        assert rank_by_similarity(query, candidates, threshold=0.3, k=15) == [
+            r for r in full if r[1] >= 0.3][:15]
+
+
+class TestSelectTop:
+    """select_top のテスト"""
+
+    def test_matches_full_sort(self):
+        """しきい値・件数の組み合わせで、全体を安定ソートした結果と一致すること"""
+        scores = np.random.default_rng(2).random(500).astype(np.float32)
+        full = np.argsort(-scores, kind="stable")
+        np.testing.assert_array_equal(select_top(scores), full)
+        np.testing.assert_array_equal(select_top(scores, k=20), full[:20])
+        np.testing.assert_array_equal(select_top(scores, threshold=0.9), full[scores[full] >= 0.9])
+        np.testing.assert_array_equal(select_top(scores, k=10, threshold=0.95),
+                                      full[scores[full] >= 0.95][:10])
+
+    def test_ties_keep_index_order_and_edge_cases(self):
+        """同点は番号順で、k=0 や空の配列では空を返すこと"""
+        scores = np.array([0.5, 0.9, 0.5, 0.9, 0.1])
+        assert select_top(scores).tolist() == [1, 3, 0, 2, 4]
+        assert select_top(scores, k=3).tolist() == [1, 3, 0]
+        assert select_top(scores, k=0).tolist() == []
+        assert select_top(np.zeros(0), k=5).tolist() == []
@@ -0,0 +1,130 @@
+'''
+test_thumbnail_loader.py - サムネイル読み込み（作業スレッド → メインスレッド）のテスト
+対象: lib/PicSorterGUIThumbnailLoader.py
+'''
+import threading
+import time
+
+from lib.PicSorterGUIThumbnailLoader import ThumbnailLoader
+
+
+class FakeWidget:
+    """after() / bind() / nametowidget() だけを持つ Tk ウィジェットの代役"""
+
+    def __init__(self, name=".dialog"):
+        self.name = name
+        self.scheduled = []
+        self.bindings = {}
+
+    def __str__(self):
+        return self.name
+
+    def after(self, ms, func):
+        self.scheduled.append(func)
+        return len(self.scheduled)
+
+    def bind(self, sequence, func, add=None):
+        self.bindings.setdefault(sequence, []).append(func)
+
+    def nametowidget(self, name):
+        return self
+
+
+class FakeEvent:
+    def __init__(self, widget):
+        self.widget = widget
+
+
+def _run_scheduled(root, until, timeout=5.0):
+    """メインループの代わりに after() で予約された受け渡しを実行する"""
+    deadline = time.time() + timeout
+    while not until() and time.time() < deadline:
+        while root.scheduled:
+            root.scheduled.pop(0)()
+        time.sleep(0.005)
+
+
+def _loader(load, **kwargs):
+    kwargs.setdefault("workers", 1)
+    return ThumbnailLoader(load=load, make_photo=lambda img: ("photo", img), **kwargs)
+
+
+class TestThumbnailLoader:
+    """ThumbnailLoader の優先度・取り消し・受け渡しのテスト"""
+
+    def test_priority_order(self):
+        """待ち行列にある依頼は優先度の小さい順に読み込むこと"""
+        gate = threading.Event()
+        loaded = []
+
+        def load(path, size, key):
+            if path == "first":
+                gate.wait(5)
+            loaded.append(path)
+            return path
+
+        root = FakeWidget()
+        loader = _loader(load)
+        results = []
+        loader.request(root, "first", (64, 64), results.append)
+        time.sleep(0.05)  # 作業スレッドが first を取り出すのを待つ
+        for path, priority in (("low", 5), ("high", 0), ("mid", 2)):
+            loader.request(root, path, (64, 64), results.append, priority=priority)
+        gate.set()
+        _run_scheduled(root, lambda: len(results) == 4)
+        loader.shutdown()
+
+        assert loaded == ["first", "high", "mid", "low"]
+        assert results[0] == ("photo", "first")
+
+    def test_cancel_on_owner_destroy(self):
+        """依頼元が破棄されたら、読み込み前の依頼はデコードもコールバックもしないこと"""
+        gate = threading.Event()
+        loaded = []
+
+        def load(path, size, key):
+            gate.wait(5)
+            loaded.append(path)
+            return path
+
+        root = FakeWidget(".")
+        dialog = FakeWidget(".dialog")
+        loader = _loader(load)
+        loader._root = root
+        results = []
+        loader.request(dialog, "a", (64, 64), results.append)
+        time.sleep(0.05)
+        job_b = loader.request(dialog, "b", (64, 64), results.append)
+        for handler in dialog.bindings["<Destroy>"]:
+            handler(FakeEvent(dialog))
+        assert job_b.cancelled
+        gate.set()
+        _run_scheduled(root, lambda: loader._pending == 0)
+        loader.shutdown()
+
+        assert loaded == ["a"]
+        assert results == []
+
+    def test_batch_limit_and_failure(self):
+        """1 回の受け渡しは batch 件までで、読み込めなければ None を渡すこと"""
+        def load(path, size, key):
+            if path == "bad":
+                raise OSError("broken")
+            return path
+
+        root = FakeWidget()
+        loader = _loader(load, batch=2)
+        results = []
+        for path in ("a", "bad", "c"):
+            loader.request(root, path, (64, 64), results.append)
+        deadline = time.time() + 5
+        while len(loader._done) < 3 and time.time() < deadline:
+            time.sleep(0.005)
+
+        root.scheduled.pop(0)()
+        assert results == [("photo", "a"), None]
+        assert len(root.scheduled) == 1  # 残りのために次の受け渡しを予約する
+        root.scheduled.pop(0)()
+        assert results[-1] == ("photo", "c")
+        assert root.scheduled == []
+        loader.shutdown()
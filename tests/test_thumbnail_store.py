@@ -0,0 +1,85 @@
+'''
+test_thumbnail_store.py - サムネイル保存のテスト
+対象: lib/PicSorterGUIThumbnailStore.py
+'''
+import os
+
+from PIL import Image
+
+import lib.PicSorterGUIThumbnailStore as thumbnail_module
+from lib.PicSorterGUIThumbnailStore import ThumbnailStore, RECORD_SIZE
+
+
+def _image(path, size=(400, 300), color=(200, 30, 30)):
+    Image.new("RGB", size, color).save(path, format="JPEG")
+    return str(path)
+
+
+def _store(tmp_path, **kwargs):
+    return ThumbnailStore(str(tmp_path / "thumbnails"), **kwargs)
+
+
+class TestThumbnailStore:
+    """ThumbnailStore の保存・参照・作り直しのテスト"""
+
+    def test_bucket_for(self, tmp_path):
+        """表示サイズを収める最小の段階を選び、最大を超えれば None になること"""
+        store = _store(tmp_path, buckets=(64, 192))
+        assert store.bucket_for((50, 50)) == 64
+        assert store.bucket_for((180, 150)) == 192
+        assert store.bucket_for((300, 300)) is None
+
+    def test_lazy_fill_then_no_decode(self, tmp_path, monkeypatch):
+        """初回だけ元画像をデコードし、2 回目以降と再オープン後は保存分を使うこと"""
+        src = _image(tmp_path / "a.jpg")
+        calls = []
+        original = thumbnail_module.open_image_reduced
+
+        def counting(path, size, fit="contain"):
+            calls.append(path)
+            return original(path, size, fit)
+
+        monkeypatch.setattr(thumbnail_module, "open_image_reduced", counting)
+        store = _store(tmp_path)
+        first = store.thumbnail(src, (180, 150), key="b:aaa")
+        assert max(first.size) <= 180 and first.height <= 150
+        second = store.thumbnail(src, (64, 64), key="b:aaa")
+        assert max(second.size) <= 64
+        store.thumbnail(src, (180, 150), key="b:aaa")
+        assert len(calls) == 2  # 192 と 64 の段階を 1 回ずつ作っただけ
+        store.close()
+
+        store = _store(tmp_path)
+        img = store.thumbnail(src, (180, 150), key="b:aaa")
+        assert len(calls) == 2
+        assert abs(img.getpixel((10, 10))[0] - 200) < 20
+        store.close()
+
+    def test_add_from_image(self, tmp_path):
+        """デコード済み画像から、大きさの足りる段階だけ作ること"""
+        store = _store(tmp_path)
+        store.add_from_image("b:k", Image.new("RGB", (100, 80)), buckets=(64, 192))
+        assert ("b:k", 64) in store
+        assert ("b:k", 192) not in store
+        assert max(store.get("b:k", 64).size) == 64
+
+    def test_truncated_index_record_ignored(self, tmp_path):
+        """書きかけの末尾レコードは無視して読み込めること"""
+        store = _store(tmp_path)
+        store.put("b:1", 64, Image.new("RGB", (64, 48)))
+        store.put("b:2", 64, Image.new("RGB", (64, 48)))
+        store.close()
+        with open(store.index_path, "r+b") as f:
+            f.truncate(os.path.getsize(store.index_path) - RECORD_SIZE // 2)
+
+        store = _store(tmp_path)
+        assert len(store) == 1
+        assert store.get("b:1", 64) is not None
+
+    def test_reset_when_over_limit(self, tmp_path):
+        """パックが上限を超えたら空にして作り直すこと"""
+        store = _store(tmp_path, max_bytes=1)
+        store.put("b:1", 64, Image.new("RGB", (64, 64)))
+        store.put("b:2", 64, Image.new("RGB", (64, 64)))
+        assert ("b:1", 64) not in store
+        assert store.get("b:2", 64) is not None
@@ -0,0 +1,307 @@
+'''
+test_vector_store.py - バイナリベクトルストアのテスト
+対象: lib/PicSorterGUIVectorStore.py
+'''
+import json
+import numpy as np
+import pytest
+
+from lib.PicSorterGUIVectorStore import VectorFile, migrate_json_vectors, HEADER_SIZE
+from lib.PicSorterGUIExceptions import VectorProcessingError
+from lib.config_defaults import VECTOR_PREPROCESS_VERSION
+
+
+def _vec(seed, dim=8):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal(dim).astype(np.float32).tolist()
+
+
+class TestVectorFile:
+    """VectorFile の読み書きテスト"""
+
+    def test_empty_store(self, tmp_path):
+        """ファイルが無い場合は空として扱えること"""
+        store = VectorFile(str(tmp_path / "vectors"))
+        assert not store.exists()
+        assert len(store) == 0
+        assert "abc" not in store
+
+    def test_flush_and_reopen(self, tmp_path):
+        """追加したベクトルが保存後に再オープンで読めること"""
+        base = str(tmp_path / "vectors")
+        store = VectorFile(base)
+        store["a" * 32] = _vec(1)
+        store["b" * 32] = _vec(2)
+        assert store.flush() == 2
+
+        reopened = VectorFile(base)
+        assert reopened.count == 2
+        assert reopened.dim == 8
+        np.testing.assert_allclose(reopened["a" * 32], _vec(1), rtol=1e-6)
+        np.testing.assert_allclose(reopened["b" * 32], _vec(2), rtol=1e-6)
+
+    def test_flush_keeps_existing_rows(self, tmp_path):
+        """既存行を残したまま新規分を追加できること"""
+        base = str(tmp_path / "vectors")
+        store = VectorFile(base)
+        store["a" * 32] = _vec(1)
+        store.flush()
+        store["c" * 32] = _vec(3)
+        store.flush()
+
+        reopened = VectorFile(base)
+        assert sorted(reopened.keys()) == ["a" * 32, "c" * 32]
+
+    def test_flush_appends_only_new_rows(self, tmp_path):
+        """2回目以降の保存は末尾への追記になること"""
+        base = str(tmp_path / "vectors")
+        store = VectorFile(base)
+        store["a" * 32] = _vec(1)
+        store.flush()
+        size_before = store.file_size()
+        store["c" * 32] = _vec(3)
+        store.flush()
+        assert store.file_size() - size_before == 8 * 4 + 32
+
+    def test_overwrite_and_compact(self, tmp_path):
+        """同じキーの再追加は後の行が優先され、コンパクションで不要行が消えること"""
+        base = str(tmp_path / "vectors")
+        store = VectorFile(base)
+        store["a" * 32] = _vec(1)
+        store["b" * 32] = _vec(2)
+        store.flush()
+        store["a" * 32] = _vec(9)
+        store.flush()
+        assert store.count == 3
+        assert store.dead_rows() == 1
+        np.testing.assert_allclose(store["a" * 32], _vec(9), rtol=1e-6)
+
+        assert store.compact() == 1
+        reopened = VectorFile(base)
+        assert reopened.count == 2
+        np.testing.assert_allclose(reopened["a" * 32], _vec(9), rtol=1e-6)
+        np.testing.assert_allclose(reopened["b" * 32], _vec(2), rtol=1e-6)
+
+    def test_values_are_float32_row_copies(self, tmp_path):
+        """未保存・保存済みどちらも float32 の 1 行分のコピーで返り、リストに変換されないこと"""
+        base = str(tmp_path / "vectors")
+        store = VectorFile(base)
+        for i in range(100):
+            store[f"{i:032d}"] = _vec(i)
+        pending = store["0" * 32]
+        assert isinstance(pending, np.ndarray) and pending.dtype == np.float32
+        store.flush()
+
+        saved = store["0" * 32]
+        assert saved.dtype == np.float32 and saved.shape == (8,)
+        assert not np.shares_memory(saved, store.matrix())
+        np.testing.assert_allclose(pending, saved)
+
+    def test_flush_extends_index(self, tmp_path):
+        """追記で索引を作り直さず、追記した行だけを足すこと"""
+        store = VectorFile(str(tmp_path / "vectors"))
+        for i in range(10):
+            store[f"{i:032d}"] = _vec(i)
+        store.flush()
+        index = store._ensure_index()
+        store[f"{1:032d}"] = _vec(99)
+        store["x" * 32] = _vec(100)
+        store.flush()
+
+        assert store._index is index
+        assert store.row_of("x" * 32) == 11
+        assert store.row_of(f"{1:032d}") == 10
+        assert store.dead_rows() == 1
+        assert VectorFile(store.base_path)._ensure_index() == index
+
+    def test_compact_while_rows_held(self, tmp_path):
+        """取り出したベクトルを持ったままでも、古い mmap を閉じて置き換えられること"""
+        store = VectorFile(str(tmp_path / "vectors"))
+        store["a" * 32] = _vec(1)
+        store["b" * 32] = _vec(2)
+        store.flush()
+        store["a" * 32] = _vec(9)
+        store.flush()
+        held = store["a" * 32]
+        old_maps = (store._vec_mm, store._keys_mm)
+
+        assert store.compact() == 1
+        assert all(mm.closed for mm in old_maps)
+        np.testing.assert_allclose(held, _vec(9), rtol=1e-6)
+        assert store.count == 2
+
+    def test_compact_deferred_while_matrix_in_use(self, tmp_path):
+        """行列のビューが使用中ならコンパクションを見送り、手放した後に実行すること"""
+        store = VectorFile(str(tmp_path / "vectors"))
+        store["a" * 32] = _vec(1)
+        store.flush()
+        store["a" * 32] = _vec(9)
+        store.flush()
+        matrix = store.matrix()
+
+        assert store.compact() == 0
+        assert store.count == 2
+        assert not (tmp_path / "vectors.vec.compact").exists()
+        np.testing.assert_allclose(store["a" * 32], _vec(9), rtol=1e-6)
+        del matrix
+        assert store.compact() == 1
+        assert store.count == 1
+
+    @pytest.mark.parametrize("replace", ["write_all", "clear"])
+    def test_compact_aborted_when_store_replaced(self, tmp_path, monkeypatch, replace):
+        """書き出し中に write_all() / clear() があれば、古い内容で上書きせず中止すること"""
+        import lib.PicSorterGUIVectorStore as vector_store
+        store = VectorFile(str(tmp_path / "vectors"))
+        store["a" * 32] = _vec(1)
+        store["b" * 32] = _vec(2)
+        store.flush()
+        store["a" * 32] = _vec(9)
+        store.flush()
+
+        pack_header = vector_store._pack_header
+        fired = []
+
+        def replace_during_copy(*args):
+            # compact() が一時ファイルを書き始めたところで、ストアを置き換える
+            if not fired:
+                fired.append(True)
+                if replace == "write_all":
+                    store.write_all({"c" * 32: _vec(3)})
+                else:
+                    store.clear()
+            return pack_header(*args)
+
+        monkeypatch.setattr(vector_store, "_pack_header", replace_during_copy)
+        assert store.compact() == 0
+        assert not (tmp_path / "vectors.vec.compact").exists()
+        if replace == "write_all":
+            assert list(store.keys()) == ["c" * 32]
+            np.testing.assert_allclose(store["c" * 32], _vec(3), rtol=1e-6)
+        else:
+            assert len(store) == 0
+            assert not store.exists()
+
+    def test_truncated_tail_is_ignored(self, tmp_path):
+        """書き込み途中の行は無視されること"""
+        base = str(tmp_path / "vectors")
+        store = VectorFile(base)
+        store["a" * 32] = _vec(1)
+        store.flush()
+        store.close()
+        with open(base + ".vec", "ab") as f:
+            f.write(b"\x00" * 5)
+
+        reopened = VectorFile(base)
+        assert reopened.count == 1
+        reopened["b" * 32] = _vec(2)
+        reopened.flush()
+        assert VectorFile(base).count == 2
+
+    def test_dimension_mismatch_skipped(self, tmp_path):
+        """次元の異なるベクトルは書き込まれないこと"""
+        store = VectorFile(str(tmp_path / "vectors"))
+        written = store.write_all({"a" * 32: _vec(1, 8), "b" * 32: _vec(2, 4)})
+        assert written == 1
+        assert "b" * 32 not in store
+
+    def test_invalid_file_raises(self, tmp_path):
+        """不正なヘッダは VectorProcessingError になること"""
+        base = str(tmp_path / "vectors")
+        for ext in (".vec", ".keys"):
+            with open(base + ext, "wb") as f:
+                f.write(b"X" * HEADER_SIZE)
+        with pytest.raises(VectorProcessingError):
+            VectorFile(base)
+
+
+class TestMigrateJsonVectors:
+    """旧 vectordata.json からの移行テスト"""
+
+    def test_migrate(self, tmp_path):
+        json_path = tmp_path / "vectordata.json"
+        data = {"a" * 32: _vec(1), "b" * 32: _vec(2)}
+        json_path.write_text(json.dumps(data), encoding="utf-8")
+
+        store = VectorFile(str(tmp_path / "vectors"))
+        assert migrate_json_vectors(str(json_path), store) == 2
+        assert not json_path.exists()
+        assert (tmp_path / "vectordata.json.migrated").exists()
+        np.testing.assert_allclose(store["b" * 32], data["b" * 32], rtol=1e-6)
+
+
+class TestVectorStoreSingleton:
+    """共有 VectorStore のテスト"""
+
+    def test_put_and_flush(self, tmp_path):
+        """put した内容は flush まで未保存として保持されること"""
+        from lib.PicSorterGUIData import VectorStore
+
+        store = VectorStore(str(tmp_path), legacy_json_path=None)
+        store.put("a" * 32, _vec(1))
+        assert store.is_dirty()
+        assert "a" * 32 in store
+        assert store.flush() == 1
+        assert not store.is_dirty()
+        assert store.flush() == 0
+        store.close()
+
+        assert VectorFile(str(tmp_path / store.namespace)).count == 1
+
+    def test_close_flushes_pending(self, tmp_path):
+        """close 時に未保存分が書き出されること"""
+        from lib.PicSorterGUIData import VectorStore
+
+        store = VectorStore(str(tmp_path), legacy_json_path=None)
+        store.put_many([("a" * 32, _vec(1)), ("b" * 32, _vec(2))])
+        store.close()
+
+        assert VectorFile(str(tmp_path / store.namespace)).count == 2
+
+    def test_models_are_separated(self, tmp_path):
+        """モデルごとに別の格納先となり、切り替えても他モデルのベクトルが残ること"""
+        from lib.PicSorterGUIData import VectorStore
+
+        store = VectorStore(str(tmp_path), legacy_json_path=None)
+        store.use_model("mobilenet_v3_small")
+        store.put("a" * 32, _vec(1, 1024))
+        store.use_model("resnet50")
+        assert "a" * 32 not in store
+        store.put("a" * 32, _vec(2, 2048))
+        store.flush()
+
+        store.use_model("mobilenet_v3_small")
+        assert len(store["a" * 32]) == 1024
+        store.close()
+        v = VECTOR_PREPROCESS_VERSION
+        assert sorted(p.name for p in tmp_path.glob("*.vec")) == [
+            f"mobilenet_v3_small-v{v}.vec", f"resnet50-v{v}.vec"]
+
+    def test_bound_store_survives_model_switch(self, tmp_path):
+        """bind() した窓口は、後で現在のモデルを切り替えても開始時の格納先に書き込むこと"""
+        from lib.PicSorterGUIData import VectorStore
+
+        store = VectorStore(str(tmp_path), legacy_json_path=None)
+        store.use_model("mobilenet_v3_small")
+        bound = store.bind()
+        store.use_model("resnet50")
+        bound.put("a" * 32, _vec(1, 1024))
+        assert "a" * 32 in bound
+        assert "a" * 32 not in store
+        assert store.bind("mobilenet_v3_small").namespace == bound.namespace
+
+        store.use_model("mobilenet_v3_small")
+        assert len(store["a" * 32]) == 1024
+        store.close()
+
+    def test_legacy_json_goes_to_matching_model(self, tmp_path):
+        """旧 vectordata.json は次元の一致するモデルの格納先へ移行されること"""
+        from lib.PicSorterGUIData import VectorStore
+
+        json_path = tmp_path / "vectordata.json"
+        json_path.write_text(json.dumps({"a" * 32: _vec(1, 2048)}), encoding="utf-8")
+
+        store = VectorStore(str(tmp_path / "vectors"), legacy_json_path=str(json_path))
+        assert "a" * 32 not in store
+        store.use_model("resnet50")
+        assert "a" * 32 in store
+        store.close()
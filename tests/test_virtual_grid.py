@@ -0,0 +1,28 @@
+'''
+test_virtual_grid.py - 仮想化グリッドのテスト
+対象: lib/PicSorterGUIVirtualGrid.py
+'''
+from lib.PicSorterGUIVirtualGrid import visible_rows
+
+
+class TestVisibleRows:
+    """visible_rows（表示範囲に掛かる行の計算）のテスト"""
+
+    def test_top_of_list(self):
+        """先頭では手前に広げず、表示範囲の後ろに余分の行を足すこと"""
+        assert visible_rows(0, 600, 230, 100, overscan=2) == (0, 5)
+
+    def test_scrolled_partial_rows(self):
+        """途中まで見えている行も含め、前後に余分の行を足すこと"""
+        # 500〜1100 は行 2（460〜690）から行 4（920〜1150）まで
+        assert visible_rows(500, 600, 230, 100, overscan=1) == (1, 6)
+        assert visible_rows(500, 600, 230, 100, overscan=0) == (2, 5)
+
+    def test_clamped_to_row_count(self):
+        """末尾では行数を超えないこと"""
+        assert visible_rows(2000, 600, 230, 10, overscan=2) == (6, 10)
+
+    def test_empty(self):
+        """項目が無い・表示前（高さ 0）なら空の範囲になること"""
+        assert visible_rows(0, 600, 230, 0) == (0, 0)
+        assert visible_rows(0, 0, 230, 10) == (0, 0)